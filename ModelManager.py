@@ -1,35 +1,174 @@
-from typing import List, Dict
-from llm_client import GeminiClient
+import asyncio
+from collections import deque
+from typing import List, Dict, Optional, Any
+from llm_client import create_llm_client
+from cassette import Cassette, CassetteMiss
+from limiter import (
+    LimiterRegistry, LatencySLO, LoadShedError, is_rate_limit_error, current_priority,
+    SUCCESS, RATE_LIMITED, ERROR, INTERACTIVE, BACKGROUND, PRIORITIES
+)
+from metrics import LLM_REQUEST_SECONDS, LLM_REQUESTS, LLM_FALLBACK_DEPTH, LLM_QUEUE_WAIT_SECONDS, LLM_SHED
+from tracing import span, traced
 import logging
+import time
 logger = logging.getLogger(__name__)
 
+FALLBACK_RESPONSE = "Извините, я временно не могу ответить. Попробуйте позже."
+
+
+class LLMUnavailableError(Exception):
+    """Ни одна модель не ответила (или промах кассеты при воспроизведении), а заглушка вызывающему не подходит"""
+
 
 class ModelManager:
-    def __init__(self, task_models: Dict[str, List[str]], api_keys: List[str]):
+    def __init__(self, task_models: Dict[str, List[str]], api_keys: List[str],
+                 limiters: Optional[LimiterRegistry] = None, backend: str = "gemini",
+                 client_options: Optional[Dict[str, Any]] = None, cassette: Optional[Cassette] = None,
+                 interactive_slo: float = 5.0, shed_wait: float = 10.0):
         self.task_models = task_models
         self.api_keys = api_keys
+        self.backend = backend
+        self.client_options = client_options or {}
+        # Запись успешных вызовов в кассету или воспроизведение ответов из неё вместо вызова модели
+        self.cassette = cassette
         self.current_key_index = 0
         self._clients_cache = {}
+        self.limiters = limiters or LimiterRegistry()
+        # Вызовы идут с приоритетом из контекста (limiter.current_priority); фоновые откладываются
+        # и отбрасываются, пока интерактивные вызовы не укладываются в SLO
+        self.slo = LatencySLO(interactive_slo)
+        self.shed_wait = shed_wait
+        self._queue_waits: Dict[str, deque] = {p: deque(maxlen=200) for p in PRIORITIES}
+        self._shed = 0
 
     def _get_client(self, model: str, key: str):
         cache_key = (model, key)
         if cache_key not in self._clients_cache:
-            self._clients_cache[cache_key] = GeminiClient(model_name=model, api_key=key)
+            self._clients_cache[cache_key] = create_llm_client(self.backend, model, key, **self.client_options)
         return self._clients_cache[cache_key]
 
-    async def generate_with_fallback(self, task: str, prompt: str, system_message: str = "") -> str:
+    async def _call(self, task: str, model: str, key_index: int, prompt: str, system_message: str):
+        """Один вызов модели под лимитом пары (модель, ключ); слот уже занят вызывающим"""
+        limiter = self.limiters.for_key(model, key_index)
+        start = time.perf_counter()
+        try:
+            client = self._get_client(model, self.api_keys[key_index])
+            with span("llm.call", model=model, key=key_index):
+                result = await client.generate(prompt, system_message)
+        except Exception as e:
+            outcome = RATE_LIMITED if is_rate_limit_error(e) else ERROR
+            limiter.release(outcome)
+            self._observe(task, model, key_index, outcome, start)
+            raise
+        limiter.release(SUCCESS)
+        self._observe(task, model, key_index, SUCCESS, start)
+        if self.cassette is not None:
+            self.cassette.record(task, prompt, system_message, result, time.perf_counter() - start, model)
+        return result
+
+    @staticmethod
+    def _observe(task: str, model: str, key_index: int, outcome: str, start: float):
+        # Ключи API не раскрываются: в метках только индекс ключа
+        LLM_REQUEST_SECONDS.labels(task, model, key_index).observe(time.perf_counter() - start)
+        LLM_REQUESTS.labels(task, model, key_index, outcome).inc()
+
+    def _background_blocked(self) -> bool:
+        return self.slo.at_risk() or self.limiters.global_limiter.waiting(INTERACTIVE) > 0
+
+    async def _admit_background(self, task: str):
+        """Отложить фоновый вызов, пока интерактивные под угрозой; не дождавшись за shed_wait — отбросить"""
+        if not self._background_blocked():
+            return
+        deadline = time.monotonic() + self.shed_wait
+        with span("llm.deferred", task=task):
+            while self._background_blocked():
+                if time.monotonic() >= deadline:
+                    self._shed += 1
+                    LLM_SHED.labels(task).inc()
+                    raise LoadShedError(f"Background {task} call shed: interactive LLM latency over SLO")
+                await asyncio.sleep(0.05)
+
+    @traced("llm.generate_with_fallback")
+    async def generate_with_fallback(self, task: str, prompt: str, system_message: str = "",
+                                     raise_on_failure: bool = False) -> str:
+        """
+        Ответ первой сработавшей пары (модель, ключ) из цепочки задачи. Если ответа нет — FALLBACK_RESPONSE,
+        а с raise_on_failure — LLMUnavailableError (когда заглушку нельзя принять за ответ, как при суммаризации).
+        """
         models = self.task_models.get(task, self.task_models["response"])
-        for model in models:
-            for key in self.api_keys:
+        priority = current_priority()
+        if priority == BACKGROUND:
+            await self._admit_background(task)
+        global_limiter = self.limiters.global_limiter
+        start = time.perf_counter()
+        with span("llm.limiter_wait", task=task, priority=priority):
+            await global_limiter.acquire(priority)
+        wait = time.perf_counter() - start
+        LLM_QUEUE_WAIT_SECONDS.labels(priority).observe(wait)
+        self._queue_waits[priority].append(wait)
+        outcome = ERROR
+        attempted = 0
+        try:
+            if self.cassette is not None and self.cassette.replaying:
+                # Воспроизведение полностью офлайн: промах не превращается в живой вызов модели
+                try:
+                    with span("llm.replay", task=task):
+                        result = await self.cassette.replay(task, prompt, system_message)
+                except CassetteMiss as e:
+                    logger.warning(f"Cassette miss: {e}")
+                    if raise_on_failure:
+                        raise LLMUnavailableError(str(e)) from e
+                    return FALLBACK_RESPONSE
+                outcome = SUCCESS
+                return result
+            for model in models:
+                for key_index in range(len(self.api_keys)):
+                    # Пары, исчерпавшие свой лимит, пропускаются — сразу идём дальше по цепочке
+                    if not self.limiters.for_key(model, key_index).try_acquire(priority):
+                        continue
+                    attempted += 1
+                    try:
+                        result = await self._call(task, model, key_index, prompt, system_message)
+                        logger.info(f"Success with model {model}...")
+                        outcome = SUCCESS
+                        return result
+                    except Exception as e:
+                        if is_rate_limit_error(e):
+                            outcome = RATE_LIMITED
+                        continue
+            if not attempted and models and self.api_keys:
+                # Все пары заняты: ждём слот у первой модели цепочки
+                with span("llm.limiter_wait", task=task, model=models[0]):
+                    await self.limiters.for_key(models[0], 0).acquire(priority)
                 try:
-                    client = self._get_client(model, key)
-                    result = await client.generate(prompt, system_message)
-                    logger.info(f"Success with model {model}...")
+                    result = await self._call(task, models[0], 0, prompt, system_message)
+                    outcome = SUCCESS
                     return result
                 except Exception as e:
-                    continue
-        logger.critical(f"All model/key combinations failed for task {task}")
-        return "Извините, я временно не могу ответить. Попробуйте позже."
+                    if is_rate_limit_error(e):
+                        outcome = RATE_LIMITED
+            logger.critical(f"All model/key combinations failed for task {task}")
+            if raise_on_failure:
+                raise LLMUnavailableError(f"All model/key combinations failed for task {task}")
+            return FALLBACK_RESPONSE
+        finally:
+            global_limiter.release(outcome)
+            LLM_FALLBACK_DEPTH.labels(task, outcome).observe(attempted)
+            if priority == INTERACTIVE:
+                self.slo.observe(time.perf_counter() - start)
+
+    def priority_stats(self) -> Dict[str, Any]:
+        """Ожидание слота по классам приоритета (по последним вызовам), SLO и число отброшенных фоновых вызовов"""
+        queue_wait = {}
+        for priority, waits in self._queue_waits.items():
+            values = sorted(waits)
+            queue_wait[priority] = {
+                "calls": len(values),
+                "p50": round(values[len(values) // 2], 4) if values else None,
+                "p95": round(values[min(len(values) - 1, int(0.95 * len(values)))], 4) if values else None,
+                "waiting": self.limiters.global_limiter.waiting(priority),
+            }
+        return {"queue_wait": queue_wait, "interactive_slo": self.slo.stats(), "shed": self._shed}
 
     async def analyze_sentiment(self, text: str) -> float:
         """
@@ -1,13 +1,50 @@
+import asyncio
+import itertools
+import re
+import threading
 import uuid
-from typing import Dict, List, Optional, Any
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Any, Callable, Tuple
 
 from memory import MemoryStore
+from message_log import format_messages
+from scenario import ScenarioContext, EMPTY_SCENARIO
+from tracing import span, traced, run_in_executor
 import logging
 
 logger = logging.getLogger(__name__)
 
+ALL_CARDS = ["profession", "age", "gender", "health", "hobby", "baggage", "personality"]
+CARD_RE = re.compile(r'\[(.*?)\]')
+# Общий счётчик версий агентов: номер растёт при любом изменении любого агента,
+# поэтому максимум по игре меняется при каждом изменении её агентов
+_versions = itertools.count(1)
+
+
+def parse_initiative(response: str, available_cards: List[str]) -> Tuple[str, str]:
+    """Карта из [квадратных скобок] ответа и текст высказывания; неизвестная карта заменяется первой доступной"""
+    fallback = available_cards[0] if available_cards else "none"
+    match = CARD_RE.search(response)
+    if not match:
+        return fallback, response.strip()
+    chosen_card = match.group(1).strip()
+    message_text = CARD_RE.sub('', response).strip()
+    if chosen_card not in available_cards:
+        chosen_card = fallback
+    return chosen_card, message_text
+
+
+def match_vote(response: str, names: List[str]) -> Optional[str]:
+    """Первое из имён кандидатов, встречающееся в ответе; иначе первый кандидат"""
+    for name in names:
+        if name in response:
+            return name
+    return names[0] if names else None
+
+
 class Agent:
-    def __init__(self, name: str, personality: str, bunker_params: dict, avatar: str = ""):
+    def __init__(self, name: str, personality: str, bunker_params: dict, avatar: str = "",
+                 memory_loader: Optional[Callable[[], MemoryStore]] = None):
         self.id = str(uuid.uuid4())
         self.name = name
         self.personality = personality
@@ -15,48 +52,132 @@ class Agent:
         self.avatar = avatar
         self.mood = 0.0
         self.relationships: Dict[str, float] = {}
-        self.memory = MemoryStore()
         self.plans: List[str] = []
         self.revealed_cards: List[str] = []
-
-        self.memory.add(f"Меня зовут {name}. Я {personality}. Мои параметры: {bunker_params}")
-        self._summarizing = False
+        # Получатель изменений отношений и настроения (граф отношений игры), назначается сессией
+        self.observer = None
+        # Версия состояния для ETag и кеша ответов; меняется при каждом изменении (см. touch)
+        self.version = next(_versions)
+
+        # Память может подгружаться лениво: memory_loader вызывается при первом обращении к self.memory
+        self._memory: Optional[MemoryStore] = None
+        self._memory_loader = memory_loader
+        self._memory_data: Optional[dict] = None
+        self._hydrate_lock = threading.Lock()
+        if memory_loader is None:
+            self._memory = MemoryStore()
+            self._memory.add(f"Меня зовут {name}. Я {personality}. Мои параметры: {bunker_params}", pinned=True)
+        self.summarizing = False  # память агента сейчас суммаризируется (см. summarizer.py)
+        self._persona: Optional[str] = None
+        self._persona_with_params: Optional[str] = None
+        # Изменения состояния (настроение, отношения, планы, карты, память) идут по одному;
+        # вызовы LLM выполняются вне замка и могут идти параллельно
+        self._lock = asyncio.Lock()
+
+    @property
+    def memory(self) -> MemoryStore:
+        return self._memory if self._memory is not None else self.hydrate()
+
+    @memory.setter
+    def memory(self, store: MemoryStore):
+        self._memory = store
+        self._memory_loader = None
+        self._memory_data = None
+
+    @property
+    def is_hydrated(self) -> bool:
+        return self._memory is not None
+
+    def hydrate(self) -> MemoryStore:
+        """Загрузить память агента (эмбеддинги), если она ещё не загружена. Потокобезопасно."""
+        if self._memory is None:
+            with self._hydrate_lock:
+                if self._memory is None:
+                    self._memory = self._memory_loader()
+                    self._memory_loader = None
+                    self._memory_data = None
+        return self._memory
+
+    def touch(self):
+        self.version = next(_versions)
+
+    @asynccontextmanager
+    async def mutation(self):
+        """Фаза изменения состояния агента; память к этому моменту загружена"""
+        with span("agent.lock_wait"):
+            await self._lock.acquire()
+        try:
+            if not self.is_hydrated:
+                with span("agent.hydrate"):
+                    await run_in_executor(self.hydrate)
+            yield
+        finally:
+            self.touch()
+            self._lock.release()
+
+    async def _encode(self, text: str):
+        """Эмбеддинг в пуле потоков, чтобы не блокировать event loop"""
+        return await run_in_executor(self.memory.encode, text)
+
+    async def _remember(self, text: str):
+        # Вызывать внутри mutation()
+        self.memory.add(text, await self._encode(text))
+
+    async def _recall(self, query: str, k: int) -> List[str]:
+        # Вызывать внутри mutation()
+        return self.memory.search(query, k=k, query_embedding=await self._encode(query))
+
+    async def remember(self, text: str):
+        """Добавить воспоминание снаружи (например, глобальное событие)"""
+        async with self.mutation():
+            await self._remember(text)
+
+    @property
+    def persona(self) -> str:
+        """Начало промпта с именем и характером; собирается один раз на агента"""
+        if self._persona is None:
+            self._persona = f"Ты — {self.name}. Характер: {self.personality}."
+        return self._persona
+
+    @property
+    def persona_with_params(self) -> str:
+        if self._persona_with_params is None:
+            self._persona_with_params = f"{self.persona} Параметры: {self.bunker_params}."
+        return self._persona_with_params
 
     def update_mood(self, delta: float):
         """Изменить настроение, ограничивая диапазон [-1, 1]"""
         self.mood = max(-1.0, min(1.0, self.mood + delta))
+        self.touch()
+        if self.observer is not None:
+            self.observer.mood_changed(self)
 
     def update_relationship(self, other_id: str, delta: float):
         """Изменить отношение к другому агенту"""
         current = self.relationships.get(other_id, 0.0)
         self.relationships[other_id] = max(-1.0, min(1.0, current + delta))
+        self.touch()
+        if self.observer is not None:
+            self.observer.relationship_changed(self, other_id, self.relationships[other_id])
 
+    @traced("agent.generate_initiative")
     async def generate_initiative(self, context_messages: List[Dict[str, str]], game_state: Dict[str, Any],
-                                  model_manager) -> tuple[str, str]:
-        bunker = game_state.get("bunker") or (globals().get('current_bunker') if 'current_bunker' in globals() else {})
-        disaster = game_state.get("disaster") or (
-            globals().get('current_disaster') if 'current_disaster' in globals() else {})
-        threat = game_state.get("threat") or (globals().get('current_threat') if 'current_threat' in globals() else {})
-
-        # Формируем строки для вставки
-        bunker_info = f"Размер: {bunker.get('size', 'неизвестно')}, запас еды: {bunker.get('food_supply', 'неизвестно')}, оборудование: {bunker.get('equipment', 'неизвестно')}" if bunker else "Информация о бункере отсутствует"
-        disaster_info = f"Тип: {disaster.get('type', 'неизвестно')}, масштаб: {disaster.get('scale', 'неизвестно')}, опасности: {disaster.get('dangers', 'неизвестно')}" if disaster else "Информация о катастрофе отсутствует"
-        threat_info = f"Тип: {threat.get('type', 'неизвестно')}, уровень: {threat.get('severity', 'неизвестно')}, описание: {threat.get('description', 'неизвестно')}" if threat else "Информация об угрозе отсутствует"
-
+                                  model_manager, scenario: Optional[ScenarioContext] = None,
+                                  dialogue: Optional[str] = None) -> tuple[str, str]:
         """
         Генерирует инициативное высказывание: агент выбирает одну НЕРАСКРЫТУЮ карту и объясняет, почему она делает его ценным.
         Возвращает (название_карты, текст_высказывания).
         """
-        dialogue_history = self._format_messages(context_messages)
-        memories = self.memory.search("текущая ситуация в бункере, обсуждение, кто должен остаться", k=3)
+        scenario = (scenario or EMPTY_SCENARIO).for_game_state(game_state)
+        dialogue_history = self._dialogue(context_messages, dialogue)
+        async with self.mutation():
+            memories = await self._recall("текущая ситуация в бункере, обсуждение, кто должен остаться", k=3)
+            available_cards = [card for card in ALL_CARDS if card not in self.revealed_cards]
         memories_text = "\n".join([f"- {mem}" for mem in memories]) if memories else "Нет важных воспоминаний."
 
-        all_cards = ["profession", "age", "gender", "health", "hobby", "baggage", "personality"]
-        available_cards = [card for card in all_cards if card not in self.revealed_cards]
-
         if not available_cards:
             prompt = f"""
-    Ты — {self.name}. Характер: {self.personality}. Настроение: {self.mood:.2f}.
+    {self.persona} Настроение: {self.mood:.2f}.
 
     Ты уже раскрыл все свои карты. Сейчас просто выскажись, почему ты должен остаться, ссылаясь на уже известные качества. Говори кратко одним предложением.
     """
@@ -75,17 +196,10 @@ class Agent:
             #     value = self.bunker_params.get(card, "неизвестно")
             #     cards_info += f"- {card}: {value}\n"
             prompt = f"""
-                Ты — {self.name}. Характер: {self.personality}. Настроение: {self.mood:.2f}.
+                {self.persona} Настроение: {self.mood:.2f}.
             
                 Ранее ты уже раскрыл: {', '.join(self.revealed_cards) if self.revealed_cards else 'пока ничего'}.
-                Обстановка в бункере:
-                {bunker_info}
-            
-                Катастрофа, которая произошла:
-                {disaster_info}
-            
-                Угроза снаружи:
-                {threat_info}
+{scenario.prompt}
                     
                 Недавние воспоминания:
                 {memories_text}
@@ -104,84 +218,59 @@ class Agent:
                 Формат: сначала укажи карту в квадратных скобках, например [profession], а затем напиши своё высказывание. Не используй квадратные скобки больше нигде.
                 """
             response = await model_manager.generate_with_fallback("response", prompt)
+            chosen_card, message_text = parse_initiative(response, available_cards)
 
-            import re
-            match = re.search(r'\[(.*?)\]', response)
-            if match:
-                chosen_card = match.group(1).strip()
-                message_text = re.sub(r'\[.*?\]', '', response).strip()
-                if chosen_card not in available_cards:
-                    chosen_card = available_cards[0] if available_cards else "none"
-            else:
-                chosen_card = available_cards[0] if available_cards else "none"
-                message_text = response.strip()
-
-        if chosen_card != "none" and chosen_card not in self.revealed_cards:
-            self.revealed_cards.append(chosen_card)
-
-        self.memory.add(f"Я раскрыл карту [{chosen_card}]: {message_text}")
+        async with self.mutation():
+            # Пока шёл вызов LLM, параллельный шаг мог уже раскрыть эту карту — повторно не добавляем
+            if chosen_card != "none" and chosen_card not in self.revealed_cards:
+                self.revealed_cards.append(chosen_card)
+            await self._remember(f"Я раскрыл карту [{chosen_card}]: {message_text}")
         logger.info(f"Agent {self.name} initiative: [{chosen_card}] {message_text}")
-        return response
+        return chosen_card, message_text
 
+    @traced("agent.generate_response")
     async def generate_response(self,
                                 message: str,
                                 from_agent: Optional[str],
                                 context_messages: List[Dict[str, str]],
                                 game_state: Dict[str, Any],
-                                model_manager) -> str:
+                                model_manager,
+                                scenario: Optional[ScenarioContext] = None,
+                                dialogue: Optional[str] = None) -> str:
         """
         Генерирует ответ агента. Если message пустое, агент высказывается по ситуации.
         """
-        bunker = game_state.get("bunker") or (globals().get('current_bunker') if 'current_bunker' in globals() else {})
-        disaster = game_state.get("disaster") or (
-            globals().get('current_disaster') if 'current_disaster' in globals() else {})
-        threat = game_state.get("threat") or (globals().get('current_threat') if 'current_threat' in globals() else {})
-
-        # Формируем строки для вставки
-        bunker_info = f"Размер: {bunker.get('size', 'неизвестно')}, запас еды: {bunker.get('food_supply', 'неизвестно')}, оборудование: {bunker.get('equipment', 'неизвестно')}" if bunker else "Информация о бункере отсутствует"
-        disaster_info = f"Тип: {disaster.get('type', 'неизвестно')}, масштаб: {disaster.get('scale', 'неизвестно')}, опасности: {disaster.get('dangers', 'неизвестно')}" if disaster else "Информация о катастрофе отсутствует"
-        threat_info = f"Тип: {threat.get('type', 'неизвестно')}, уровень: {threat.get('severity', 'неизвестно')}, описание: {threat.get('description', 'неизвестно')}" if threat else "Информация об угрозе отсутствует"
+        scenario = (scenario or EMPTY_SCENARIO).for_game_state(game_state)
 
         alive_agent_ids = game_state.get("alive_agents", [])
         agent_names_map = game_state.get("agent_names", {})
         alive_names = [agent_names_map.get(aid, aid) for aid in alive_agent_ids]
         game_state_desc = f"Раунд: {game_state.get('round', '?')}, живые: {', '.join(alive_names)}"
 
-        if message:
-            tone_delta = await model_manager.analyze_sentiment(message)
-            self.update_mood(tone_delta)
-            if from_agent:
-                self.memory.add(f"{from_agent} сказал: {message}")
-                self.update_relationship(from_agent, tone_delta)
-            else:
-                self.memory.add(f"Наблюдатель сказал: {message}")
-
-        dialogue_history = ""
-        if context_messages:
-            for msg in context_messages[-5:]:
-                sender = msg.get("from", "Unknown")
-                text = msg.get("text", "")
-                dialogue_history += f"{sender}: {text}\n"
-
+        tone_delta = await model_manager.analyze_sentiment(message) if message else 0.0
         query = message if message else "текущая ситуация в бункере, обсуждение, кто должен остаться"
-        memories = self.memory.search(query, k=3)
+        async with self.mutation():
+            if message:
+                self.update_mood(tone_delta)
+                if from_agent:
+                    await self._remember(f"{from_agent} сказал: {message}")
+                    self.update_relationship(from_agent, tone_delta)
+                else:
+                    await self._remember(f"Наблюдатель сказал: {message}")
+            memories = await self._recall(query, k=3)
+
+        dialogue_history = self._dialogue(context_messages, dialogue)
+
         memories_text = "\n".join([f"- {mem}" for mem in memories])
 
         current_plan = self.plans[-1] if self.plans else "Нет конкретного плана."
 
         if message:
             prompt = f"""
-    Ты — {self.name}. Характер: {self.personality}. Параметры: {self.bunker_params}.
+    {self.persona_with_params}
     Настроение: {self.mood:.2f}.
     
-    Обстановка в бункере:
-    {bunker_info}
-    
-    Катастрофа, которая произошла:
-    {disaster_info}
-    
-    Угроза снаружи:
-    {threat_info}
+{scenario.prompt}
     
     Недавние воспоминания:
     {memories_text if memories_text else "Нет важных воспоминаний."}
@@ -198,7 +287,7 @@ class Agent:
     """
         else:
             prompt = f"""
-    Ты — {self.name}. Характер: {self.personality}. Параметры: {self.bunker_params}.
+    {self.persona_with_params}
     Настроение: {self.mood:.2f}.
 
     Недавние воспоминания:
@@ -214,22 +303,17 @@ class Agent:
 
         response = await model_manager.generate_with_fallback("response", prompt)
 
-        self.memory.add(f"Я сказал: {response}")
+        async with self.mutation():
+            await self._remember(f"Я сказал: {response}")
         return response
 
-    async def decide_vote(self, context_messages: List[Dict[str, str]], game_state: Dict[str, Any], model_manager) -> str:
+    @traced("agent.decide_vote")
+    async def decide_vote(self, context_messages: List[Dict[str, str]], game_state: Dict[str, Any], model_manager,
+                          scenario: Optional[ScenarioContext] = None, dialogue: Optional[str] = None) -> str:
         """
         Возвращает ID агента, за которого голосует этот агент.
         """
-        bunker = game_state.get("bunker") or (globals().get('current_bunker') if 'current_bunker' in globals() else {})
-        disaster = game_state.get("disaster") or (
-            globals().get('current_disaster') if 'current_disaster' in globals() else {})
-        threat = game_state.get("threat") or (globals().get('current_threat') if 'current_threat' in globals() else {})
-
-        # Формируем строки для вставки
-        bunker_info = f"Размер: {bunker.get('size', 'неизвестно')}, запас еды: {bunker.get('food_supply', 'неизвестно')}, оборудование: {bunker.get('equipment', 'неизвестно')}" if bunker else "Информация о бункере отсутствует"
-        disaster_info = f"Тип: {disaster.get('type', 'неизвестно')}, масштаб: {disaster.get('scale', 'неизвестно')}, опасности: {disaster.get('dangers', 'неизвестно')}" if disaster else "Информация о катастрофе отсутствует"
-        threat_info = f"Тип: {threat.get('type', 'неизвестно')}, уровень: {threat.get('severity', 'неизвестно')}, описание: {threat.get('description', 'неизвестно')}" if threat else "Информация об угрозе отсутствует"
+        scenario = (scenario or EMPTY_SCENARIO).for_game_state(game_state)
 
         alive_agents = game_state.get("alive_agents", [])
         others = [aid for aid in alive_agents if aid != self.id]
@@ -240,22 +324,14 @@ class Agent:
         other_names = [agent_names.get(aid, aid) for aid in others]
         current_plan = self.plans[-1] if self.plans else "Нет конкретного плана."
         prompt = f"""
-    Ты — {self.name}. Твоя личность: {self.personality}.
-    Обстановка в бункере:
-    {bunker_info}
-    
-    Катастрофа, которая произошла:
-    {disaster_info}
-    
-    Угроза снаружи:
-    {threat_info}
-    Параметры: {self.bunker_params}.
+    {self.persona_with_params}
+{scenario.prompt}
     Настроение: {self.mood:.2f}.
     Твой текущий план: {current_plan}
     
 
     Вы прошли обсуждение. Вот последние сообщения:
-    {self._format_messages(context_messages)}
+    {self._dialogue(context_messages, dialogue)}
     
     Тебе нужно проголосовать за исключение одного из следующих игроков: {', '.join(other_names)}.
     Кого ты выбираешь и почему? Учитывай свою личность, план, параметры, отношения и ход обсуждения.
@@ -263,13 +339,7 @@ class Agent:
     
     """
         response = await model_manager.generate_with_fallback("vote", prompt)
-        chosen_name = None
-        for name in other_names:
-            if name in response:
-                chosen_name = name
-                break
-        if chosen_name is None:
-            chosen_name = other_names[0] if other_names else None
+        chosen_name = match_vote(response, other_names)
 
         name_to_id = {v: k for k, v in agent_names.items()}
         candidate_id = name_to_id.get(chosen_name)
@@ -290,46 +360,42 @@ class Agent:
         """Форматирует список сообщений в строку для промпта."""
         if not messages:
             return ""
-        result = ""
-        for msg in messages[-max_count:]:
-            sender = msg.get("from", "Unknown")
-            text = msg.get("text", "")
-            result += f"{sender}: {text}\n"
-        return result
-
-    async def update_plan(self, context_messages: List[Dict[str, str]], game_state: Dict[str, Any], model_manager, recent_events: List[str] = None) -> str:
+        return format_messages(messages[-max_count:])
+
+    def _dialogue(self, context_messages: Optional[List[Dict[str, str]]], dialogue: Optional[str]) -> str:
+        """Готовое окно из журнала игры или (для старых клиентов) сообщения, присланные в запросе"""
+        return dialogue if dialogue is not None else self._format_messages(context_messages)
+
+    @traced("agent.update_plan")
+    async def update_plan(self, context_messages: List[Dict[str, str]], game_state: Dict[str, Any], model_manager,
+                          recent_events: List[str] = None, scenario: Optional[ScenarioContext] = None,
+                          dialogue: Optional[str] = None) -> str:
         """
         Генерирует новый план (цель) агента на основе текущей ситуации.
         Возвращает текст плана и сохраняет его в self.plans.
         """
-        bunker = game_state.get("bunker") or (globals().get('current_bunker') if 'current_bunker' in globals() else {})
-        disaster = game_state.get("disaster") or (
-            globals().get('current_disaster') if 'current_disaster' in globals() else {})
-        threat = game_state.get("threat") or (globals().get('current_threat') if 'current_threat' in globals() else {})
+        prompt = self.plan_prompt(context_messages, game_state, recent_events, scenario, dialogue)
+        response = await model_manager.generate_with_fallback("plan", prompt)
+        await self.add_plan(response)
+        return response
 
-        # Формируем строки для вставки
-        bunker_info = f"Размер: {bunker.get('size', 'неизвестно')}, запас еды: {bunker.get('food_supply', 'неизвестно')}, оборудование: {bunker.get('equipment', 'неизвестно')}" if bunker else "Информация о бункере отсутствует"
-        disaster_info = f"Тип: {disaster.get('type', 'неизвестно')}, масштаб: {disaster.get('scale', 'неизвестно')}, опасности: {disaster.get('dangers', 'неизвестно')}" if disaster else "Информация о катастрофе отсутствует"
-        threat_info = f"Тип: {threat.get('type', 'неизвестно')}, уровень: {threat.get('severity', 'неизвестно')}, описание: {threat.get('description', 'неизвестно')}" if threat else "Информация об угрозе отсутствует"
+    def plan_prompt(self, context_messages: List[Dict[str, str]], game_state: Dict[str, Any],
+                    recent_events: List[str] = None, scenario: Optional[ScenarioContext] = None,
+                    dialogue: Optional[str] = None) -> str:
+        """Промпт для нового плана; отделён от вызова LLM, чтобы вызов шёл без аренды игры"""
+        scenario = (scenario or EMPTY_SCENARIO).for_game_state(game_state)
 
         events_str = "\n".join(recent_events) if recent_events else "Нет значимых событий."
 
         relations_str = ", ".join(
             [f"{aid}: {val}" for aid, val in self.relationships.items()]) if self.relationships else "нейтральные"
         prompt = f"""
-                Ты — {self.name}. Характер: {self.personality}. Параметры: {self.bunker_params}.
+                {self.persona_with_params}
                 Настроение: {self.mood:.2f}. Отношения с другими: {relations_str}
-                Обстановка в бункере:
-                {bunker_info}
-                
-                Катастрофа, которая произошла:
-                {disaster_info}
-                
-                Угроза снаружи:
-                {threat_info}
+{scenario.prompt}
                 Текущая ситуация в игре: {game_state}
                 Последние сообщения:
-                {self._format_messages(context_messages)}
+                {self._dialogue(context_messages, dialogue)}
 
                 Последние события в бункере:
                 {events_str}
@@ -344,11 +410,14 @@ class Agent:
                 - "Защищать себя от подозрений, указывая на свои положительные качества."
                 Ответ дай одной короткой фразой (1 предложение). Не используй общие фразы, будь конкретен.
                 """
-        response = await model_manager.generate_with_fallback("plan", prompt)
-        self.plans.append(response)
-        if len(self.plans) > 10:
-            self.plans = self.plans[-10:]
-        return response
+        return prompt
+
+    async def add_plan(self, plan: str):
+        """Запомнить план, оставляя 10 последних"""
+        async with self.mutation():
+            self.plans.append(plan)
+            if len(self.plans) > 10:
+                self.plans = self.plans[-10:]
 
     def to_dict(self):
         return {
@@ -360,41 +429,54 @@ class Agent:
             'mood': self.mood,
             'relationships': self.relationships,
             'plans': self.plans,
-            'memory': self.memory.to_dict(),
+            'memory': self._memory_data if self._memory_data is not None else self.memory.to_dict(),
             'revealed_cards': self.revealed_cards,
         }
 
+    def fork(self) -> "Agent":
+        """
+        Независимая копия агента с тем же id для другой игры (ветки «что если»).
+        Память разделяется с оригиналом копированием при записи (MemoryStore.fork), поэтому загружается заранее.
+        """
+        memory = self.memory.fork()
+        agent = Agent(self.name, self.personality, dict(self.bunker_params), self.avatar, memory_loader=lambda: memory)
+        agent.memory = memory
+        agent.id = self.id
+        agent.mood = self.mood
+        agent.relationships = dict(self.relationships)
+        agent.plans = list(self.plans)
+        agent.revealed_cards = list(self.revealed_cards)
+        return agent
+
     @classmethod
-    def from_dict(cls, data):
+    def from_dict(cls, data, memory: Optional[MemoryStore] = None,
+                  memory_loader: Optional[Callable[[], MemoryStore]] = None, lazy: bool = False):
+        """
+        Восстановить агента.
+        memory — готовая память (например, из SQLite); memory_loader — отложенная загрузка памяти;
+        при lazy=True память из data['memory'] пересчитывается только при первом обращении.
+        """
+        memory_data = None
+        if memory is not None:
+            loader = lambda: memory
+        elif memory_loader is not None:
+            loader = memory_loader
+        else:
+            memory_data = data['memory']
+            loader = lambda: MemoryStore.from_dict(memory_data)
         agent = cls(
             name=data['name'],
             personality=data['personality'],
             bunker_params=data['bunker_params'],
-            avatar=data.get('avatar', '')
+            avatar=data.get('avatar', ''),
+            memory_loader=loader
         )
+        agent._memory_data = memory_data
         agent.id = data['id']
         agent.mood = data['mood']
         agent.relationships = data['relationships']
         agent.plans = data.get('plans', [])
-        agent.memory = MemoryStore.from_dict(data['memory'])
         agent.revealed_cards = data.get('revealed_cards', [])
+        if not lazy:
+            agent.hydrate()
         return agent
-
-    async def summarize_memory(self, model_manager, threshold=20, batch_size=10):
-        """Вызывает суммаризацию памяти агента."""
-        return await self.memory.summarize_old(model_manager, threshold, batch_size)
-
-    async def summarize_if_needed(self, model_manager, threshold=20, batch_size=10):
-        """Запускает суммаризацию, если превышен порог и нет активной задачи."""
-        if self._summarizing:
-            logger.debug(f"Agent {self.name} already summarizing, skipping")
-            return 0
-        if len(self.memory.memories) < threshold:
-            return 0
-        self._summarizing = True
-        try:
-            count = await self.memory.summarize_old(model_manager, threshold, batch_size)
-            logger.info(f"Agent {self.name} summarized {count} memories")
-            return count
-        finally:
-            self._summarizing = False
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Регрессионная проверка разбора ответов LLM на записанной кассете (LLM_CASSETTE_MODE=record).
+
+    LLM_CASSETTE_MODE=record LLM_CASSETTE=cassettes/game.jsonl.gz uvicorn main:app   # живая игра
+    python bench_cassette.py cassettes/game.jsonl.gz --repeat 100
+
+Для каждой записанной инициативы (промпт «Ты раскрываешь карту «...»») ответ разбирается parse_initiative,
+для каждого голосования — match_vote; считается, как часто модель соблюдает формат
+([карта] в начале, одно из предложенных имён) и как быстро идёт разбор. --repeat прогоняет записи
+многократно, чтобы измерить разбор под нагрузкой.
+
+Воспроизведение живого трафика для замеров производительности:
+    python bench_game.py --cassette cassettes/game.jsonl.gz --latency-scale 0.5
+"""
+import argparse
+import json
+import re
+import time
+
+from agent import ALL_CARDS, CARD_RE, parse_initiative, match_vote
+from cassette import entries_by_task
+
+OFFERED_RE = re.compile(r"Ты раскрываешь карту «([^»]+)»")
+REVEALED_RE = re.compile(r"Ранее ты уже раскрыл: (.*?)\.\s*\n")
+CANDIDATES_RE = re.compile(r"из следующих игроков: (.+?)\.\s*\n")
+
+
+def initiative_cases(entries):
+    for entry in entries:
+        offered = OFFERED_RE.search(entry["prompt"])
+        if not offered:
+            continue
+        revealed = REVEALED_RE.search(entry["prompt"])
+        revealed_cards = [] if not revealed or revealed.group(1) == "пока ничего" else [
+            card.strip() for card in revealed.group(1).split(",")]
+        available = [card for card in ALL_CARDS if card not in revealed_cards]
+        yield entry["response"], available, offered.group(1)
+
+
+def vote_cases(entries):
+    for entry in entries:
+        candidates = CANDIDATES_RE.search(entry["prompt"])
+        if candidates:
+            yield entry["response"], [name.strip() for name in candidates.group(1).split(",")]
+
+
+def check_initiatives(cases, repeat: int) -> dict:
+    stats = {"total": len(cases), "bracketed": 0, "offered_card": 0, "available_card": 0, "empty_text": 0}
+    for response, available, offered in cases:
+        card, text = parse_initiative(response, available)
+        match = CARD_RE.search(response)
+        stats["bracketed"] += bool(match)
+        stats["available_card"] += bool(match) and match.group(1).strip() in available
+        stats["offered_card"] += card == offered
+        stats["empty_text"] += not text
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for response, available, _offered in cases:
+            parse_initiative(response, available)
+    elapsed = time.perf_counter() - start
+    stats["parses_per_s"] = round(repeat * len(cases) / elapsed) if elapsed and cases else 0
+    return stats
+
+
+def check_votes(cases, repeat: int) -> dict:
+    stats = {"total": len(cases), "named_candidate": 0, "fallback_to_first": 0}
+    for response, names in cases:
+        named = any(name in response for name in names)
+        stats["named_candidate"] += named
+        stats["fallback_to_first"] += not named and match_vote(response, names) == names[0]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for response, names in cases:
+            match_vote(response, names)
+    elapsed = time.perf_counter() - start
+    stats["matches_per_s"] = round(repeat * len(cases) / elapsed) if elapsed and cases else 0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassette", help="файл кассеты (JSONL или JSONL.gz)")
+    parser.add_argument("--repeat", type=int, default=10, help="сколько раз прогнать записи при замере скорости")
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    by_task = entries_by_task(args.cassette)
+    latencies = {task: round(sum(e.get("latency", 0.0) for e in entries) / len(entries) * 1000, 1)
+                 for task, entries in by_task.items()}
+    result = {
+        "calls": {task: len(entries) for task, entries in by_task.items()},
+        "mean_latency_ms": latencies,
+        "initiative": check_initiatives(list(initiative_cases(by_task.get("response", []))), args.repeat),
+        "vote": check_votes(list(vote_cases(by_task.get("vote", []))), args.repeat),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
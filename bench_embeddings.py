@@ -0,0 +1,127 @@
+"""
+Сравнение бэкендов эмбеддингов (EMBEDDING_BACKEND) на записанных воспоминаниях агентов.
+
+    python bench_embeddings.py --agents-file agents_state.json
+    python bench_embeddings.py --sqlite agents.db --backends full quantized projection --dim 96
+
+Для каждого бэкенда: время загрузки, пропускная способность пакетного кодирования (восстановление памяти)
+и задержка одиночного вызова (новое воспоминание, поисковый запрос), байт на эмбеддинг.
+Качество поиска — recall@k относительно эталонного бэкенда (--reference, по умолчанию full):
+для --queries воспоминаний ищутся k ближайших по косинусу среди остальных, и считается доля совпавших
+с эталонной выдачей соседей. Недоступный бэкенд (нет sentence-transformers или torch) пропускается с ошибкой в отчёте.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from config import EMBEDDING_MODEL
+from embeddings import BACKENDS, create_embedding_backend
+
+
+def load_texts(agents_file=None, sqlite_file=None):
+    texts = []
+    if agents_file:
+        with open(agents_file, encoding="utf-8") as f:
+            for agent in json.load(f).values():
+                texts.extend(m["text"] for m in agent.get("memory", {}).get("memories", []))
+    if sqlite_file:
+        conn = sqlite3.connect(sqlite_file)
+        texts.extend(row[0] for row in conn.execute("SELECT text FROM memories ORDER BY timestamp"))
+        conn.close()
+    # Повторы (одинаковые вступления, слитые дубликаты) не добавляют информации о качестве поиска
+    return list(dict.fromkeys(texts))
+
+
+def neighbours(embeddings: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k ближайших по косинусу воспоминаний для каждого запроса (сам запрос исключается)"""
+    normed = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-9)
+    scores = normed[queries] @ normed.T
+    scores[np.arange(len(queries)), queries] = -np.inf
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top
+
+
+def measure(kind: str, texts, args) -> dict:
+    backend = create_embedding_backend(kind, args.model, args.dim if kind in ("projection", "hashing") else None)
+    start = time.perf_counter()
+    backend.load()
+    backend.encode("прогрев")
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embeddings = np.concatenate([backend.encode(texts[i:i + args.batch]) for i in range(0, len(texts), args.batch)])
+    batch_s = time.perf_counter() - start
+
+    sample = texts[:args.single]
+    start = time.perf_counter()
+    for text in sample:
+        backend.encode(text)
+    single_s = time.perf_counter() - start
+    return {
+        "tag": backend.tag,
+        "dim": backend.dim,
+        "bytes_per_embedding": backend.dim * 4,
+        "load_s": round(load_s, 3),
+        "batch_texts_per_s": round(len(texts) / batch_s, 1) if batch_s else None,
+        "single_ms": round(single_s / len(sample) * 1000, 3) if sample else None,
+        "_embeddings": embeddings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents-file", help="JSON-сохранение агентов (STORAGE_BACKEND=json)")
+    parser.add_argument("--sqlite", help="база SQLite агентов (STORAGE_BACKEND=sqlite)")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--reference", choices=BACKENDS, default="full", help="эталон для recall@k")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--dim", type=int, help="размерность для projection и hashing")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--single", type=int, default=50, help="сколько одиночных вызовов замерить")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    if not args.agents_file and not args.sqlite:
+        for default in ("agents_state.json", "agents.db"):
+            if os.path.exists(default):
+                setattr(args, "sqlite" if default.endswith(".db") else "agents_file", default)
+    texts = load_texts(args.agents_file, args.sqlite)
+    if len(texts) <= args.k:
+        parser.error(f"need more than {args.k} recorded memories, found {len(texts)}")
+
+    kinds = list(dict.fromkeys([args.reference] + args.backends))
+    results = {}
+    for kind in kinds:
+        try:
+            results[kind] = measure(kind, texts, args)
+        except Exception as e:
+            results[kind] = {"error": repr(e)}
+
+    rng = np.random.default_rng(args.seed)
+    queries = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+    reference = next((kind for kind in kinds if "_embeddings" in results[kind]), None)
+    if reference is not None:
+        expected = neighbours(results[reference]["_embeddings"], queries, args.k)
+        for kind in kinds:
+            if "_embeddings" in results[kind]:
+                found = neighbours(results[kind].pop("_embeddings"), queries, args.k)
+                overlap = [len(set(a) & set(b)) for a, b in zip(expected.tolist(), found.tolist())]
+                results[kind][f"recall@{args.k}"] = round(sum(overlap) / (args.k * len(queries)), 4)
+    report = {"texts": len(texts), "queries": len(queries), "reference": reference, "backends": results}
+    if reference != args.reference:
+        report["note"] = f"reference backend {args.reference} unavailable, using {reference}"
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Бенчмарк ветвления игр: снимок с копированием при записи (Agent.fork / MemoryStore.fork) против полной копии памяти.
+
+    python bench_fork.py --agents 8 --memories 200 500 2000 --forks 16
+
+Для каждого размера памяти: время снимка всех агентов, дополнительная память на одну ветку (tracemalloc),
+цена первой записи в ветку (копирование буферов поиска) и следующих записей. Затем --forks веток
+параллельно (пул потоков) дописывают и ищут воспоминания, и проверяется изоляция: исходная игра
+и соседние ветки не меняются. Эмбеддинги случайные (без вызова модели), запросы — хеширование слов.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from agent import Agent
+from embeddings import create_embedding_backend
+from memory import MemoryStore
+
+EMBEDDING_DIM = 384
+
+
+def make_agents(n_agents: int, n_memories: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    embedder = create_embedding_backend("hashing", "", EMBEDDING_DIM)
+    start = datetime.now() - timedelta(days=1)
+    agents = {}
+    for i in range(n_agents):
+        memory = MemoryStore(embedder=embedder, max_memories=None, dedup_threshold=None)
+        for j in range(n_memories):
+            memory.memories.append({
+                'id': uuid.uuid4().hex,
+                'text': f"Агент {i}: воспоминание номер {j} о ходе обсуждения в бункере",
+                'embedding': rng.standard_normal(EMBEDDING_DIM).astype(np.float32),
+                'timestamp': start + timedelta(seconds=j),
+            })
+        agent = Agent(f"Агент {i}", "осторожный", {"profession": "инженер"}, memory_loader=lambda m=memory: m)
+        agent.memory = memory
+        # Буферы поиска собраны, как у агента в идущей игре
+        memory.search("бункер", k=3)
+        agents[agent.id] = agent
+    return agents
+
+
+def full_copy(agent: Agent) -> MemoryStore:
+    """Прежний способ ветвления: независимые копии записей, эмбеддингов и буферов"""
+    source = agent.memory
+    store = MemoryStore(embedder=source.embedder, max_memories=None, dedup_threshold=None)
+    store.memories = [{**m, 'embedding': m['embedding'].copy()} for m in source.memories]
+    store.search("бункер", k=3)
+    return store
+
+
+def timed_alloc(fn, repeat: int):
+    """Лучшее время вызова и объём памяти, оставшийся занятым его результатом"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return best, allocated
+
+
+def write_costs(agent: Agent, writes: int):
+    fork = agent.fork()
+    texts = [f"ветка: новое событие {k}" for k in range(writes)]
+    embeddings = fork.memory.encode(texts)
+    durations = []
+    for text, embedding in zip(texts, embeddings):
+        start = time.perf_counter()
+        fork.memory.add(text, embedding)
+        durations.append(time.perf_counter() - start)
+    return durations[0], float(np.median(durations[1:])) if len(durations) > 1 else None
+
+
+def fingerprint(agents) -> list:
+    return [(len(a.memory.memories), float(a.memory._matrix[:a.memory._rows].sum()), dict(a.relationships))
+            for a in agents.values()]
+
+
+def what_if(agents, n_forks: int, writes: int, threads: int) -> dict:
+    """Ветки параллельно дописывают и ищут воспоминания; исходная игра и другие ветки не должны меняться"""
+    before = fingerprint(agents)
+    branches = [{aid: agent.fork() for aid, agent in agents.items()} for _ in range(n_forks)]
+
+    def play(b: int):
+        for agent in branches[b].values():
+            for k in range(writes):
+                agent.memory.add(f"ветка {b}: событие {k}")
+            agent.relationships["other"] = b / n_forks
+            agent.memory.search(f"ветка {b}", k=3)
+        return fingerprint(branches[b])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(play, range(n_forks)))
+    elapsed = time.perf_counter() - start
+    expected_sizes = [size + writes for size, _, _ in before]
+    return {
+        "forks": n_forks,
+        "elapsed_s": round(elapsed, 3),
+        "parent_unchanged": fingerprint(agents) == before,
+        "branches_isolated": all([size for size, _, _ in r] == expected_sizes
+                                 and all(rel.get("other") == b / n_forks for _, _, rel in r)
+                                 for b, r in enumerate(results)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=8)
+    parser.add_argument("--memories", type=int, nargs="+", default=[200, 500, 2000], help="воспоминаний на агента")
+    parser.add_argument("--forks", type=int, default=16, help="параллельных веток в проверке изоляции")
+    parser.add_argument("--writes", type=int, default=20, help="записей на агента в каждой ветке")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    results = []
+    for n_memories in args.memories:
+        agents = make_agents(args.agents, n_memories)
+        cow_s, cow_bytes = timed_alloc(lambda: {aid: a.fork() for aid, a in agents.items()}, args.repeat)
+        copy_s, copy_bytes = timed_alloc(lambda: {aid: full_copy(a) for aid, a in agents.items()}, args.repeat)
+        first_write, next_write = write_costs(next(iter(agents.values())), args.writes)
+        results.append({
+            "agents": args.agents,
+            "memories_per_agent": n_memories,
+            "snapshot_ms": {"cow": round(cow_s * 1000, 3), "full_copy": round(copy_s * 1000, 3)},
+            "fork_kb": {"cow": round(cow_bytes / 1024, 1), "full_copy": round(copy_bytes / 1024, 1)},
+            "write_ms": {"first": round(first_write * 1000, 3),
+                         "next_median": round(next_write * 1000, 3) if next_write is not None else None},
+            "what_if": what_if(agents, args.forks, args.writes, args.threads),
+        })
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Сквозной бенчмарк симулированной игры: приложение FastAPI в том же процессе (httpx + ASGITransport),
+LLM — локальная имитация (LLM_BACKEND=fake), эмбеддинги — хеширование слов или любой другой бэкенд (EMBEDDING_BACKEND).
+
+    python bench_game.py --agents 8 --rounds 5 --output baseline.json
+    python bench_game.py --agents 8 --rounds 5 --compare baseline.json
+    python bench_game.py --cassette cassettes/game.jsonl.gz --latency-scale 0.5
+
+Создаются N агентов, задаются бункер, катастрофа и угроза, затем R раундов: /step, сообщение каждому агенту,
+голос каждого агента и /vote (самый «популярный» исключается, пока живых больше двух).
+Отчёт: запросы в секунду, p50/p95/p99 по эндпоинтам, задержка event loop, прирост RSS на агента
+и время сохранения. --output пишет отчёт как baseline, --compare сравнивает с baseline
+и завершается с кодом 1, если p95 или пропускная способность хуже более чем на --tolerance.
+С --cassette ответы LLM воспроизводятся из записанной кассеты (см. bench_cassette.py)
+с исходной задержкой, умноженной на --latency-scale; --record-cassette записывает кассету прогона.
+Промпты прогона содержат время и память агентов и редко совпадают с записанными точно: промах отдаёт запасной
+ответ (число промахов — в отчёте cassette), а --cassette-lenient вместо него отдаёт ответы той же задачи по кругу.
+"""
+import argparse
+import atexit
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from embeddings import BACKENDS
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (Linux /proc; иначе пиковый RSS из getrusage)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже запланированного просыпается sleep(interval)"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class Client:
+    def __init__(self, http):
+        self.http = http
+        self.latencies = defaultdict(list)
+        self.errors = 0
+
+    async def request(self, method: str, path: str, payload=None, label: str = None):
+        start = time.perf_counter()
+        response = await self.http.request(method, path, json=payload)
+        self.latencies[label or path].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors += 1
+            raise RuntimeError(f"{method} {path}: {response.status_code} {response.text[:200]}")
+        return response.json()
+
+
+async def play_game(client: Client, n_agents: int, rounds: int):
+    agent_ids = []
+    for i in range(n_agents):
+        agent = await client.request("POST", "/agents", {
+            "name": f"Агент{i}", "personality": "спокойный, рассудительный",
+            "bunker_params": {"profession": "инженер", "age": 30 + i, "health": "здоров", "hobby": "шахматы",
+                              "baggage": "аптечка"},
+        }, label="create_agent")
+        agent_ids.append(agent["id"])
+    await client.request("POST", "/bunker", {"size": "средний", "food_supply": "месяц", "equipment": "медицинское"},
+                         label="scenario")
+    await client.request("POST", "/disaster", {"type": "ядерная война", "scale": "планетарный",
+                                               "dangers": "ядерная зима"}, label="scenario")
+    await client.request("POST", "/threat", {"type": "мародёры", "severity": "средний",
+                                             "description": "группы мародёров у входа"}, label="scenario")
+    alive = list(agent_ids)
+    excluded = []
+    for r in range(1, rounds + 1):
+        context = {"game_state": {"round": r, "alive_agents": alive, "excluded": excluded}, "round": r}
+        await client.request("POST", "/step", {"context": context}, label="step")
+        for aid in alive:
+            await client.request("POST", f"/agents/{aid}/message",
+                                 {"from_agent": None, "text": "Почему тебя стоит оставить?", "context": context},
+                                 label="message")
+        votes = {}
+        for aid in alive:
+            vote = await client.request("POST", f"/agents/{aid}/vote", {"context": context}, label="agent_vote")
+            if vote["candidate_id"]:
+                votes[aid] = vote["candidate_id"]
+        excluded_id = ""
+        if len(alive) > 2 and votes:
+            excluded_id = Counter(votes.values()).most_common(1)[0][0]
+            alive = [aid for aid in alive if aid != excluded_id]
+            excluded = excluded + [excluded_id]
+        await client.request("POST", "/vote", {"round": r, "votes": votes, "excluded_id": excluded_id,
+                                               "alive_agents": alive}, label="vote")
+
+
+async def wait_background(scheduler, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = scheduler.stats()
+        if not stats["pending"] and not stats["running"]:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run(args) -> dict:
+    import httpx
+    import main
+    from metrics import STORAGE_SAVE_SECONDS
+
+    rss_start = rss_mb()
+    transport = httpx.ASGITransport(app=main.app)
+    monitor = LoopLagMonitor()
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as http:
+            client = Client(http)
+            monitor.start()
+            start = time.perf_counter()
+            await play_game(client, args.agents, args.rounds)
+            elapsed = time.perf_counter() - start
+            drained = await wait_background(main.scheduler, args.drain_timeout)
+            await monitor.stop()
+        save_start = time.perf_counter()
+        main.sessions.save_all()
+        save_all = time.perf_counter() - save_start
+        rss_end = rss_mb()
+        background = main.scheduler.stats()
+        cassette = main.model_manager.cassette.stats() if main.model_manager.cassette is not None else None
+
+    saves = STORAGE_SAVE_SECONDS.labels(args.storage)
+    requests = sum(len(v) for v in client.latencies.values())
+    return {
+        "revision": git_revision(),
+        "config": {"agents": args.agents, "rounds": args.rounds, "llm_latency": args.llm_latency,
+                   "llm_latency_dist": args.llm_latency_dist, "embedder": args.embedder, "storage": args.storage,
+                   "cassette": args.cassette, "latency_scale": args.latency_scale if args.cassette else None,
+                   "cassette_lenient": args.cassette_lenient if args.cassette else None},
+        "requests": requests,
+        "errors": client.errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 1),
+        "latency_ms": {
+            label: {"count": len(values),
+                    "p50": round(percentile(values, 0.50) * 1000, 2),
+                    "p95": round(percentile(values, 0.95) * 1000, 2),
+                    "p99": round(percentile(values, 0.99) * 1000, 2)}
+            for label, values in client.latencies.items()
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(monitor.lags, 0.50) * 1000, 2) if monitor.lags else 0.0,
+            "p99": round(percentile(monitor.lags, 0.99) * 1000, 2) if monitor.lags else 0.0,
+            "max": round(max(monitor.lags) * 1000, 2) if monitor.lags else 0.0,
+        },
+        "rss_mb": {"start": round(rss_start, 1), "end": round(rss_end, 1),
+                   "per_agent_kb": round((rss_end - rss_start) * 1024 / args.agents, 1)},
+        "persistence_ms": {
+            "saves": sum(saves.counts),
+            "mean_save": round(saves.sum / sum(saves.counts) * 1000, 3) if sum(saves.counts) else 0.0,
+            "save_all": round(save_all * 1000, 3),
+        },
+        "background": {"drained": drained, **background},
+        "cassette": cassette,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Регрессии относительно baseline: p95 эндпоинтов и пропускная способность"""
+    regressions = []
+    if result["requests_per_s"] < baseline["requests_per_s"] * (1 - tolerance):
+        regressions.append(f"requests_per_s {baseline['requests_per_s']} -> {result['requests_per_s']}")
+    for label, stats in result["latency_ms"].items():
+        base = baseline.get("latency_ms", {}).get(label)
+        if base and stats["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{label} p95 {base['p95']}ms -> {stats['p95']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.02, help="средняя задержка имитации LLM, секунд")
+    parser.add_argument("--llm-latency-dist", default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--embedder", choices=BACKENDS, default="hashing",
+                        help="бэкенд эмбеддингов: hashing — без модели, full/quantized/projection — sentence-transformers")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--cassette", help="воспроизводить ответы LLM из кассеты")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="множитель задержки воспроизведения")
+    parser.add_argument("--cassette-lenient", action="store_true",
+                        help="при промахе отдавать записанные ответы той же задачи по кругу")
+    parser.add_argument("--record-cassette", help="записать вызовы LLM прогона в кассету")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="сколько ждать фоновые задачи, секунд")
+    parser.add_argument("--output", help="записать отчёт (baseline) в JSON-файл")
+    parser.add_argument("--compare", help="сравнить с baseline из JSON-файла")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение относительно baseline")
+    args = parser.parse_args()
+
+    if args.cassette and args.record_cassette:
+        parser.error("--cassette and --record-cassette are mutually exclusive")
+    output = os.path.abspath(args.output) if args.output else None
+    cassette_file = os.path.abspath(args.cassette or args.record_cassette) if (
+        args.cassette or args.record_cassette) else None
+    baseline_file = os.path.abspath(args.compare) if args.compare else None
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["LLM_BACKEND"] = "fake"
+        os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+        os.environ["FAKE_LLM_LATENCY_DIST"] = args.llm_latency_dist
+        os.environ["STORAGE_BACKEND"] = args.storage
+        if cassette_file:
+            os.environ["LLM_CASSETTE_MODE"] = "replay" if args.cassette else "record"
+            os.environ["LLM_CASSETTE"] = cassette_file
+            os.environ["LLM_CASSETTE_LATENCY_SCALE"] = str(args.latency_scale)
+            os.environ["LLM_CASSETTE_STRICT"] = "0" if args.cassette_lenient else "1"
+        os.environ["EMBEDDING_BACKEND"] = args.embedder
+        result = asyncio.run(run(args))
+        # Сохранение игры при выходе (atexit в main) иначе сработает уже вне временного каталога
+        atexit.unregister(sys.modules["main"].auto_save)
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if baseline_file:
+        with open(baseline_file, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Бенчмарк слияния почти-дубликатов в памяти агента: размер памяти, доля слитых записей
+и время поиска с dedup и без него.
+
+    python bench_memory_dedup.py --memories 2000 --dup-ratio 0.4
+
+Поток воспоминаний синтетический: часть записей — повтор одной из недавних тем с небольшим шумом
+(повторные «Событие: ...», одинаковые сообщения наблюдателя, похожие «Я сказал: ...»),
+остальные — новые темы. Эмбеддинги передаются в add() готовыми, модель не вызывается.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from memory import MemoryStore
+
+EMBEDDING_DIM = 384
+
+
+def make_stream(n: int, dup_ratio: float, noise: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    topics = []
+    stream = []
+    for i in range(n):
+        if topics and rng.random() < dup_ratio:
+            t = int(rng.integers(max(0, len(topics) - 20), len(topics)))
+            emb = topics[t] + noise * rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+            stream.append((f"Событие: повтор темы {t}", emb))
+        else:
+            emb = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+            topics.append(emb)
+            stream.append((f"Наблюдатель сказал: тема {len(topics) - 1}", emb))
+    return stream
+
+
+def run(stream, dedup_threshold, max_memories, queries: int, seed: int = 1):
+    store = MemoryStore(max_memories=max_memories, dedup_threshold=dedup_threshold)
+    start = time.perf_counter()
+    for text, emb in stream:
+        store.add(text, emb)
+    add_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    query_embs = rng.standard_normal((queries, EMBEDDING_DIM)).astype(np.float32)
+    store.search("", k=5, query_embedding=query_embs[0])  # прогрев кэша матрицы
+    start = time.perf_counter()
+    for q in query_embs:
+        store.search("", k=5, query_embedding=q)
+    search_s = time.perf_counter() - start
+
+    stats = store.stats()
+    return {
+        **stats,
+        "dedup_rate": round(stats["deduplicated"] / stats["added"], 3) if stats["added"] else 0.0,
+        "add_us": round(add_s / len(stream) * 1e6, 1),
+        "search_us": round(search_s / queries * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--memories", type=int, default=2000)
+    parser.add_argument("--dup-ratio", type=float, default=0.4, help="доля повторов среди новых воспоминаний")
+    parser.add_argument("--noise", type=float, default=0.1, help="шум повторов (0.1 ≈ косинус 0.99)")
+    parser.add_argument("--threshold", type=float, default=0.95)
+    parser.add_argument("--max-memories", type=int, default=0, help="предел памяти агента (0 — без предела)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    stream = make_stream(args.memories, args.dup_ratio, args.noise)
+    max_memories = args.max_memories or None
+    results = {
+        "memories": args.memories,
+        "dup_ratio": args.dup_ratio,
+        "max_memories": max_memories,
+        "no_dedup": run(stream, None, max_memories, args.queries),
+        "dedup": run(stream, args.threshold, max_memories, args.queries),
+    }
+    base, dedup = results["no_dedup"], results["dedup"]
+    results["search_speedup"] = round(base["search_us"] / dedup["search_us"], 2) if dedup["search_us"] else None
+
+    for name in ("no_dedup", "dedup"):
+        print(f"{name:10s} " + "  ".join(f"{k}={v}" for k, v in results[name].items()))
+    print(f"search speedup: {results['search_speedup']}x")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
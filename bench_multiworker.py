@@ -0,0 +1,209 @@
+"""
+Нагрузочный тест нескольких воркеров с локальной заменой LLM.
+
+    python bench_multiworker.py --workers 4 --games 16 --agents 4 --rounds 5
+    python bench_multiworker.py --workers 4 --routing random
+
+Воркеры запускаются в отдельных процессах во временном каталоге с общим бэкендом координации
+(STATE_BACKEND=sqlite), локальной имитацией LLM (LLM_BACKEND=fake, задержка --llm-latency
+с распределением --llm-latency-dist, ошибки 429 с долей --llm-429-rate) и эмбеддингами --embedder
+(по умолчанию hashing — без модели sentence-transformers). Каждая игра
+проигрывается последовательно (события, сообщения агентам, голосования), игры — параллельно.
+
+routing=affinity направляет игру на её воркер (как балансировщик с hash по game_id),
+routing=random — каждый запрос на случайный воркер. В конце проверяется, что ни одна запись
+не потеряна: число голосований, агентов и сообщений совпадает с ожидаемым, отношения обновлены голосованиями.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from embeddings import BACKENDS
+from state_backend import worker_for_game
+
+
+def run_stub_worker(index: int, host: str, port: int):
+    """Воркер с бэкендом LLM_BACKEND=fake (параметры имитации — из переменных окружения FAKE_LLM_*)"""
+    import uvicorn
+    os.environ["WORKER_ID"] = f"worker-{index}"
+    import main
+
+    uvicorn.run(main.app, host=host, port=port, log_level="warning")
+
+
+class Client:
+    def __init__(self, ports, routing: str, seed: int = 0):
+        self.ports = ports
+        self.routing = routing
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.conflicts = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def port_for(self, game_id: str) -> int:
+        if self.routing == "affinity":
+            return self.ports[worker_for_game(game_id, len(self.ports))]
+        with self._lock:
+            return self.rng.choice(self.ports)
+
+    def request(self, game_id: str, method: str, path: str, body=None, label: str = None):
+        url = f"http://127.0.0.1:{self.port_for(game_id)}{path}"
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as resp:
+                result = json.loads(resp.read() or b"null")
+        except urllib.error.HTTPError as e:
+            with self._lock:
+                if e.code == 409:
+                    self.conflicts += 1
+                else:
+                    self.errors += 1
+            raise
+        with self._lock:
+            self.latencies[label or path].append(time.perf_counter() - start)
+        return result
+
+
+def wait_ready(ports, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=2):
+                    break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker on port {port} did not start")
+                time.sleep(0.2)
+
+
+def play_game(client: Client, game_id: str, n_agents: int, rounds: int):
+    base = f"/games/{game_id}"
+    client.request(game_id, "POST", "/games", {"game_id": game_id}, label="create_game")
+    agent_ids = []
+    for i in range(n_agents):
+        agent = client.request(game_id, "POST", f"{base}/agents", {
+            "name": f"Агент {i}", "personality": "спокойный", "bunker_params": {"profession": "инженер"},
+        }, label="create_agent")
+        agent_ids.append(agent["id"])
+    context = {"game_state": {"round": 1, "alive_agents": agent_ids, "excluded": []}}
+    for r in range(rounds):
+        context["game_state"]["round"] = r + 1
+        client.request(game_id, "POST", f"{base}/event", {"description": f"Событие раунда {r + 1}"}, label="event")
+        for aid in agent_ids:
+            client.request(game_id, "POST", f"{base}/agents/{aid}/message",
+                           {"from_agent": None, "text": "Что скажешь?", "context": context}, label="message")
+        votes = {aid: agent_ids[(k + 1) % len(agent_ids)] for k, aid in enumerate(agent_ids)}
+        client.request(game_id, "POST", f"{base}/vote", {
+            "round": r + 1, "votes": votes, "excluded_id": "", "alive_agents": agent_ids,
+        }, label="vote")
+    return agent_ids
+
+
+def verify_game(client: Client, game_id: str, agent_ids, rounds: int):
+    """Проверка потерянных записей: все голосования, агенты и сообщения журнала игры на месте"""
+    base = f"/games/{game_id}"
+    problems = []
+    page = client.request(game_id, "GET", f"{base}/history/votes", label="verify")
+    if page["total"] != rounds:
+        problems.append(f"{game_id}: {page['total']} votes instead of {rounds}")
+    messages = client.request(game_id, "GET", f"{base}/messages?limit=1000", label="verify")
+    expected_messages = 2 * rounds * len(agent_ids)
+    if len(messages["items"]) != expected_messages:
+        problems.append(f"{game_id}: {len(messages['items'])} messages instead of {expected_messages}")
+    agents = client.request(game_id, "GET", f"{base}/agents", label="verify")
+    if len(agents) != len(agent_ids):
+        problems.append(f"{game_id}: {len(agents)} agents instead of {len(agent_ids)}")
+    for aid in agent_ids:
+        detail = client.request(game_id, "GET", f"{base}/agents/{aid}", label="verify")
+        if not detail["relationships"]:
+            problems.append(f"{game_id}/{aid}: vote results missing from relationships")
+    return problems
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--games", type=int, default=8)
+    parser.add_argument("--agents", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--routing", choices=["affinity", "random"], default="affinity")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="средняя задержка имитации LLM, секунд")
+    parser.add_argument("--llm-latency-dist", default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="доля ответов имитации LLM с ошибкой 429")
+    parser.add_argument("--embedder", choices=BACKENDS, default="hashing",
+                        help="бэкенд эмбеддингов: hashing — без модели, full/quantized/projection — sentence-transformers")
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    import multiprocessing
+    ports = [args.port + i for i in range(args.workers)]
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["STATE_BACKEND"] = "sqlite"
+        os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+        os.environ["LLM_BACKEND"] = "fake"
+        os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+        os.environ["FAKE_LLM_LATENCY_DIST"] = args.llm_latency_dist
+        os.environ["FAKE_LLM_RATE_LIMIT_RATE"] = str(args.llm_429_rate)
+        os.environ["EMBEDDING_BACKEND"] = args.embedder
+        ctx = multiprocessing.get_context("spawn")
+        processes = [ctx.Process(target=run_stub_worker, args=(i, "127.0.0.1", port), daemon=True)
+                     for i, port in enumerate(ports)]
+        for process in processes:
+            process.start()
+        try:
+            wait_ready(ports)
+            client = Client(ports, args.routing)
+            game_ids = [f"bench-{i}" for i in range(args.games)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.games) as pool:
+                agent_ids = list(pool.map(lambda gid: play_game(client, gid, args.agents, args.rounds), game_ids))
+            elapsed = time.perf_counter() - start
+            problems = [p for gid, ids in zip(game_ids, agent_ids) for p in verify_game(client, gid, ids, args.rounds)]
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
+            os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    requests_total = sum(len(v) for k, v in client.latencies.items() if k != "verify")
+    results = {
+        "workers": args.workers, "games": args.games, "routing": args.routing,
+        "requests": requests_total, "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests_total / elapsed, 1),
+        "conflicts_409": client.conflicts, "errors": client.errors,
+        "lost_writes": len(problems),
+        "latency_ms": {
+            label: {"p50": round(statistics.median(v) * 1000, 1), "p95": round(percentile(v, 0.95) * 1000, 1)}
+            for label, v in client.latencies.items() if label != "verify"
+        },
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    for problem in problems[:20]:
+        print("LOST:", problem)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Бенчмарк сохранения/загрузки агентов: JSON-документ против SQLite.
+
+    python bench_persistence.py --agents 100 --memories 1000
+
+Воспоминания генерируются со случайными эмбеддингами (без вызова модели),
+поэтому измеряется только стоимость хранилища. Загрузка JSON включает
+пересчёт эмбеддингов — это и есть её реальная цена.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from agent import Agent
+from persistence import save_agents, load_agents
+from sqlite_store import SQLiteStore
+
+EMBEDDING_DIM = 384
+
+
+def make_agents(n_agents: int, n_memories: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    agents = {}
+    start = datetime.now() - timedelta(days=1)
+    for i in range(n_agents):
+        agent = Agent(name=f"Агент {i}", personality="осторожный", bunker_params={"profession": "инженер"})
+        for j in range(n_memories):
+            emb = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+            agent.memory.memories.append({
+                'id': uuid.uuid4().hex,
+                'text': f"Агент {i}: воспоминание номер {j} о ходе обсуждения в бункере",
+                'embedding': emb,
+                'timestamp': start + timedelta(seconds=j),
+            })
+        agent.plans = [f"План {k}" for k in range(5)]
+        agents[agent.id] = agent
+    ids = list(agents)
+    for agent in agents.values():
+        for other in ids[:10]:
+            if other != agent.id:
+                agent.relationships[other] = 0.1
+    return agents
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def add_one_memory_each(agents):
+    for agent in agents.values():
+        agent.memory.memories.append({
+            'id': uuid.uuid4().hex,
+            'text': "Новое событие в бункере",
+            'embedding': np.zeros(EMBEDDING_DIM, dtype=np.float32),
+            'timestamp': datetime.now(),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--memories", type=int, default=1000)
+    parser.add_argument("--skip-json-load", action="store_true", help="не измерять загрузку JSON (пересчёт эмбеддингов)")
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    agents = make_agents(args.agents, args.memories)
+    results = {"agents": args.agents, "memories_per_agent": args.memories}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "agents_state.json")
+        db_path = os.path.join(tmp, "agents.db")
+
+        _, results["json_save_s"] = timed(save_agents, agents, json_path)
+        results["json_bytes"] = os.path.getsize(json_path)
+        if not args.skip_json_load:
+            _, results["json_load_s"] = timed(load_agents, json_path)
+
+        store = SQLiteStore(db_path)
+        _, results["sqlite_full_save_s"] = timed(store.save_agents, agents)
+        add_one_memory_each(agents)
+        _, results["sqlite_incremental_save_s"] = timed(store.save_agents, agents)
+        some_agent = next(iter(agents.values()))
+        _, results["sqlite_single_agent_save_s"] = timed(store.save_agent, some_agent)
+        _, results["sqlite_load_s"] = timed(store.load_agents)
+        _, results["sqlite_lazy_load_s"] = timed(store.load_agents, True)
+        _, results["sqlite_single_agent_load_s"] = timed(store.load_agent, some_agent.id)
+        store.close()
+        results["sqlite_bytes"] = sum(
+            os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p)
+        )
+
+    for key, value in results.items():
+        print(f"{key:32s} {value:.4f}" if isinstance(value, float) else f"{key:32s} {value}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Замер холодного старта сервиса: сколько стоит импорт main и через сколько отвечают /healthz, /agents и /readyz.
+
+    python bench_startup.py                       # разбивка времени импорта по пакетам (python -X importtime)
+    python bench_startup.py --serve --port 8010   # ещё и запуск uvicorn с опросом эндпоинтов
+
+Импорт выполняется в отдельном процессе, чтобы кеш модулей текущего интерпретатора не влиял на результат.
+Собственное время модулей суммируется по пакету верхнего уровня; отдельно показано, какие тяжёлые
+зависимости (torch, sentence_transformers, google.generativeai) попали в импорт main — после
+ленивой загрузки их там быть не должно, они подгружаются прогревом модели и первым вызовом LLM.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "google.generativeai")
+ENDPOINTS = ("/healthz", "/agents", "/readyz")
+
+
+def import_breakdown(module: str = "main", top: int = 15) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    by_package = defaultdict(int)
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        by_package[name.split(".")[0]] += int(self_us)
+        cumulative[name] = int(cumulative_us)
+    packages = sorted(by_package.items(), key=lambda item: -item[1])[:top]
+    return {
+        "wall_ms": round(wall * 1000, 1),
+        "import_ms": round(cumulative.get(module, 0) / 1000, 1),
+        "packages_ms": {name: round(us / 1000, 1) for name, us in packages},
+        "heavy_imported": {name: round(cumulative[name] / 1000, 1) for name in HEAVY_MODULES if name in cumulative},
+    }
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def serve_timeline(port: int, timeout: float) -> dict:
+    """Время от запуска uvicorn до первого успешного ответа каждого эндпоинта"""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    first_ok = {}
+    try:
+        while len(first_ok) < len(ENDPOINTS) and time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            for path in ENDPOINTS:
+                if path not in first_ok and _get(f"http://127.0.0.1:{port}{path}") == 200:
+                    first_ok[path] = round((time.perf_counter() - start) * 1000, 1)
+            time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {path: first_ok.get(path) for path in ENDPOINTS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="какой модуль импортировать")
+    parser.add_argument("--top", type=int, default=15, help="сколько самых дорогих пакетов показать")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов импорта (берётся лучший)")
+    parser.add_argument("--serve", action="store_true", help="запустить uvicorn и замерить время до ответов эндпоинтов")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--timeout", type=float, default=300.0, help="сколько ждать готовности сервиса, с")
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    runs = [import_breakdown(args.module, args.top) for _ in range(args.repeat)]
+    result = {"import": min(runs, key=lambda r: r["import_ms"])}
+    if args.serve:
+        result["first_ok_ms"] = serve_timeline(args.port, args.timeout)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
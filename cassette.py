@@ -0,0 +1,183 @@
+import asyncio
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Any, Iterator
+
+logger = logging.getLogger(__name__)
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (OFF, RECORD, REPLAY)
+
+
+def request_key(task: str, prompt: str, system_message: str = "") -> str:
+    return hashlib.sha1(f"{task}\0{system_message}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class CassetteMiss(LookupError):
+    """Запроса нет в кассете, а воспроизведение строгое: живой вызов модели в режиме replay недопустим."""
+
+    def __init__(self, task: str):
+        super().__init__(f"No recorded LLM call matches this {task!r} request")
+        self.task = task
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _parts(path: str) -> List[str]:
+    """Несжатые части записи в *.gz-кассету, оставшиеся от воркеров, которые не успели закрыть кассету"""
+    return sorted(glob.glob(f"{glob.escape(path)}.*.part")) if path.endswith(".gz") else []
+
+
+def _read_lines(path: str, opener) -> Iterator[Dict[str, Any]]:
+    with opener(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Оборванная последняя строка части, которую писал убитый воркер
+                logger.warning(f"Skipping truncated cassette line in {path}")
+
+
+def read_entries(path: str) -> Iterator[Dict[str, Any]]:
+    """Записи кассеты по порядку: task, prompt, system, response, latency, model"""
+    if os.path.exists(path) or not _parts(path):
+        yield from _read_lines(path, lambda p: _open(p, "r"))
+    for part in _parts(path):
+        yield from _read_lines(part, lambda p: open(p, encoding="utf-8"))
+
+
+class Cassette:
+    """
+    Запись и воспроизведение вызовов LLM: (задача, промпт, system) -> ответ и задержка.
+
+    Кассета — JSONL (сжатый gzip, если файл *.gz), по строке на успешный вызов. При записи строки
+    дописываются по мере ответов; запись в *.gz идёт в несжатую часть <path>.<pid>.part, которая сжимается
+    в кассету при закрытии — убитый воркер теряет не запись, а только её сжатие (часть читается как есть).
+    При воспроизведении ответ ищется по хешу запроса (повторы одного запроса отдаются в записанном порядке
+    по кругу). Промах (промпт с другим временем, памятью и т.п.) в строгом режиме — None; с strict=False
+    отдаются ответы той же задачи по кругу, и ответ тогда зависит от порядка вызовов, а не от запроса.
+    Задержка воспроизводится с множителем latency_scale (0 — без задержки).
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY, latency_scale: float = 1.0, strict: bool = True):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._by_task: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._counters: Dict[str, int] = {"recorded": 0, "hits": 0, "misses": 0, "task_fallbacks": 0}
+        self._file = None
+        self._part: Optional[str] = None
+        if mode == REPLAY:
+            self._load()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if path.endswith(".gz"):
+                self._part = f"{path}.{os.getpid()}.part"
+                self._file = open(self._part, "a", encoding="utf-8")
+            else:
+                self._file = _open(path, "a")
+
+    def _load(self):
+        count = 0
+        for entry in read_entries(self.path):
+            self._by_key[request_key(entry["task"], entry["prompt"], entry.get("system", ""))].append(entry)
+            self._by_task[entry["task"]].append(entry)
+            count += 1
+        logger.info(f"Loaded {count} LLM calls from cassette {self.path}")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def record(self, task: str, prompt: str, system_message: str, response: str, latency: float,
+               model: Optional[str] = None):
+        if self.mode != RECORD:
+            return
+        line = json.dumps({"task": task, "prompt": prompt, "system": system_message, "response": response,
+                           "latency": round(latency, 4), "model": model}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._counters["recorded"] += 1
+
+    def _next(self, queue: Deque[Dict[str, Any]]) -> Dict[str, Any]:
+        entry = queue[0]
+        queue.rotate(-1)
+        return entry
+
+    def lookup(self, task: str, prompt: str, system_message: str = "") -> Optional[Dict[str, Any]]:
+        """Записанный вызов для запроса; без точного совпадения — None (или ответ той же задачи при strict=False)"""
+        with self._lock:
+            exact = self._by_key.get(request_key(task, prompt, system_message))
+            if exact:
+                self._counters["hits"] += 1
+                return self._next(exact)
+            self._counters["misses"] += 1
+            same_task = None if self.strict else self._by_task.get(task)
+            if not same_task:
+                return None
+            self._counters["task_fallbacks"] += 1
+            return self._next(same_task)
+
+    async def replay(self, task: str, prompt: str, system_message: str = "") -> str:
+        entry = self.lookup(task, prompt, system_message)
+        if entry is None:
+            raise CassetteMiss(task)
+        if self.latency_scale > 0:
+            await asyncio.sleep(entry.get("latency", 0.0) * self.latency_scale)
+        return entry["response"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "path": self.path, "strict": self.strict, **self._counters}
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._part is not None and os.path.exists(self._part):
+            with open(self._part, "rb") as f:
+                data = f.read()
+            if data:
+                # Отдельный член gzip одной записью в конец файла: кассеты нескольких воркеров не перемешиваются
+                with open(self.path, "ab") as f:
+                    f.write(gzip.compress(data))
+            os.remove(self._part)
+        self._part = None
+
+
+def create_cassette(mode: str, path: str, latency_scale: float = 1.0, strict: bool = True) -> Optional[Cassette]:
+    """Кассета по настройкам из конфигурации; None, если режим "off" """
+    if mode not in MODES:
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    if mode == OFF or not path:
+        return None
+    return Cassette(path, mode, latency_scale, strict)
+
+
+def entries_by_task(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    result: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for entry in read_entries(path):
+        result[entry["task"]].append(entry)
+    return dict(result)
@@ -55,7 +55,90 @@ TASK_MODELS = {
 }
 
 AGENTS_FILE = "agents_state.json"
-HISTORY_FILE = "voting_history.json"
-MEMORY_THRESHOLD = 3
-BATCH_SIZE = 10
-SEMAPHORE = 10
\ No newline at end of file
+HISTORY_FILE = "voting_history.jsonl"
+LEGACY_HISTORY_FILE = "voting_history.json"
+SEMAPHORE = 10
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # "json" или "sqlite"
+SQLITE_FILE = os.getenv("SQLITE_FILE", "agents.db")
+
+BACKGROUND_WORKERS = 4
+BACKGROUND_MAX_PENDING = 1000
+BACKGROUND_MAX_DEFER = 2.0  # секунд, сколько фоновая задача может ждать окончания foreground-запросов
+
+# Адаптивный (AIMD) лимит параллельных вызовов LLM: общий на процесс и на пару (модель, ключ)
+LIMITER_MIN = 1
+LIMITER_MAX = 64
+LIMITER_PER_KEY_INITIAL = 4
+LIMITER_PER_KEY_MAX = 16
+# Приоритеты вызовов LLM: фоновые задачи занимают не больше этой доли общего лимита
+LLM_BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.5"))
+# SLO интерактивных вызовов (ответ в чате): p95 ожидания в очереди + вызова, секунд.
+# Пока он нарушен или интерактивные вызовы ждут слота, фоновые вызовы откладываются,
+# а не дождавшиеся за LLM_BACKGROUND_SHED_WAIT секунд — отбрасываются
+LLM_INTERACTIVE_SLO = float(os.getenv("LLM_INTERACTIVE_SLO", "5.0"))
+LLM_BACKGROUND_SHED_WAIT = float(os.getenv("LLM_BACKGROUND_SHED_WAIT", "10.0"))
+
+GAMES_DIR = "games"  # каталог с состоянием дополнительных игр: games/<game_id>/
+DEFAULT_GAME_ID = "default"  # игра маршрутов без префикса /games/{game_id}, хранится в файлах выше
+
+# Координация нескольких воркеров: "local" (один процесс) или "sqlite" (общий файл аренды и версий игр)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "local")
+STATE_SQLITE_FILE = os.getenv("STATE_SQLITE_FILE", os.path.join(GAMES_DIR, "state.db"))
+LEASE_TTL = 300.0  # секунд, после которых аренда упавшего воркера считается свободной
+LEASE_WAIT = 30.0  # секунд, сколько запрос ждёт освобождения игры другим воркером (затем 409)
+GAME_SNAPSHOTS_MAX = 32  # снимков игр в памяти процесса для ветвлений; самые старые вытесняются
+
+# Журнал сообщений игры на сервере: кольцевой буфер в памяти + дописываемый JSONL-файл
+MESSAGES_FILE = "messages.jsonl"
+MESSAGE_LOG_CAPACITY = 200
+MESSAGE_WINDOW = 5  # сколько последних сообщений попадает в промпт
+
+# Память агента: жёсткий предел числа воспоминаний и затухание давности при поиске
+MEMORY_MAX_PER_AGENT = 200
+MEMORY_HALF_LIFE = 1800.0  # секунд, за которые вклад давности в ранжирование падает вдвое
+MEMORY_RECENCY_FLOOR = 0.1  # минимальный вклад давности, чтобы важные старые воспоминания не пропадали из поиска
+# Слияние почти-дубликатов при добавлении воспоминания (None — выключено)
+MEMORY_DEDUP_THRESHOLD = 0.95  # косинусное сходство, начиная с которого запись считается дубликатом
+MEMORY_DEDUP_WINDOW = 50  # со сколькими последними воспоминаниями сравнивать
+# Эмбеддинги памяти: "full" — модель в полной точности, "quantized" — int8-квантованная модель,
+# "projection" — полная модель со случайной проекцией в EMBEDDING_DIM измерений, "hashing" — хеширование слов без модели.
+# Модель загружается фоновым прогревом при старте (или при первом обращении)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "full")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM")) if os.getenv("EMBEDDING_DIM") else None
+
+# Иерархическая суммаризация памяти (сырые воспоминания -> сводки раундов -> сводка игры)
+SUMMARY_RAW_TOKEN_BUDGET = 400  # объём сырых воспоминаний, после которого старые сворачиваются в сводку раунда
+SUMMARY_KEEP_RECENT = 6  # сколько последних сырых воспоминаний не сворачивать
+SUMMARY_ROUND_TOKEN_BUDGET = 300  # объём сводок раундов, после которого они сворачиваются в сводку игры
+SUMMARY_BATCH_AGENTS = 8  # сколько агентов суммаризируются одним вызовом LLM
+
+# Трассировка запроса по заголовку X-Trace: "1" — Server-Timing, "chrome" — файл трассы, "profile" — семплирующий профайлер
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+TRACE_HEADER = "X-Trace"
+# Режимы chrome и profile пишут файлы и нагружают CPU: только с заголовком X-Trace-Token, равным TRACE_TOKEN
+# (пустой токен — режимы выключены), остальным доступен лишь Server-Timing
+TRACE_TOKEN = os.getenv("TRACE_TOKEN", "")
+TRACE_TOKEN_HEADER = "X-Trace-Token"
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+TRACE_MAX_FILES = int(os.getenv("TRACE_MAX_FILES", "100"))  # сколько последних файлов трасс и профилей хранить
+PROFILE_INTERVAL = 0.005  # секунд между снимками стеков в режиме profile
+
+# Бэкенд LLM: "gemini" или "fake" — локальная имитация для нагрузочных тестов без расхода квоты
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+FAKE_LLM = {
+    "latency": float(os.getenv("FAKE_LLM_LATENCY", "0.5")),  # средняя задержка ответа, секунд
+    "latency_dist": os.getenv("FAKE_LLM_LATENCY_DIST", "lognormal"),  # fixed, uniform, exponential, lognormal
+    "latency_sigma": float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),  # разброс для lognormal
+    "rate_limit_rate": float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0")),  # доля ответов 429
+    "error_rate": float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),  # доля прочих ошибок
+    "failing_models": [m.strip() for m in os.getenv("FAKE_LLM_FAILING_MODELS", "").split(",") if m.strip()],
+    "seed": int(os.getenv("FAKE_LLM_SEED", "0")),
+}
+
+# Кассета вызовов LLM: "record" — записывать ответы живой игры, "replay" — отдавать записанные ответы, "off"
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "cassettes/llm.jsonl.gz")
+LLM_CASSETTE_LATENCY_SCALE = float(os.getenv("LLM_CASSETTE_LATENCY_SCALE", "1.0"))  # 0 — без задержки
+# "1" — промах воспроизведения отдаёт запасной ответ; "0" — ответ той же задачи по кругу (зависит от порядка вызовов)
+LLM_CASSETTE_STRICT = os.getenv("LLM_CASSETTE_STRICT", "1") == "1"
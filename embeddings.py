@@ -0,0 +1,208 @@
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Сохранения без метки сделаны до появления бэкендов — всегда полной моделью по умолчанию
+LEGACY_TAG = "full:all-MiniLM-L6-v2"
+BACKENDS = ("full", "quantized", "projection", "hashing")
+
+WORD_RE = re.compile(r"\w+")
+
+
+class EmbeddingMismatchError(ValueError):
+    """Эмбеддинги посчитаны другим бэкендом (другое пространство или размерность) и несовместимы с текущим."""
+
+    def __init__(self, expected: str, found: str):
+        super().__init__(f"Embeddings tagged {found!r} cannot be mixed with backend {expected!r}; "
+                         f"re-encode memories or set EMBEDDING_BACKEND to match")
+        self.expected = expected
+        self.found = found
+
+
+class EmbeddingBackend:
+    """
+    Бэкенд эмбеддингов: encode(str) -> вектор, encode(list) -> матрица (float32).
+    tag однозначно задаёт пространство эмбеддингов и сохраняется вместе с ними: векторы с разными метками
+    сравнивать нельзя. dim — размерность вектора (для моделей известна после загрузки).
+    """
+    kind = "base"
+
+    @property
+    def tag(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def dim(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def loaded(self) -> bool:
+        return True
+
+    def load(self):
+        """Подготовить бэкенд заранее (загрузить модель); для лёгких бэкендов ничего не делает"""
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def encode(self, text: Union[str, List[str]]) -> np.ndarray:
+        if isinstance(text, list):
+            if not text:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            return np.asarray(self._encode_batch(text), dtype=np.float32)
+        return np.asarray(self._encode_batch([text])[0], dtype=np.float32)
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Модель sentence-transformers в полной точности; модель и torch загружаются при первом обращении"""
+    kind = "full"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def tag(self) -> str:
+        return f"{self.kind}:{self.model_name}"
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def _create(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name, device="cpu")
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._create()
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self.load().get_sentence_embedding_dimension()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.load().encode(texts, convert_to_numpy=True)
+
+
+class QuantizedBackend(SentenceTransformerBackend):
+    """
+    Та же модель с динамическим квантованием линейных слоёв в int8 (torch.quantization.quantize_dynamic):
+    быстрее на CPU, векторы близки к полной модели, но не совпадают — поэтому отдельная метка.
+    """
+    kind = "quantized"
+
+    def _create(self):
+        import torch
+        model = super()._create()
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class ProjectionBackend(EmbeddingBackend):
+    """
+    Случайная проекция эмбеддингов базового бэкенда в dim измерений (Джонсон — Линденштраусс):
+    косинусная близость примерно сохраняется, а матрица памяти и поиск по ней становятся в base.dim / dim раз легче.
+    Матрица проекции детерминирована seed, поэтому метка включает и его.
+    """
+    kind = "projection"
+
+    def __init__(self, base: EmbeddingBackend, dim: int, seed: int = 0):
+        self.base = base
+        self._dim = dim
+        self.seed = seed
+        self._matrix: Optional[np.ndarray] = None
+
+    @property
+    def tag(self) -> str:
+        return f"{self.kind}{self._dim}.{self.seed}:{self.base.tag}"
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    @property
+    def loaded(self) -> bool:
+        return self.base.loaded
+
+    def load(self):
+        self.base.load()
+
+    def _projection(self) -> np.ndarray:
+        if self._matrix is None:
+            rng = np.random.default_rng(self.seed)
+            matrix = rng.standard_normal((self.base.dim, self._dim)).astype(np.float32)
+            self._matrix = matrix / np.sqrt(self._dim)
+        return self._matrix
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.base.encode(texts), dtype=np.float32) @ self._projection()
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    Мешок слов со знаковым хешированием в вектор фиксированной длины — без модели и внешних зависимостей.
+    Ловит только совпадение слов, годится для тестов, бенчмарков и как запасной вариант.
+    """
+    kind = "hashing"
+
+    def __init__(self, dim: int = 384):
+        self._dim = dim
+
+    @property
+    def tag(self) -> str:
+        return f"{self.kind}:{self._dim}"
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in WORD_RE.findall(text.lower()):
+                h = zlib.crc32(word.encode("utf-8"))
+                matrix[row, h % self._dim] += 1.0 if h & 1 << 31 else -1.0
+        return matrix
+
+
+_backends: Dict[Tuple, EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def create_embedding_backend(kind: str, model_name: str, dim: Optional[int] = None, seed: int = 0) -> EmbeddingBackend:
+    """
+    Бэкенд по настройкам; один экземпляр на процесс для одинаковых параметров (модель разделяется всеми агентами).
+    dim — размерность для projection (по умолчанию 128) и hashing (по умолчанию 384).
+    """
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {kind}")
+    key = (kind, model_name, dim, seed)
+    backend = _backends.get(key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(key)
+            if backend is None:
+                if kind == "full":
+                    backend = SentenceTransformerBackend(model_name)
+                elif kind == "quantized":
+                    backend = QuantizedBackend(model_name)
+                elif kind == "projection":
+                    backend = ProjectionBackend(create_embedding_backend("full", model_name), dim or 128, seed)
+                else:
+                    backend = HashingBackend(dim or 384)
+                _backends[key] = backend
+    return backend
+
+
+def check_tag(backend: EmbeddingBackend, tag: Optional[str]):
+    """Отклонить эмбеддинги, посчитанные другим бэкендом (tag None — сохранение до появления меток)"""
+    found = tag or LEGACY_TAG
+    if found != backend.tag:
+        raise EmbeddingMismatchError(backend.tag, found)
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import random
+import re
+import zlib
+from typing import Iterable
+
+from llm_client import LLMClient
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+CARD_RE = re.compile(r"Ты раскрываешь карту «([^»]+)»")
+VOTE_RE = re.compile(r"из следующих игроков: (.+?)\.\s*\n")
+BATCH_ITEM_RE = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+
+PHRASES = (
+    "Я готов работать на общее благо и не подведу группу.",
+    "Давайте решать спокойно, паника нам сейчас не поможет.",
+    "Мне кажется, нам стоит держаться вместе и делить запасы поровну.",
+    "Я не доверяю тем, кто отмалчивается в обсуждении.",
+    "Без меня вам будет труднее пережить первые месяцы.",
+)
+PLANS = (
+    "Убедить всех, что я полезен, и найти союзника до голосования.",
+    "Проголосовать против самого молчаливого игрока.",
+    "Предложить план распределения еды и воды.",
+)
+
+
+class FakeLLMClient(LLMClient):
+    """
+    Локальная имитация LLM для нагрузочных тестов без квоты Gemini.
+
+    Задержка берётся из распределения (fixed, uniform, exponential, lognormal со средним latency),
+    с вероятностью rate_limit_rate вызов падает ошибкой 429, с вероятностью error_rate — обычной ошибкой;
+    модели из failing_models всегда отвечают 429 (для воспроизведения перебора цепочки моделей).
+    Ответ детерминирован текстом промпта и узнаёт задачу по промпту: [карта] для инициативы,
+    число для тональности, имя игрока для голосования, JSON для пакетной суммаризации.
+    """
+
+    def __init__(self, model_name: str, api_key: str = None, latency: float = 0.5, latency_dist: str = "lognormal",
+                 latency_sigma: float = 0.5, rate_limit_rate: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_latency: float = 0.05, failing_models: Iterable[str] = (), seed: int = 0):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {latency_dist}")
+        self.model_name = model_name
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.rate_limit_latency = rate_limit_latency
+        self.failing = model_name in set(failing_models)
+        # Свой генератор на пару (модель, ключ): одинаковый seed даёт одинаковую последовательность задержек и ошибок
+        self._rng = random.Random(zlib.crc32(f"{seed}:{model_name}:{api_key}".encode("utf-8")))
+
+    def sample_latency(self) -> float:
+        if self.latency_dist == "fixed":
+            return self.latency
+        if self.latency_dist == "uniform":
+            return self._rng.uniform(0, 2 * self.latency)
+        if self.latency_dist == "exponential":
+            return self._rng.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+        mu = -self.latency_sigma ** 2 / 2
+        return self.latency * self._rng.lognormvariate(mu, self.latency_sigma)
+
+    async def generate(self, prompt: str, system_message: str = "") -> str:
+        roll = self._rng.random()
+        if self.failing or roll < self.rate_limit_rate:
+            await asyncio.sleep(self.rate_limit_latency)
+            raise RuntimeError(f"429 Resource has been exhausted (fake {self.model_name})")
+        await asyncio.sleep(self.sample_latency())
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError(f"500 Internal error (fake {self.model_name})")
+        return self.respond(f"{system_message}\n\n{prompt}" if system_message else prompt)
+
+    @staticmethod
+    def _pick(options, prompt: str):
+        return options[zlib.crc32(prompt.encode("utf-8")) % len(options)]
+
+    @classmethod
+    def respond(cls, prompt: str) -> str:
+        """Детерминированный ответ в формате, которого ждёт вызывающий код"""
+        if "Оцени эмоциональную окраску" in prompt:
+            return f"{(zlib.crc32(prompt.encode('utf-8')) % 201 - 100) / 100:.2f}"
+        card = CARD_RE.search(prompt)
+        if card:
+            return f"[{card.group(1)}] {cls._pick(PHRASES, prompt)}"
+        vote = VOTE_RE.search(prompt)
+        if vote:
+            return cls._pick([name.strip() for name in vote.group(1).split(",")], prompt)
+        if "JSON" in prompt:
+            indexes = BATCH_ITEM_RE.findall(prompt)
+            return json.dumps({i: f"Я помню, что в раунде многое решалось ({i})." for i in indexes},
+                              ensure_ascii=False)
+        if "Суммируй" in prompt or "Объедини сводки" in prompt:
+            return "Я помню главное: шло обсуждение, кто полезнее для выживания."
+        if "сформулируй свою текущую цель" in prompt:
+            return cls._pick(PLANS, prompt)
+        return cls._pick(PHRASES, prompt)
@@ -0,0 +1,84 @@
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+
+def make_etag(*parts) -> str:
+    return '"' + ".".join(str(part) for part in parts) + '"'
+
+
+class ResponseCache:
+    """
+    Сериализованные ответы по ключу (эндпоинт и параметры) вместе с ETag, под который они собраны.
+    Тело пересобирается, только если ETag изменился; самые старые ключи вытесняются сверх capacity.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: Hashable, etag: str) -> Optional[bytes]:
+        """Тело, собранное под этот ETag, или None"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != etag:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def store(self, key: Hashable, etag: str, body: bytes) -> bytes:
+        self._entries[key] = (etag, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        return body
+
+    def get(self, key: Hashable, etag: str, build: Callable[[], bytes]) -> bytes:
+        body = self.lookup(key, etag)
+        return body if body is not None else self.store(key, etag, build())
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка If-None-Match: список тегов через запятую, "*" и слабые теги W/"..." """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def serialize(content: Any) -> bytes:
+    """JSON как у JSONResponse FastAPI (модели Pydantic — по алиасам полей)"""
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 без тела, если клиент уже видел эту версию"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def cached_response(request: Request, etag: str, body: bytes, media_type: str = "application/json") -> Response:
+    """304, если клиент уже видел эту версию, иначе тело с ETag"""
+    return not_modified(request, etag) or Response(
+        content=body, media_type=media_type, headers={"ETag": etag, "Cache-Control": "no-cache"})
@@ -0,0 +1,206 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Tuple, Any, Optional
+
+SUCCESS = "success"
+RATE_LIMITED = "rate_limited"
+ERROR = "error"
+
+# Классы приоритета вызовов LLM по убыванию важности: ответ в чате, шаг игры, фоновые задачи (планы, суммаризация)
+INTERACTIVE = "interactive"
+STEP = "step"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, STEP, BACKGROUND)
+
+_priority: ContextVar[str] = ContextVar("llm_priority", default=STEP)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def set_priority(priority: str):
+    """Задать класс приоритета для вызовов LLM в текущем контексте (запросе или фоновой задаче)"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}")
+    _priority.set(priority)
+
+
+@contextmanager
+def priority_scope(priority: str):
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LoadShedError(Exception):
+    """Фоновый вызов LLM отклонён: задержка интерактивных вызовов выходит за SLO."""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Ошибки квоты/лимита запросов (429, quota, rate limit, resource exhausted)"""
+    message = str(error).lower()
+    return ("429" in message or "quota" in message or "rate limit" in message
+            or "resource exhausted" in message or "resourceexhausted" in message)
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель параллелизма с AIMD: лимит растёт на ~1 за «окно» успешных вызовов
+    и уменьшается в decrease раз при ошибке лимита (не чаще раза за cooldown секунд).
+    Ожидающие обслуживаются по приоритету (interactive, step, background), внутри класса — по порядку (FIFO).
+    Фоновые вызовы занимают не больше background_share лимита, чтобы для интерактивных всегда оставались слоты.
+    """
+
+    def __init__(self, initial: float, min_limit: float = 1, max_limit: float = 64,
+                 decrease: float = 0.5, cooldown: float = 1.0, background_share: float = 1.0):
+        self.limit = float(initial)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.background_share = background_share
+        self.in_flight = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {p: deque() for p in PRIORITIES}
+        self._last_decrease = 0.0
+        self._counters: Dict[str, int] = {SUCCESS: 0, RATE_LIMITED: 0, ERROR: 0}
+
+    def _has_capacity(self, priority: str = STEP) -> bool:
+        limit = max(1, int(self.limit))
+        if priority == BACKGROUND:
+            limit = max(1, int(limit * self.background_share))
+        return self.in_flight < limit
+
+    def waiting(self, priority: Optional[str] = None) -> int:
+        if priority is not None:
+            return len(self._waiters[priority])
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def try_acquire(self, priority: str = STEP) -> bool:
+        """Занять слот без ожидания; False, если слотов нет или ждут вызовы того же или более высокого приоритета"""
+        for p in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+            if self._waiters[p]:
+                return False
+        if not self._has_capacity(priority):
+            return False
+        self.in_flight += 1
+        return True
+
+    async def acquire(self, priority: str = STEP):
+        if self.try_acquire(priority):
+            return
+        fut = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[priority]
+        waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот уже был выдан — возвращаем его
+                self.in_flight -= 1
+                self._wake()
+            else:
+                waiters.remove(fut)
+            raise
+
+    def release(self, outcome: str = SUCCESS):
+        self.in_flight -= 1
+        self._counters[outcome] = self._counters.get(outcome, 0) + 1
+        if outcome == SUCCESS:
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+        elif outcome == RATE_LIMITED:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = now
+        self._wake()
+
+    def _wake(self):
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters and self._has_capacity(priority):
+                fut = waiters.popleft()
+                if not fut.done():
+                    self.in_flight += 1
+                    fut.set_result(None)
+            if waiters:
+                # Более низкие классы не обгоняют ждущих выше
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting(),
+            "waiting_by_priority": {p: len(w) for p, w in self._waiters.items() if w},
+            **self._counters,
+        }
+
+
+class LimiterRegistry:
+    """Общий лимит на процесс плюс отдельный лимит на каждую пару (модель, API-ключ)."""
+
+    def __init__(self, global_initial: float = 10, per_key_initial: float = 4,
+                 min_limit: float = 1, max_limit: float = 64, per_key_max: float = 16,
+                 background_share: float = 1.0):
+        self.global_limiter = AdaptiveLimiter(global_initial, min_limit, max_limit, background_share=background_share)
+        self.per_key_initial = per_key_initial
+        self.min_limit = min_limit
+        self.per_key_max = per_key_max
+        self._per_key: Dict[Tuple[str, int], AdaptiveLimiter] = {}
+
+    def for_key(self, model: str, key_index: int) -> AdaptiveLimiter:
+        limiter = self._per_key.get((model, key_index))
+        if limiter is None:
+            limiter = AdaptiveLimiter(self.per_key_initial, self.min_limit, self.per_key_max)
+            self._per_key[(model, key_index)] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Any]:
+        """Ключи API не раскрываются: пары обозначаются как model#индекс_ключа"""
+        return {
+            "global": self.global_limiter.stats(),
+            "per_key": {f"{model}#{idx}": lim.stats() for (model, idx), lim in self._per_key.items()},
+        }
+
+
+class LatencySLO:
+    """
+    Задержка интерактивных вызовов LLM (ожидание в очереди + вызов) за последние horizon секунд
+    и проверка её p95 против цели target. Старые замеры отбрасываются, чтобы после всплеска
+    фоновая работа не оставалась заблокированной без новых интерактивных вызовов.
+    """
+
+    def __init__(self, target: float, window: int = 100, horizon: float = 30.0, min_samples: int = 5):
+        self.target = target
+        self.horizon = horizon
+        self.min_samples = min_samples
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+
+    def observe(self, latency: float):
+        self._samples.append((time.monotonic(), latency))
+
+    def p95(self) -> Optional[float]:
+        cutoff = time.monotonic() - self.horizon
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        if len(self._samples) < self.min_samples:
+            return None
+        values = sorted(latency for _, latency in self._samples)
+        return values[min(len(values) - 1, int(0.95 * len(values)))]
+
+    def at_risk(self) -> bool:
+        p95 = self.p95()
+        return p95 is not None and p95 > self.target
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {"target": self.target, "p95": round(p95, 3) if p95 is not None else None,
+                "samples": len(self._samples), "at_risk": p95 is not None and p95 > self.target}
@@ -1,14 +1,25 @@
 import logging
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 import asyncio
 
+from limiter import is_rate_limit_error
+from tracing import span, traced, run_in_executor
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-class GeminiClient:
+class LLMClient:
+    """Интерфейс бэкенда LLM: один клиент на пару (модель, API-ключ)."""
+
+    async def generate(self, prompt: str, system_message: str = "") -> str:
+        raise NotImplementedError
+
+
+class GeminiClient(LLMClient):
     def __init__(self, model_name, api_key=None, retries=1, base_delay=1):
+        # SDK импортируется при создании первого клиента (первом вызове LLM), а не при старте сервиса
+        import google.generativeai as genai
         if api_key:
             genai.configure(api_key=api_key)
         else:
@@ -18,18 +29,29 @@ class GeminiClient:
         self.retries = retries
         self.base_delay = base_delay
 
+    @traced("gemini.generate")
     async def generate(self, prompt: str, system_message: str = "") -> str:
         full_prompt = f"{system_message}\n\n{prompt}" if system_message else prompt
-        loop = asyncio.get_event_loop()
 
         for attempt in range(1, self.retries + 1):
             try:
-                response = await loop.run_in_executor(None, self.model.generate_content, full_prompt)
+                with span("gemini.generate_content", attempt=attempt):
+                    response = await run_in_executor(self.model.generate_content, full_prompt)
                 result = response.text
                 logger.info(f"LLM response (attempt {attempt}): {result[:100]}...")
                 return result
             except Exception as e:
-                if attempt == self.retries or "429" in str(e) or "quota" in str(e).lower() or "rate limit" in str(e).lower():
+                if attempt == self.retries or is_rate_limit_error(e):
                     raise
                 delay = self.base_delay * (2 ** (attempt - 1))
                 await asyncio.sleep(delay)
+
+
+def create_llm_client(backend: str, model_name: str, api_key: str = None, **options) -> LLMClient:
+    """Выбрать бэкенд LLM по имени из конфигурации ("gemini" или "fake" — локальная имитация для нагрузочных тестов)."""
+    if backend == "gemini":
+        return GeminiClient(model_name=model_name, api_key=api_key)
+    if backend == "fake":
+        from fake_llm import FakeLLMClient
+        return FakeLLMClient(model_name=model_name, api_key=api_key, **options)
+    raise ValueError(f"Unknown LLM backend: {backend}")
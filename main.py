@@ -1,23 +1,48 @@
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional, Dict
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, APIRouter, HTTPException, Body, Query, Depends, Request
+from fastapi.responses import JSONResponse, Response
 import uvicorn
 import logging
 import atexit
-import os
 
-from config import TASK_MODELS, API_KEYS, AGENTS_FILE, HISTORY_FILE, MEMORY_THRESHOLD, BATCH_SIZE, SEMAPHORE
+from config import (
+    TASK_MODELS, API_KEYS, AGENTS_FILE, HISTORY_FILE, LEGACY_HISTORY_FILE,
+    SEMAPHORE, STORAGE_BACKEND, SQLITE_FILE, BACKGROUND_WORKERS, BACKGROUND_MAX_PENDING, BACKGROUND_MAX_DEFER,
+    LIMITER_MIN, LIMITER_MAX, LIMITER_PER_KEY_INITIAL, LIMITER_PER_KEY_MAX, GAMES_DIR, DEFAULT_GAME_ID,
+    LLM_BACKGROUND_SHARE, LLM_INTERACTIVE_SLO, LLM_BACKGROUND_SHED_WAIT,
+    STATE_BACKEND, STATE_SQLITE_FILE, LEASE_TTL, LEASE_WAIT, MESSAGES_FILE, MESSAGE_LOG_CAPACITY, MESSAGE_WINDOW,
+    GAME_SNAPSHOTS_MAX,
+    SUMMARY_RAW_TOKEN_BUDGET, SUMMARY_KEEP_RECENT, SUMMARY_ROUND_TOKEN_BUDGET, SUMMARY_BATCH_AGENTS,
+    TRACING_ENABLED, TRACE_HEADER, TRACE_TOKEN, TRACE_TOKEN_HEADER, TRACE_DIR, TRACE_MAX_FILES,
+    PROFILE_INTERVAL, LLM_BACKEND, FAKE_LLM,
+    LLM_CASSETTE_MODE, LLM_CASSETTE, LLM_CASSETTE_LATENCY_SCALE, LLM_CASSETTE_STRICT
+)
 from agent import Agent
+from memory import default_embedder
 from models import (
     AgentCreate, AgentResponse, AgentDetailResponse, StepResponse, StepRequest,
     MessageToAgentRequest, VoteResponse, VoteRequest, VoteResultRequest,
-    EventRequest, RelationshipGraphResponse, RelationshipEdge, RelationshipNode, ThreatParams, DisasterParams,
-    BunkerParams
+    EventRequest, RelationshipGraphResponse, RelationshipGraphDelta, ThreatParams, DisasterParams,
+    BunkerParams, VoteHistoryPage, AgentVoteStats, GameContext, GameCreate, GameInfo, MessagePage,
+    SnapshotInfo, ForkRequest
 )
 from ModelManager import ModelManager
-from persistence import save_agents, load_agents, load_history, save_history
+from session import GameSession, SessionManager, GameBusyError
+from state_backend import create_state_backend, default_worker_id, worker_for_game
+from scheduler import BackgroundScheduler
+from limiter import LimiterRegistry, set_priority, INTERACTIVE
+from cassette import create_cassette
+from summarizer import Summarizer
+from http_cache import cached_response, make_etag, not_modified, serialize
+from metrics import (
+    REGISTRY, CONTENT_TYPE, HTTP_REQUEST_SECONDS, AUTO_SAVE_SECONDS, BACKGROUND_QUEUE_DEPTH, BACKGROUND_RUNNING
+)
+import tracing
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -27,24 +52,244 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("huggingface_hub").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-app = FastAPI(title="Agent Core API", description="Микросервис для управления агентами в игре 'Бункер'", version="1.0.0")
-
-agents = load_agents(AGENTS_FILE)
-voting_history = load_history(HISTORY_FILE)
-model_manager = ModelManager(TASK_MODELS, API_KEYS)
-current_bunker: Optional[Dict] = None
-current_disaster: Optional[Dict] = None
-current_threat: Optional[Dict] = None
+# Игры загружаются при первом обращении; модели эмбеддингов, LLM-клиенты, лимитер и очередь фоновых задач общие.
+# При нескольких воркерах игра арендуется на время запроса через общий бэкенд координации (STATE_BACKEND=sqlite)
+sessions = SessionManager(STORAGE_BACKEND, GAMES_DIR, DEFAULT_GAME_ID,
+                          AGENTS_FILE, HISTORY_FILE, SQLITE_FILE, LEGACY_HISTORY_FILE,
+                          state=create_state_backend(STATE_BACKEND, STATE_SQLITE_FILE), owner=default_worker_id(),
+                          lease_ttl=LEASE_TTL, lease_wait=LEASE_WAIT, messages_file=MESSAGES_FILE,
+                          message_capacity=MESSAGE_LOG_CAPACITY, message_window=MESSAGE_WINDOW,
+                          max_snapshots=GAME_SNAPSHOTS_MAX)
+# Один адаптивный лимитер на процесс: /step, /message и фоновые задачи делят общую квоту
+model_manager = ModelManager(TASK_MODELS, API_KEYS, LimiterRegistry(
+    global_initial=SEMAPHORE, per_key_initial=LIMITER_PER_KEY_INITIAL,
+    min_limit=LIMITER_MIN, max_limit=LIMITER_MAX, per_key_max=LIMITER_PER_KEY_MAX,
+    background_share=LLM_BACKGROUND_SHARE
+), backend=LLM_BACKEND, client_options=FAKE_LLM if LLM_BACKEND == "fake" else None,
+   cassette=create_cassette(LLM_CASSETTE_MODE, LLM_CASSETTE, LLM_CASSETTE_LATENCY_SCALE, LLM_CASSETTE_STRICT),
+   interactive_slo=LLM_INTERACTIVE_SLO, shed_wait=LLM_BACKGROUND_SHED_WAIT)
+scheduler = BackgroundScheduler(BACKGROUND_WORKERS, BACKGROUND_MAX_PENDING, BACKGROUND_MAX_DEFER)
+# Суммаризация памяти всех агентов игры пакетами: один вызов LLM на несколько агентов
+summarizer = Summarizer(model_manager, SUMMARY_RAW_TOKEN_BUDGET, SUMMARY_KEEP_RECENT,
+                        SUMMARY_ROUND_TOKEN_BUDGET, SUMMARY_BATCH_AGENTS)
+
+BACKGROUND_QUEUE_DEPTH.set_function(lambda: scheduler.stats()["pending"])
+BACKGROUND_RUNNING.set_function(lambda: scheduler.stats()["running"])
 
 def auto_save():
-    save_agents(agents, AGENTS_FILE)
-    save_history(voting_history, HISTORY_FILE)
+    with AUTO_SAVE_SECONDS.time():
+        sessions.save_all()
 
 atexit.register(auto_save)
 
+async def get_session(game_id: str = DEFAULT_GAME_ID):
+    """
+    Игра запроса: из пути /games/{game_id}/... или из query-параметра game_id
+    (маршруты без префикса работают с игрой по умолчанию). На время запроса игра арендуется воркером.
+    """
+    try:
+        session = sessions.get(game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    try:
+        await sessions.checkout(session)
+    except GameBusyError as e:
+        raise HTTPException(status_code=409, detail=f"Game is busy on worker {e.owner}")
+    try:
+        yield session
+    finally:
+        sessions.checkin(session)
+
+def dialogue_for(session: GameSession, context: GameContext) -> Optional[str]:
+    """
+    Окно диалога для промптов из журнала игры. Если клиент по-старому прислал recent_messages,
+    возвращается None и агент форматирует присланные сообщения сам.
+    """
+    if context.recent_messages is not None:
+        return None
+    return session.messages.window_text(round=context.round, cursor=context.cursor)
+
+def schedule_summarize(session: GameSession, round: Optional[int] = None):
+    """Фоновая суммаризация памяти агентов игры (повторные запросы по игре склеиваются)"""
+
+    async def job():
+        # Аренда держится только вокруг выбора и применения сводок: вызовы LLM идут без неё,
+        # чтобы запросы других воркеров к игре не ждали суммаризацию
+        await summarizer.run(lambda: session.agents, round=round,
+                             hold=lambda: sessions.lease(session), commit=session.save)
+
+    scheduler.submit(("summarize", session.game_id), job)
+
+def schedule_plan_update(session: GameSession, agent: Agent, context: GameContext):
+    """Фоновое обновление плана; выполнится только последний запрос для агента"""
+    agent_id = agent.id
+
+    async def job():
+        # Как и при суммаризации, аренда держится при сборке промпта и записи плана, но не во время вызова LLM
+        async with sessions.lease(session):
+            current = session.agents.get(agent_id)
+            if current is None:
+                return
+            prompt = current.plan_prompt(
+                context_messages=context.recent_messages,
+                game_state=context.game_state,
+                recent_events=context.recent_events,
+                scenario=session.scenario,
+                dialogue=dialogue_for(session, context)
+            )
+        with tracing.span("agent.update_plan", agent=current.name):
+            plan = await model_manager.generate_with_fallback("plan", prompt)
+        async with sessions.lease(session):
+            # Пока аренды не было, игру могли перечитать или сбросить: агент берётся заново
+            current = session.agents.get(agent_id)
+            if current is None:
+                return
+            await current.add_plan(plan)
+            session.save()
+
+    scheduler.submit(("plan", session.game_id, agent_id), job)
+
+async def hydrate_agents(targets):
+    """Подгрузить память агентов в пуле потоков, не блокируя event loop"""
+    for agent in list(targets):
+        if not agent.is_hydrated:
+            with tracing.span("agent.hydrate", agent=agent.name):
+                await tracing.run_in_executor(agent.hydrate)
+
+# Прогресс фонового прогрева для /readyz
+warm_up_state = {"started_at": None, "model_seconds": None, "agents_seconds": None, "error": None}
+
+async def warm_up_model():
+    """Загрузить модель эмбеддингов и прогнать пробный эмбеддинг, пока сервис уже отвечает"""
+    start = time.perf_counter()
+    embedder = default_embedder()
+    await tracing.run_in_executor(embedder.encode, "прогрев")
+    warm_up_state["model_seconds"] = round(time.perf_counter() - start, 3)
+    logger.info(f"Embeddings {embedder.tag} ready in {warm_up_state['model_seconds']:.2f}s")
+
+async def warm_up_agents():
+    start = time.perf_counter()
+    loaded = sessions.load_all()
+    for session in loaded:
+        await hydrate_agents(session.agents.values())
+    total = sum(len(session.agents) for session in loaded)
+    warm_up_state["agents_seconds"] = round(time.perf_counter() - start, 3)
+    logger.info(f"Hydrated {total} agents in {len(loaded)} games in {time.perf_counter() - start:.2f}s")
+
+async def warm_up():
+    warm_up_state["started_at"] = datetime.now().isoformat()
+    try:
+        # Сначала модель: восстановление памяти агентов всё равно считает эмбеддинги
+        await warm_up_model()
+        await warm_up_agents()
+    except Exception as e:
+        warm_up_state["error"] = repr(e)
+        logger.exception("Warm-up failed")
+
+def check_embeddings():
+    """
+    Сохранённые эмбеддинги всех игр должны быть посчитаны текущим бэкендом: иначе восстановление памяти
+    падало бы в каждом запросе к агенту. Проверяются только метки в хранилище, модель не загружается.
+    """
+    embedder = default_embedder()
+    mismatches = sessions.embedding_mismatches(embedder)
+    if mismatches:
+        games = "; ".join(f"{game_id}: {', '.join(tags)}" for game_id, tags in sorted(mismatches.items()))
+        raise RuntimeError(f"Stored embeddings do not match backend {embedder.tag!r} ({games}). "
+                           f"Set EMBEDDING_BACKEND/EMBEDDING_MODEL/EMBEDDING_DIM to the stored backend "
+                           f"or re-encode the memories of these games")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_embeddings()
+    scheduler.start()
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    await scheduler.stop()
+    if model_manager.cassette is not None:
+        model_manager.cassette.close()
+
+app = FastAPI(title="Agent Core API", description="Микросервис для управления агентами в игре 'Бункер'", version="1.0.0",
+              lifespan=lifespan)
+# Маршруты игры: подключаются и без префикса (игра по умолчанию), и под /games/{game_id}
+router = APIRouter()
+GAME_PREFIX = "/games/{game_id}"
+
+@app.middleware("http")
+async def mark_foreground(request, call_next):
+    """POST-запросы считаются интерактивными: пока они выполняются, фоновые задачи ждут"""
+    if request.method != "POST":
+        return await call_next(request)
+    async with scheduler.foreground():
+        return await call_next(request)
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    if route is None:
+        return "<unmatched>"
+    # Маршруты игры подключены дважды; в зависимости от версии FastAPI route.path может быть без префикса
+    if "game_id" in scope.get("path_params", {}) and "{game_id}" not in route.path:
+        return GAME_PREFIX + route.path
+    return route.path
+
+@app.middleware("http")
+async def record_latency(request, call_next):
+    """Длительность запросов по шаблону маршрута (а не по пути), чтобы число серий не росло с числом игр"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUEST_SECONDS.labels(request.method, route_template(request.scope), status).observe(
+            time.perf_counter() - start)
+
+@app.middleware("http")
+async def trace_request(request, call_next):
+    """
+    Трассировка запроса по заголовку X-Trace: "1" — разбивка времени по спанам в Server-Timing,
+    "chrome" — ещё и файл Chrome-трассы в TRACE_DIR, "profile" — семплирующий профайлер на время запроса
+    (collapsed stacks в TRACE_DIR). Режимы можно перечислить через запятую. Включается TRACING_ENABLED;
+    chrome и profile — только с X-Trace-Token, равным TRACE_TOKEN, в каталоге хранятся последние TRACE_MAX_FILES файлов.
+    """
+    if not TRACING_ENABLED:
+        return await call_next(request)
+    modes = tracing.allowed_modes(tracing.parse_modes(request.headers.get(TRACE_HEADER)),
+                                  request.headers.get(TRACE_TOKEN_HEADER), TRACE_TOKEN)
+    if not modes:
+        return await call_next(request)
+    profiler = None
+    if tracing.PROFILE in modes:
+        profiler = tracing.SamplingProfiler(PROFILE_INTERVAL)
+        profiler.start()
+    try:
+        with tracing.start_trace(f"{request.method} {request.url.path}") as trace:
+            response = await call_next(request)
+    finally:
+        # Остановка профайлера ждёт его поток, а файлы пишутся на диск — всё это вне event loop
+        if profiler is not None:
+            await tracing.run_in_executor(profiler.stop)
+    response.headers["X-Trace-Id"] = trace.trace_id
+    response.headers["Server-Timing"] = trace.server_timing()
+    if tracing.CHROME in modes:
+        path = await tracing.run_in_executor(trace.write_chrome, TRACE_DIR)
+        response.headers["X-Trace-File"] = path
+        logger.info(f"Trace {trace.trace_id} written to {path}")
+    if profiler is not None:
+        path = await tracing.run_in_executor(profiler.write, TRACE_DIR, trace.trace_id)
+        response.headers["X-Profile-File"] = path
+        logger.info(f"Profile {trace.trace_id} written to {path}")
+    if tracing.CHROME in modes or profiler is not None:
+        await tracing.run_in_executor(tracing.prune, TRACE_DIR, TRACE_MAX_FILES)
+    return response
+
 # ---------- Эндпоинты ----------
 
-@app.post("/agents", response_model=AgentResponse, summary="Создать нового агента")
+@router.post("/agents", response_model=AgentResponse, summary="Создать нового агента")
 async def create_agent(agent_data: AgentCreate = Body(..., examples={
     "default": {
         "summary": "Пример создания агента",
@@ -61,7 +306,7 @@ async def create_agent(agent_data: AgentCreate = Body(..., examples={
             "avatar": ""
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Создаёт агента с указанными характеристиками.
     Возвращает ID агента, имя, начальное настроение (0.0) и аватар.
@@ -72,9 +317,9 @@ async def create_agent(agent_data: AgentCreate = Body(..., examples={
         bunker_params=agent_data.bunker_params,
         avatar=agent_data.avatar
     )
-    agents[agent.id] = agent
+    session.add_agent(agent)
     logger.info(f"Created agent {agent.name} with id {agent.id}")
-    auto_save()
+    session.save()
     return AgentResponse(
         id=agent.id,
         name=agent.name,
@@ -82,35 +327,48 @@ async def create_agent(agent_data: AgentCreate = Body(..., examples={
         avatar=agent.avatar
     )
 
-@app.get("/agents", response_model=list[AgentResponse], summary="Получить список всех агентов")
-async def list_agents():
+@router.get("/agents", response_model=list[AgentResponse], summary="Получить список всех агентов")
+async def list_agents(http_request: Request, session: GameSession = Depends(get_session)):
     """
     Возвращает краткую информацию обо всех существующих агентах.
+    Ответ кешируется до изменения агентов; поддерживается If-None-Match (304).
     """
-    return [
-        AgentResponse(id=a.id, name=a.name, mood=a.mood, avatar=a.avatar)
-        for a in agents.values()
-    ]
-
-@app.get("/agents/{agent_id}", response_model=AgentDetailResponse, summary="Детальная информация об агенте")
-async def get_agent_detail(agent_id: str):
-    agent = agents.get(agent_id)
+    etag = make_etag(session.epoch, "agents", session.agents_stamp())
+    return not_modified(http_request, etag) or cached_response(http_request, etag, session.responses.get(
+        "agents", etag, lambda: serialize([
+            AgentResponse(id=a.id, name=a.name, mood=a.mood, avatar=a.avatar)
+            for a in session.agents.values()
+        ])))
+
+@router.get("/agents/{agent_id}", response_model=AgentDetailResponse, summary="Детальная информация об агенте")
+async def get_agent_detail(agent_id: str, http_request: Request, session: GameSession = Depends(get_session)):
+    agent = session.agents.get(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
-    recent = agent.memory.get_recent(5)
-    return AgentDetailResponse(
-        id=agent.id,
-        name=agent.name,
-        mood=agent.mood,
-        avatar=agent.avatar,
-        personality=agent.personality,
-        bunker_params=agent.bunker_params,
-        relationships={k: int(round(v * 100)) for k, v in agent.relationships.items()},
-        recent_memories=recent,
-        plans=agent.plans
-    )
-
-@app.post("/step", response_model=StepResponse, summary="Выполнить шаг симуляции")
+    # Совпавший ETag или собранный ранее ответ отдаются без загрузки памяти агента
+    etag = make_etag(session.epoch, agent.id, agent.version)
+    cached = not_modified(http_request, etag)
+    if cached:
+        return cached
+    key = ("agent", agent.id)
+    body = session.responses.lookup(key, etag)
+    if body is None:
+        await hydrate_agents([agent])
+        etag = make_etag(session.epoch, agent.id, agent.version)
+        body = session.responses.store(key, etag, serialize(AgentDetailResponse(
+            id=agent.id,
+            name=agent.name,
+            mood=agent.mood,
+            avatar=agent.avatar,
+            personality=agent.personality,
+            bunker_params=agent.bunker_params,
+            relationships={k: int(round(v * 100)) for k, v in agent.relationships.items()},
+            recent_memories=agent.memory.get_recent(5),
+            plans=agent.plans
+        )))
+    return cached_response(http_request, etag, body)
+
+@router.post("/step", response_model=StepResponse, summary="Выполнить шаг симуляции")
 async def perform_step(request: StepRequest = Body(..., examples={
     "default": {
         "summary": "Пример запроса шага",
@@ -126,7 +384,7 @@ async def perform_step(request: StepRequest = Body(..., examples={
             }
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Запускает один шаг симуляции: все живые агенты генерируют сообщения.
     Возвращает новые сообщения и обновлённые настроения.
@@ -134,47 +392,50 @@ async def perform_step(request: StepRequest = Body(..., examples={
     alive_ids = request.context.game_state.get("alive_agents", [])
     if not alive_ids:
         return StepResponse(new_messages=[], mood_updates={}, relationship_updates={})
-
-    semaphore = asyncio.Semaphore(SEMAPHORE)
+    await hydrate_agents(session.agents[aid] for aid in alive_ids if aid in session.agents)
+    # Все агенты шага видят одно и то же окно — сообщения, сказанные до шага
+    dialogue = dialogue_for(session, request.context)
+    round_no = request.context.game_state.get("round")
 
     async def process_agent(agent_id):
-        async with semaphore:
-            agent = agents.get(agent_id)
-            if not agent:
-                return None
-            chosen_card, message_text = await agent.generate_initiative(
-                context_messages=request.context.recent_messages,
-                game_state=request.context.game_state,
-                model_manager=model_manager
-            )
-            return {
-                "agent_id": agent_id,
-                "text": message_text,
-                "chosen_card": chosen_card
-            }
+        agent = session.agents.get(agent_id)
+        if not agent:
+            return None
+        chosen_card, message_text = await agent.generate_initiative(
+            context_messages=request.context.recent_messages,
+            game_state=request.context.game_state,
+            model_manager=model_manager,
+            scenario=session.scenario,
+            dialogue=dialogue
+        )
+        return {
+            "agent_id": agent_id,
+            "text": message_text,
+            "chosen_card": chosen_card
+        }
 
     tasks = [process_agent(aid) for aid in alive_ids]
     results = await asyncio.gather(*tasks)
     new_messages = [r for r in results if r]
-    mood_updates = {aid: agents[aid].mood for aid in alive_ids if agents.get(aid)}
+    for msg in new_messages:
+        session.record_message(session.agents[msg["agent_id"]].name, msg["text"], round_no, msg["agent_id"])
+    mood_updates = {aid: session.agents[aid].mood for aid in alive_ids if session.agents.get(aid)}
 
-    for agent in agents.values():
-        asyncio.create_task(agent.summarize_if_needed(model_manager, threshold=MEMORY_THRESHOLD, batch_size=BATCH_SIZE))
-        asyncio.create_task(agent.update_plan(
-            context_messages=request.context.recent_messages,
-            game_state=request.context.game_state,
-            model_manager=model_manager,
-            recent_events=request.context.recent_events
-        ))
+    for aid in alive_ids:
+        agent = session.agents.get(aid)
+        if agent:
+            schedule_plan_update(session, agent, request.context)
+    schedule_summarize(session, round_no)
 
-    auto_save()
+    session.save()
     return StepResponse(
         new_messages=new_messages,
         mood_updates=mood_updates,
-        relationship_updates={}
+        relationship_updates={},
+        cursor=session.messages.last_seq
     )
 
-@app.post("/agents/{agent_id}/step", summary="Выполнить шаг для одного агента")
+@router.post("/agents/{agent_id}/step", summary="Выполнить шаг для одного агента")
 async def agent_step(agent_id: str, request: StepRequest = Body(..., examples={
     "default": {
         "summary": "Пример шага для одного агента",
@@ -186,46 +447,41 @@ async def agent_step(agent_id: str, request: StepRequest = Body(..., examples={
             }
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Выполняет шаг симуляции только для указанного агента.
     Возвращает его сообщение и выбранную карту.
     """
-    agent = agents.get(agent_id)
+    agent = session.agents.get(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
 
     alive_ids = request.context.game_state.get("alive_agents", [])
     if agent_id not in alive_ids:
         raise HTTPException(status_code=400, detail="Agent is not alive")
+    await hydrate_agents([agent])
 
-    # chosen_card, message_text = await agent.generate_initiative(
-    #     context_messages=request.context.recent_messages,
-    #     game_state=request.context.game_state,
-    #     model_manager=model_manager
-    # )
-    message_text = await agent.generate_initiative(
-            context_messages=request.context.recent_messages,
-            game_state=request.context.game_state,
-            model_manager=model_manager
-        )
-
-    asyncio.create_task(agent.summarize_if_needed(model_manager, threshold=MEMORY_THRESHOLD, batch_size=BATCH_SIZE))
-    asyncio.create_task(agent.update_plan(
+    chosen_card, message_text = await agent.generate_initiative(
         context_messages=request.context.recent_messages,
         game_state=request.context.game_state,
         model_manager=model_manager,
-        recent_events=request.context.recent_events
-    ))
+        scenario=session.scenario,
+        dialogue=dialogue_for(session, request.context)
+    )
+    message = session.record_message(agent.name, message_text, request.context.game_state.get("round"), agent_id)
 
-    auto_save()
+    schedule_summarize(session, request.context.game_state.get("round"))
+    schedule_plan_update(session, agent, request.context)
+
+    session.save()
     return {
         "agent_id": agent_id,
         "text": message_text,
-        # "chosen_card": chosen_card
+        "chosen_card": chosen_card,
+        "cursor": message["seq"]
     }
 
-@app.post("/agents/{agent_id}/message", summary="Отправить сообщение агенту")
+@router.post("/agents/{agent_id}/message", summary="Отправить сообщение агенту")
 async def send_message_to_agent(agent_id: str, request: MessageToAgentRequest = Body(..., examples={
     "default": {
         "summary": "Пример отправки сообщения",
@@ -239,30 +495,37 @@ async def send_message_to_agent(agent_id: str, request: MessageToAgentRequest =
             }
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Отправляет сообщение указанному агенту от наблюдателя (from_agent = null) или от другого агента.
-    Возвращает ответ агента.
+    Возвращает ответ агента. Вызовы LLM идут с интерактивным приоритетом — впереди шагов и фоновых задач.
     """
-    agent = agents.get(agent_id)
+    set_priority(INTERACTIVE)
+    agent = session.agents.get(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
-    if request.from_agent and request.from_agent not in agents:
+    if request.from_agent and request.from_agent not in session.agents:
         raise HTTPException(status_code=400, detail="Sender agent not found")
+    await hydrate_agents([agent])
 
     response_text = await agent.generate_response(
         message=request.text,
         from_agent=request.from_agent,
         context_messages=request.context.recent_messages,
         game_state=request.context.game_state,
-        model_manager=model_manager
+        model_manager=model_manager,
+        scenario=session.scenario,
+        dialogue=dialogue_for(session, request.context)
     )
-    for agent in agents.values():
-        asyncio.create_task(agent.summarize_if_needed(model_manager, threshold=MEMORY_THRESHOLD))
-    auto_save()
-    return {"response": response_text}
-
-@app.post("/agents/{agent_id}/vote", response_model=VoteResponse, summary="Получить голос агента")
+    round_no = request.context.game_state.get("round")
+    sender = session.agents[request.from_agent].name if request.from_agent else "Наблюдатель"
+    session.record_message(sender, request.text, round_no, request.from_agent)
+    reply = session.record_message(agent.name, response_text, round_no, agent_id)
+    schedule_summarize(session, round_no)
+    session.save()
+    return {"response": response_text, "cursor": reply["seq"]}
+
+@router.post("/agents/{agent_id}/vote", response_model=VoteResponse, summary="Получить голос агента")
 async def get_agent_vote(agent_id: str, request: VoteRequest = Body(..., examples={
     "default": {
         "summary": "Пример запроса голоса",
@@ -274,27 +537,29 @@ async def get_agent_vote(agent_id: str, request: VoteRequest = Body(..., example
             }
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Запрашивает у агента решение, за кого он голосует в текущем раунде.
     Возвращает ID выбранного кандидата.
     """
-    agent = agents.get(agent_id)
+    agent = session.agents.get(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
 
     game_state = request.context.game_state
-    agent_names = {aid: agents[aid].name for aid in game_state.get("alive_agents", []) if aid in agents}
+    agent_names = {aid: session.agents[aid].name for aid in game_state.get("alive_agents", []) if aid in session.agents}
     game_state["agent_names"] = agent_names
 
     candidate_id = await agent.decide_vote(
         context_messages=request.context.recent_messages,
         game_state=game_state,
-        model_manager=model_manager
+        model_manager=model_manager,
+        scenario=session.scenario,
+        dialogue=dialogue_for(session, request.context)
     )
     return VoteResponse(candidate_id=candidate_id, explanation="")
 
-@app.post("/vote", summary="Зафиксировать результаты голосования")
+@router.post("/vote", summary="Зафиксировать результаты голосования")
 async def process_vote_results(request: VoteResultRequest = Body(..., examples={
     "default": {
         "summary": "Пример результатов голосования",
@@ -305,16 +570,16 @@ async def process_vote_results(request: VoteResultRequest = Body(..., examples={
             "alive_agents": ["agent_id_2"]
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Принимает результаты голосования, обновляет отношения агентов и сохраняет запись в историю.
     """
     for agent_id in request.alive_agents:
-        agent = agents.get(agent_id)
+        agent = session.agents.get(agent_id)
         if agent:
             agent.process_vote_results(request.votes, request.excluded_id)
 
-    voting_history.append({
+    session.record_vote({
         "round": request.round,
         "votes": request.votes,
         "excluded_id": request.excluded_id,
@@ -322,18 +587,59 @@ async def process_vote_results(request: VoteResultRequest = Body(..., examples={
         "timestamp": datetime.now().isoformat()
     })
 
-    auto_save()
-    save_history(voting_history, HISTORY_FILE)
+    session.save()
     return {"status": "ok"}
 
-@app.get("/history/votes", summary="Получить историю голосований")
-async def get_voting_history():
+@router.get("/messages", response_model=MessagePage, summary="Журнал сообщений игры")
+async def get_messages(
+    after: int = Query(0, ge=0, description="Курсор: вернуть сообщения с номером больше этого"),
+    limit: int = Query(100, ge=1, le=1000),
+    session: GameSession = Depends(get_session),
+):
+    """
+    Возвращает сообщения, записанные сервером при /step и /message, начиная после курсора.
+    Клиенту не нужно пересылать историю: достаточно передавать в контексте cursor или round.
+    """
+    cursor, items = session.messages.since(after, limit)
+    return MessagePage(cursor=cursor, items=items)
+
+@router.get("/history/votes", response_model=VoteHistoryPage, summary="Получить историю голосований")
+async def get_voting_history(
+    http_request: Request,
+    round_from: Optional[int] = Query(None, description="Минимальный номер раунда"),
+    round_to: Optional[int] = Query(None, description="Максимальный номер раунда"),
+    voter: Optional[str] = Query(None, description="Только голосования, где участвовал этот агент"),
+    candidate: Optional[str] = Query(None, description="Только голосования, где голосовали против этого агента"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    session: GameSession = Depends(get_session),
+):
     """
-    Возвращает список всех прошедших голосований.
+    Возвращает страницу прошедших голосований с фильтрами по раундам, голосующему и кандидату.
+    Ответ кешируется до следующего голосования; поддерживается If-None-Match (304).
     """
-    return voting_history
+    key = ("votes", round_from, round_to, voter, candidate, offset, limit)
+    etag = make_etag(session.epoch, "votes", session.voting_history.version)
 
-@app.post("/event", summary="Добавить глобальное событие")
+    def build() -> bytes:
+        total, items = session.voting_history.query(round_from, round_to, voter, candidate, offset, limit)
+        return serialize(VoteHistoryPage(total=total, offset=offset, limit=limit, items=items))
+
+    return not_modified(http_request, etag) or cached_response(
+        http_request, etag, session.responses.get(key, etag, build))
+
+@router.get("/history/votes/stats", response_model=Dict[str, AgentVoteStats], summary="Статистика голосований по агентам")
+async def get_voting_stats(session: GameSession = Depends(get_session)):
+    """
+    Возвращает агрегаты по всем агентам: сколько раз голосовали против агента и насколько его голоса совпадали с итогом.
+    """
+    return session.voting_history.all_stats()
+
+@router.get("/history/votes/stats/{agent_id}", response_model=AgentVoteStats, summary="Статистика голосований агента")
+async def get_agent_voting_stats(agent_id: str, session: GameSession = Depends(get_session)):
+    return session.voting_history.agent_stats(agent_id)
+
+@router.post("/event", summary="Добавить глобальное событие")
 async def add_event(request: EventRequest = Body(..., examples={
     "default": {
         "summary": "Пример добавления события",
@@ -342,70 +648,65 @@ async def add_event(request: EventRequest = Body(..., examples={
             "affect_mood": False
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Добавляет событие в память всех агентов. Все агенты узнают о нём и смогут учитывать при следующих шагах.
     """
-    updated_count = 0
-    for agent in agents.values():
-        agent.memory.add(f"Событие: {request.description}")
-        updated_count += 1
+    agents = list(session.agents.values())
+    await asyncio.gather(*(agent.remember(f"Событие: {request.description}") for agent in agents))
+    updated_count = len(agents)
 
-    for agent in agents.values():
-        asyncio.create_task(agent.summarize_if_needed(model_manager, threshold=MEMORY_THRESHOLD))
+    schedule_summarize(session)
 
-    auto_save()
+    session.save()
     return {
         "status": "ok",
         "agents_updated": updated_count,
         "description": request.description
     }
 
-@app.get("/relationships/graph", response_model=RelationshipGraphResponse, summary="Получить граф отношений")
-async def get_relationship_graph():
-    nodes = []
-    edges = []
-
-    for agent_id, agent in agents.items():
-        nodes.append(RelationshipNode(
-            id=agent_id,
-            name=agent.name,
-            mood=agent.mood,
-            avatar=agent.avatar
-        ))
-
-    for agent_id, agent in agents.items():
-        for other_id, value in agent.relationships.items():
-            if other_id in agents:
-                edges.append(RelationshipEdge(
-                    from_=agent_id,
-                    to=other_id,
-                    value=int(round(value * 100))
-                ))
-
-    return RelationshipGraphResponse(nodes=nodes, edges=edges)
+@router.get("/relationships/graph", response_model=RelationshipGraphResponse, summary="Получить граф отношений")
+async def get_relationship_graph(
+    http_request: Request,
+    include_excluded: bool = Query(False, description="Показывать агентов, исключённых голосованием"),
+    session: GameSession = Depends(get_session),
+):
+    """
+    Граф поддерживается инкрементально и сериализуется только после изменений.
+    Ответ содержит ETag; при совпадении If-None-Match возвращается 304 без тела.
+    """
+    graph = session.graph
+    etag = graph.etag if not include_excluded else graph.etag[:-1] + '.all"'
+    return cached_response(http_request, etag, graph.snapshot_json(include_excluded))
+
+@router.get("/relationships/graph/delta", response_model=RelationshipGraphDelta, summary="Изменения графа отношений")
+async def get_relationship_graph_delta(
+    since: int = Query(0, description="Версия графа из предыдущего ответа (поле version)"),
+    epoch: Optional[str] = Query(None, description="Поколение графа из предыдущего ответа (поле epoch)"),
+    include_excluded: bool = Query(False, description="Показывать агентов, исключённых голосованием"),
+    session: GameSession = Depends(get_session),
+):
+    """
+    Узлы и рёбра, изменившиеся после версии since, и исключённые с тех пор агенты.
+    Если граф был пересобран (epoch не совпадает), возвращается полный граф с full=true.
+    """
+    return JSONResponse(session.graph.delta(since, epoch, include_excluded))
 
-@app.delete("/reset", summary="Сбросить всё состояние")
-async def reset_all():
+@router.delete("/reset", summary="Сбросить всё состояние")
+async def reset_all(session: GameSession = Depends(get_session)):
     """
-    Полностью сбрасывает состояние сервера:
+    Полностью сбрасывает состояние игры:
     - удаляет всех агентов
     - очищает историю голосований
     - удаляет файлы сохранения
     """
-    agents.clear()
-    voting_history.clear()
+    session.reset()
 
-    for file in [AGENTS_FILE, HISTORY_FILE]:
-        if os.path.exists(file):
-            os.remove(file)
-            logger.info(f"Deleted {file}")
-
-    logger.info("Reset complete: all agents and history cleared")
+    logger.info(f"Reset complete: all agents and history cleared in game {session.game_id}")
     return {"status": "ok", "message": "All data reset"}
 
 
-@app.post("/bunker", summary="Установить параметры бункера")
+@router.post("/bunker", summary="Установить параметры бункера")
 async def set_bunker(params: BunkerParams = Body(..., examples={
     "default": {
         "summary": "Пример параметров бункера",
@@ -415,16 +716,15 @@ async def set_bunker(params: BunkerParams = Body(..., examples={
             "equipment": "медицинское"
         }
     }
-})):
+}), session: GameSession = Depends(get_session)):
     """
     Устанавливает глобальные параметры бункера. Они будут использоваться агентами при генерации ответов.
     """
-    global current_bunker
-    current_bunker = params.dict()
-    logger.info(f"Bunker set: {current_bunker}")
-    return {"status": "ok", "bunker": current_bunker}
+    session.update_scenario(bunker=params.dict())
+    logger.info(f"Bunker set for game {session.game_id}: {session.bunker}")
+    return {"status": "ok", "bunker": session.bunker}
 
-@app.post("/disaster", summary="Установить параметры катастрофы")
+@router.post("/disaster", summary="Установить параметры катастрофы")
 async def set_disaster(params: DisasterParams = Body(..., examples={
     "default": {
         "summary": "Пример параметров катастрофы",
@@ -434,13 +734,12 @@ async def set_disaster(params: DisasterParams = Body(..., examples={
             "dangers": "ядерная зима 50 лет, заражено 90% населения"
         }
     }
-})):
-    global current_disaster
-    current_disaster = params.dict()
-    logger.info(f"Disaster set: {current_disaster}")
-    return {"status": "ok", "disaster": current_disaster}
+}), session: GameSession = Depends(get_session)):
+    session.update_scenario(disaster=params.dict())
+    logger.info(f"Disaster set for game {session.game_id}: {session.disaster}")
+    return {"status": "ok", "disaster": session.disaster}
 
-@app.post("/threat", summary="Установить параметры угрозы")
+@router.post("/threat", summary="Установить параметры угрозы")
 async def set_threat(params: ThreatParams = Body(..., examples={
     "default": {
         "summary": "Пример параметров угрозы",
@@ -450,11 +749,163 @@ async def set_threat(params: ThreatParams = Body(..., examples={
             "description": "Стаи мутантов рыщут в поисках еды"
         }
     }
-})):
-    global current_threat
-    current_threat = params.dict()
-    logger.info(f"Threat set: {current_threat}")
-    return {"status": "ok", "threat": current_threat}
+}), session: GameSession = Depends(get_session)):
+    session.update_scenario(threat=params.dict())
+    logger.info(f"Threat set for game {session.game_id}: {session.threat}")
+    return {"status": "ok", "threat": session.threat}
+
+app.include_router(router)
+app.include_router(router, prefix=GAME_PREFIX)
+
+# ---------- Сервис ----------
+
+@app.get("/healthz", summary="Процесс жив")
+async def liveness():
+    """Отвечает сразу после старта, не дожидаясь загрузки модели и агентов"""
+    return {"status": "ok"}
+
+@app.get("/readyz", summary="Готовность сервиса")
+async def readiness():
+    """
+    Показывает прогресс фонового прогрева: загружена ли модель эмбеддингов и память агентов загруженных игр.
+    Пока прогрев не завершён, отвечает 503.
+    """
+    loaded = [a for session in sessions.loaded() for a in session.agents.values()]
+    total = len(loaded)
+    hydrated = sum(1 for a in loaded if a.is_hydrated)
+    embedder = default_embedder()
+    model_ready = embedder.loaded and warm_up_state["model_seconds"] is not None
+    ready = model_ready and hydrated == total and warm_up_state["agents_seconds"] is not None
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "ready": ready,
+        "model": embedder.tag,
+        "model_loaded": model_ready,
+        "agents_total": total,
+        "agents_hydrated": hydrated,
+        "progress": hydrated / total if total else 1.0,
+        "warm_up": warm_up_state,
+    })
+
+@app.get("/metrics", summary="Метрики в формате Prometheus", include_in_schema=False)
+async def get_metrics():
+    """
+    Счётчики и гистограммы горячих путей: задержки эндпоинтов и вызовов LLM, глубина перебора моделей,
+    эмбеддинги, поиск по памяти, сохранение и очередь фоновых задач.
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/stats", summary="Внутренняя статистика сервиса")
+async def get_stats():
+    """
+    Состояние очереди фоновых задач (глубина, выполняемые, склеенные и отброшенные задачи),
+    адаптивного лимитера вызовов LLM (текущий лимит и число вызовов в полёте),
+    ожидания слота LLM по классам приоритета и SLO интерактивных вызовов,
+    памяти загруженных агентов (размер, доля слитых дубликатов, вытесненные записи)
+    и пакетной суммаризации (задачи, пакетные и одиночные вызовы LLM).
+    """
+    memory = {"memories": 0, "added": 0, "deduplicated": 0, "evicted": 0}
+    for session in sessions.loaded():
+        for agent in session.agents.values():
+            if agent.is_hydrated:
+                for key, value in agent.memory.stats().items():
+                    memory[key] += value
+    memory["dedup_rate"] = memory["deduplicated"] / memory["added"] if memory["added"] else 0.0
+    return {
+        "background": scheduler.stats(),
+        "llm_limiter": model_manager.limiters.stats(),
+        "llm_priority": model_manager.priority_stats(),
+        "games_loaded": len(sessions.loaded()),
+        "memory": memory,
+        "summarizer": summarizer.stats(),
+        "cassette": model_manager.cassette.stats() if model_manager.cassette is not None else None
+    }
+
+# ---------- Игры ----------
+
+@app.post("/games", response_model=GameInfo, summary="Создать игру")
+async def create_game(request: GameCreate = Body(GameCreate())):
+    """
+    Создаёт новую игру со своими агентами, сценарием и историей. Маршруты игры доступны под /games/{game_id}/...
+    """
+    try:
+        session = sessions.create(request.game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return GameInfo(game_id=session.game_id, agents=len(session.agents), loaded=True)
+
+@app.get("/games", response_model=list[GameInfo], summary="Список игр")
+async def list_games():
+    loaded = {session.game_id: session for session in sessions.loaded()}
+    return [
+        GameInfo(game_id=gid, agents=len(loaded[gid].agents) if gid in loaded else None, loaded=gid in loaded)
+        for gid in sessions.list_ids()
+    ]
+
+@app.get("/games/{game_id}/affinity", summary="Воркер, обслуживающий игру")
+async def get_game_affinity(game_id: str, workers: int = Query(..., ge=1, description="Число воркеров за балансировщиком")):
+    """
+    Номер воркера для игры при привязке по game_id (crc32(game_id) % workers, как hash в nginx из serve.py)
+    и текущий арендатор игры.
+    """
+    try:
+        sessions.validate_game_id(game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "game_id": game_id,
+        "worker": worker_for_game(game_id, workers),
+        "lease_owner": sessions.state.owner(game_id)
+    }
+
+@app.delete("/games/{game_id}", summary="Удалить игру")
+async def delete_game(session: GameSession = Depends(get_session)):
+    """
+    Удаляет игру вместе с файлами сохранения. Игра по умолчанию только сбрасывается.
+    """
+    sessions.delete(session.game_id)
+    return {"status": "ok", "game_id": session.game_id}
+
+@app.post("/games/{game_id}/snapshots", response_model=SnapshotInfo, summary="Снимок игры")
+async def create_snapshot(session: GameSession = Depends(get_session)):
+    """
+    Запоминает текущее состояние игры в памяти процесса, чтобы затем ответвлять от него игры (POST /games/{game_id}/fork).
+    Снимок не копирует память агентов: она разделяется с игрой и копируется только при изменении.
+    """
+    await hydrate_agents(session.agents.values())
+    return sessions.snapshot(session).info()
+
+@app.get("/games/{game_id}/snapshots", response_model=list[SnapshotInfo], summary="Снимки игры")
+async def list_snapshots(game_id: str):
+    return [snapshot.info() for snapshot in sessions.snapshots(game_id)]
+
+@app.delete("/games/{game_id}/snapshots/{snapshot_id}", summary="Удалить снимок игры")
+async def delete_snapshot(game_id: str, snapshot_id: str):
+    snapshot = sessions.get_snapshot(snapshot_id)
+    if snapshot is None or snapshot.game_id != game_id:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    sessions.drop_snapshot(snapshot_id)
+    return {"status": "ok", "snapshot_id": snapshot_id}
+
+@app.post("/games/{game_id}/fork", response_model=GameInfo, summary="Ответвить игру")
+async def fork_game(request: ForkRequest = Body(ForkRequest()), session: GameSession = Depends(get_session)):
+    """
+    Создаёт новую игру из снимка (snapshot_id) или текущего состояния игры для параллельного прогона «что если».
+    Ветки независимы: изменения в одной не видны в других и в исходной игре.
+    """
+    if request.snapshot_id:
+        snapshot = sessions.get_snapshot(request.snapshot_id)
+        if snapshot is None or snapshot.game_id != session.game_id:
+            raise HTTPException(status_code=404, detail="Snapshot not found")
+    else:
+        await hydrate_agents(session.agents.values())
+        snapshot = session.snapshot()
+    try:
+        fork = sessions.fork(snapshot, request.game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    async with sessions.lease(fork):
+        fork.save()
+    return GameInfo(game_id=fork.game_id, agents=len(fork.agents), loaded=True)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
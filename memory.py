@@ -1,87 +1,415 @@
+import time
+import uuid
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+from config import (
+    MEMORY_MAX_PER_AGENT, MEMORY_HALF_LIFE, MEMORY_RECENCY_FLOOR, MEMORY_DEDUP_THRESHOLD, MEMORY_DEDUP_WINDOW,
+    EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_DIM
+)
+from embeddings import EmbeddingBackend, create_embedding_backend, check_tag
+from tracing import traced
+from metrics import EMBEDDING_ENCODE_SECONDS, EMBEDDING_BATCH_SIZE, MEMORY_SEARCH_SECONDS, MEMORY_SEARCH_SIZE
+
+INTRO_PREFIX = "Меня зовут"
+DEFAULT_IMPORTANCE = 0.3
+SUMMARY_IMPORTANCE = 0.8
+# Уровни памяти: сырые воспоминания -> сводки раундов -> сводка всей игры
+RAW, ROUND_SUMMARY, GAME_SUMMARY = 0, 1, 2
+SUMMARY_PREFIXES = {ROUND_SUMMARY: "Суммаризация:", GAME_SUMMARY: "Итоги игры:"}
+# Начало текста воспоминания -> базовая важность
+IMPORTANCE_PREFIXES = (
+    (INTRO_PREFIX, 1.0),
+    (SUMMARY_PREFIXES[GAME_SUMMARY], 0.9),
+    (SUMMARY_PREFIXES[ROUND_SUMMARY], SUMMARY_IMPORTANCE),
+    ("Событие:", 0.7),
+    ("Я раскрыл карту", 0.6),
+    ("Наблюдатель сказал:", 0.4),
+    ("Я сказал:", 0.3),
+)
+# Слова, которые делают воспоминание заметнее (голосования, угрозы, союзы, обман)
+IMPORTANCE_KEYWORDS = ("голос", "исключ", "угроз", "опасн", "предал", "союз", "доверя", "обман", "лж", "ранен", "болезн")
+IMPORTANCE_KEYWORD_BONUS = 0.2
+
+
+def default_embedder() -> EmbeddingBackend:
+    """Бэкенд эмбеддингов из конфигурации; один на процесс и разделяется всеми агентами"""
+    return create_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_DIM)
+
+
+def summary_level_of(text: str) -> int:
+    for level, prefix in SUMMARY_PREFIXES.items():
+        if text.startswith(prefix):
+            return level
+    return RAW
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (≈4 символа на токен) для бюджетов суммаризации"""
+    return len(text) // 4 + 1
+
+
+def score_importance(text: str) -> float:
+    """Эвристическая важность воспоминания в диапазоне (0, 1] — без вызова LLM"""
+    score = DEFAULT_IMPORTANCE
+    for prefix, value in IMPORTANCE_PREFIXES:
+        if text.startswith(prefix):
+            score = value
+            break
+    lowered = text.lower()
+    if any(word in lowered for word in IMPORTANCE_KEYWORDS):
+        score += IMPORTANCE_KEYWORD_BONUS
+    return min(1.0, score)
+
 
 class MemoryStore:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    """
+    Память агента. Поиск ранжирует воспоминания по произведению релевантности (косинус),
+    давности (экспоненциальное затухание с периодом полураспада half_life секунд) и важности;
+    при превышении max_memories вытесняются наименее ценные (важность × давность), закреплённые — никогда.
+
+    Если задан dedup_threshold, новое воспоминание, почти совпадающее (косинус ≥ порога) с одним из
+    последних dedup_window, не добавляется, а сливается с ним: растёт счётчик count и обновляется время.
+    """
+
+    def __init__(self, embedder: Optional[EmbeddingBackend] = None, max_memories: Optional[int] = MEMORY_MAX_PER_AGENT,
+                 half_life: float = MEMORY_HALF_LIFE, dedup_threshold: Optional[float] = MEMORY_DEDUP_THRESHOLD,
+                 dedup_window: int = MEMORY_DEDUP_WINDOW):
+        self.embedder = embedder or default_embedder()
         self.memories = []
+        self.max_memories = max_memories
+        self.half_life = half_life
+        self.dedup_threshold = dedup_threshold
+        self.dedup_window = dedup_window
+        self.evicted = 0
+        self.added = 0
+        self.deduplicated = 0
+        # id воспоминаний, изменённых слиянием после записи в хранилище
+        self._dirty: Set[str] = set()
+        # Буферы нормированных эмбеддингов, важности и времени с запасом ёмкости: новое воспоминание
+        # дописывается строкой, удаление (суммаризация, вытеснение) сбрасывает их до пересборки
+        self._matrix: Optional[np.ndarray] = None
+        self._importance: Optional[np.ndarray] = None
+        self._timestamps: Optional[np.ndarray] = None
+        self._rows = -1
+        # После fork() записи и буферы разделяются с другими копиями: изменяемая запись копируется
+        # перед слиянием, буферы — перед первой записью в них (копирование при записи)
+        self._shared = False
+        self._buffers_shared = False
 
-    def add(self, text: str):
-        """Добавить воспоминание с эмбеддингом"""
-        emb = self.model.encode(text, convert_to_numpy=True)
-        self.memories.append({
+    @property
+    def embedding_tag(self) -> str:
+        return self.embedder.tag
+
+    @traced("memory.encode")
+    def encode(self, text) -> np.ndarray:
+        """
+        Эмбеддинг текста (или матрица эмбеддингов для списка текстов);
+        не меняет хранилище, поэтому можно вызывать из пула потоков
+        """
+        EMBEDDING_BATCH_SIZE.observe(len(text) if isinstance(text, list) else 1)
+        with EMBEDDING_ENCODE_SECONDS.time():
+            return self.embedder.encode(text)
+
+    @traced("memory.add")
+    def add(self, text: str, embedding: Optional[np.ndarray] = None, importance: Optional[float] = None,
+            pinned: bool = False, level: int = RAW) -> Dict[str, Any]:
+        """
+        Добавить воспоминание с эмбеддингом (уже посчитанным или считаемым здесь).
+        Возвращает новую запись или ту, с которой слился почти-дубликат.
+        """
+        emb = embedding if embedding is not None else self.encode(text)
+        importance = importance if importance is not None else score_importance(text)
+        self.added += 1
+        if self.dedup_threshold and not pinned and level == RAW:
+            idx = self._find_duplicate(emb)
+            if idx is not None:
+                return self._merge(idx, importance)
+        memory = {
+            'id': uuid.uuid4().hex,
             'text': text,
             'embedding': emb,
-            'timestamp': datetime.now()
-        })
+            'timestamp': datetime.now(),
+            'importance': importance,
+            'pinned': pinned,
+            'count': 1,
+            'level': level,
+        }
+        self.memories.append(memory)
+        self._append_row(memory)
+        self._enforce_cap()
+        return memory
+
+    def _find_duplicate(self, embedding: np.ndarray) -> Optional[int]:
+        """Индекс почти совпадающего воспоминания среди последних dedup_window или None"""
+        if not self.memories:
+            return None
+        matrix, _, _ = self._arrays()
+        start = max(0, len(self.memories) - self.dedup_window)
+        emb = np.asarray(embedding, dtype=np.float32)
+        similarities = matrix[start:] @ (emb / (np.linalg.norm(emb) + 1e-9))
+        # Закреплённые записи не сливаются — и не должны заслонять дубликат среди остальных
+        pinned = [i for i, m in enumerate(self.memories[start:]) if m.get('pinned')]
+        similarities[pinned] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.dedup_threshold:
+            return None
+        return start + best
+
+    def _merge(self, idx: int, importance: float) -> Dict[str, Any]:
+        memory = self.memories[idx]
+        if self._shared:
+            memory = self.memories[idx] = dict(memory)
+        memory['count'] = memory.get('count', 1) + 1
+        memory['timestamp'] = datetime.now()
+        memory['importance'] = max(memory.get('importance', DEFAULT_IMPORTANCE), importance)
+        self.deduplicated += 1
+        self._dirty.add(memory['id'])
+        # Матрицу не пересобираем: меняются только важность и время этой строки
+        self._own_buffers()
+        self._importance[idx] = memory['importance']
+        self._timestamps[idx] = memory['timestamp'].timestamp()
+        return memory
+
+    def take_dirty(self) -> Set[str]:
+        """Забрать id воспоминаний, изменённых слиянием (для инкрементального сохранения)"""
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def mark_dirty(self, ids: Set[str]):
+        """Вернуть id, забранные take_dirty, если запись в хранилище не удалась"""
+        self._dirty |= ids
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memories": len(self.memories),
+            "added": self.added,
+            "deduplicated": self.deduplicated,
+            "evicted": self.evicted,
+        }
+
+    def _invalidate(self):
+        self._rows = -1
+
+    def _own_buffers(self):
+        """Скопировать разделяемые с другой копией буферы перед записью в них"""
+        if self._buffers_shared:
+            self._matrix = self._matrix.copy()
+            self._importance = self._importance.copy()
+            self._timestamps = self._timestamps.copy()
+            self._buffers_shared = False
+
+    def fork(self) -> "MemoryStore":
+        """
+        Копия хранилища за O(число воспоминаний) указателей: записи, эмбеддинги и буферы поиска разделяются
+        с оригиналом и копируются только при изменении (в копии или в оригинале).
+        """
+        store = MemoryStore.__new__(MemoryStore)
+        store.__dict__.update(self.__dict__)
+        store.memories = list(self.memories)
+        store._dirty = set()
+        self._shared = store._shared = True
+        if self._matrix is not None:
+            self._buffers_shared = store._buffers_shared = True
+        return store
 
-    def search(self, query: str, k: int = 5) -> List[str]:
-        """Поиск k самых похожих воспоминаний по косинусному сходству"""
+    def _rebuild(self):
+        n = len(self.memories)
+        capacity = max(16, 2 * n)
+        dim = len(self.memories[0]['embedding'])
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._importance = np.zeros(capacity, dtype=np.float32)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        matrix = self._matrix[:n]
+        matrix[:] = [np.asarray(m['embedding'], dtype=np.float32) for m in self.memories]
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-9
+        self._importance[:n] = [m.get('importance', DEFAULT_IMPORTANCE) for m in self.memories]
+        self._timestamps[:n] = [m['timestamp'].timestamp() for m in self.memories]
+        self._rows = n
+        self._buffers_shared = False
+
+    def _append_row(self, memory: Dict[str, Any]):
+        idx = len(self.memories) - 1
+        if self._rows != idx:
+            # Буферы уже неактуальны (или список менялся снаружи) — пересоберутся при следующем поиске
+            self._invalidate()
+            return
+        self._own_buffers()
+        if idx >= self._matrix.shape[0]:
+            grow = self._matrix.shape[0]
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix[:grow])])
+            self._importance = np.concatenate([self._importance, np.zeros(grow, dtype=np.float32)])
+            self._timestamps = np.concatenate([self._timestamps, np.zeros(grow, dtype=np.float64)])
+        emb = np.asarray(memory['embedding'], dtype=np.float32)
+        self._matrix[idx] = emb / (np.linalg.norm(emb) + 1e-9)
+        self._importance[idx] = memory['importance']
+        self._timestamps[idx] = memory['timestamp'].timestamp()
+        self._rows = idx + 1
+
+    def _arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Актуальные представления буферов: матрица эмбеддингов, важность, время (по строке на воспоминание)"""
+        if self._rows != len(self.memories):
+            self._rebuild()
+        n = self._rows
+        return self._matrix[:n], self._importance[:n], self._timestamps[:n]
+
+    def _recency(self, timestamps: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+        age = np.maximum((now if now is not None else time.time()) - timestamps, 0.0)
+        return MEMORY_RECENCY_FLOOR + (1.0 - MEMORY_RECENCY_FLOOR) * np.power(0.5, age / self.half_life)
+
+    def _enforce_cap(self):
+        """Вытеснить наименее ценные незакреплённые воспоминания сверх max_memories"""
+        if not self.max_memories or len(self.memories) <= self.max_memories:
+            return
+        excess = len(self.memories) - self.max_memories
+        _, importance, timestamps = self._arrays()
+        value = importance * self._recency(timestamps)
+        pinned = np.fromiter((m.get('pinned', False) for m in self.memories), dtype=bool, count=len(self.memories))
+        value[pinned] = np.inf
+        candidates = int(np.count_nonzero(~pinned))
+        excess = min(excess, candidates)
+        if excess <= 0:
+            return
+        keep = np.ones(len(self.memories), dtype=bool)
+        keep[np.argpartition(value, excess - 1)[:excess]] = False
+        self.memories = [m for m, kept in zip(self.memories, keep) if kept]
+        # Сжимаем буферы на месте, без пересборки из списка
+        self._own_buffers()
+        n = len(self.memories)
+        rows = self._rows
+        self._matrix[:n] = self._matrix[:rows][keep]
+        self._importance[:n] = self._importance[:rows][keep]
+        self._timestamps[:n] = self._timestamps[:rows][keep]
+        self._rows = n
+        self.evicted += excess
+
+    @traced("memory.search")
+    def search(self, query: str, k: int = 5, query_embedding: Optional[np.ndarray] = None,
+               now: Optional[float] = None) -> List[str]:
+        """k лучших воспоминаний по релевантности × давности × важности"""
         if not self.memories:
             return []
-        query_emb = self.model.encode(query, convert_to_numpy=True)
-        similarities = []
-        for mem in self.memories:
-            sim = np.dot(query_emb, mem['embedding']) / (np.linalg.norm(query_emb) * np.linalg.norm(mem['embedding']) + 1e-9)
-            similarities.append(sim)
-        top_indices = np.argsort(similarities)[-k:][::-1]
-        return [self.memories[i]['text'] for i in top_indices]
+        query_emb = query_embedding if query_embedding is not None else self.encode(query)
+        start = time.perf_counter()
+        query_emb = np.asarray(query_emb, dtype=np.float32)
+        query_emb = query_emb / (np.linalg.norm(query_emb) + 1e-9)
+        matrix, importance, timestamps = self._arrays()
+        relevance = (matrix @ query_emb + 1.0) / 2.0
+        scores = relevance * self._recency(timestamps, now) * importance
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        MEMORY_SEARCH_SECONDS.observe(time.perf_counter() - start)
+        MEMORY_SEARCH_SIZE.observe(len(scores))
+        return [self.memories[i]['text'] for i in top]
 
     def get_recent(self, n: int = 10) -> List[str]:
-        """Последние n воспоминаний (по времени)"""
-        recent = sorted(self.memories, key=lambda x: x['timestamp'], reverse=True)[:n]
-        return [m['text'] for m in recent]
+        """Последние n воспоминаний (по времени); частичная выборка по буферу времени вместо сортировки всего списка"""
+        if not self.memories or n <= 0:
+            return []
+        _, _, timestamps = self._arrays()
+        n = min(n, len(timestamps))
+        top = np.argpartition(-timestamps, n - 1)[:n]
+        top = top[np.argsort(-timestamps[top], kind="stable")]
+        return [self.memories[i]['text'] for i in top]
+
+    @staticmethod
+    def _restore(mem: Dict[str, Any], embedding: np.ndarray) -> Dict[str, Any]:
+        text = mem['text']
+        return {
+            'id': mem.get('id') or uuid.uuid4().hex,
+            'text': text,
+            'embedding': embedding,
+            'timestamp': datetime.fromisoformat(mem['timestamp']),
+            'importance': mem['importance'] if mem.get('importance') is not None else score_importance(text),
+            # В старых сохранениях флага нет — закрепляем вступительное воспоминание по тексту
+            'pinned': bool(mem['pinned']) if mem.get('pinned') is not None else text.startswith(INTRO_PREFIX),
+            'count': mem.get('count') or 1,
+            'level': mem['level'] if mem.get('level') is not None else summary_level_of(text),
+        }
 
     def to_dict(self):
         """Сериализация в словарь (без эмбеддингов)"""
         return {
             'memories': [
                 {
+                    'id': m['id'],
                     'text': m['text'],
-                    'timestamp': m['timestamp'].isoformat()
+                    'timestamp': m['timestamp'].isoformat(),
+                    'importance': m.get('importance', DEFAULT_IMPORTANCE),
+                    'pinned': m.get('pinned', False),
+                    'count': m.get('count', 1),
+                    'level': m.get('level', RAW),
                 }
                 for m in self.memories
             ]
         }
 
     @classmethod
-    def from_dict(cls, data):
-        """Восстановление из словаря (пересчёт эмбеддингов)"""
-        store = cls()
-        for mem in data.get('memories', []):
-            text = mem['text']
-            timestamp = datetime.fromisoformat(mem['timestamp'])
-            emb = store.model.encode(text, convert_to_numpy=True)
-            store.memories.append({
-                'text': text,
-                'embedding': emb,
-                'timestamp': timestamp
-            })
+    def from_dict(cls, data, embedder: Optional[EmbeddingBackend] = None):
+        """Восстановление из словаря (пересчёт эмбеддингов одним батчем)"""
+        store = cls(embedder)
+        memories = data.get('memories', [])
+        if memories:
+            embeddings = store.encode([mem['text'] for mem in memories])
+            store.memories.extend(cls._restore(mem, emb) for mem, emb in zip(memories, embeddings))
         return store
 
-    async def summarize_old(self, model_manager, threshold=20, batch_size=10):
+    def to_records(self, only: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+        """Записи для хранилища с эмбеддингами в виде float32-байтов и меткой бэкенда (only — фильтр по id)"""
+        tag = self.embedding_tag
+        return [
+            {
+                'id': m['id'],
+                'text': m['text'],
+                'timestamp': m['timestamp'].isoformat(),
+                'embedding': np.asarray(m['embedding'], dtype=np.float32).tobytes(),
+                'embedding_tag': tag,
+                'importance': m.get('importance', DEFAULT_IMPORTANCE),
+                'pinned': int(m.get('pinned', False)),
+                'count': m.get('count', 1),
+                'level': m.get('level', RAW),
+            }
+            for m in self.memories
+            if only is None or m['id'] in only
+        ]
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]], embedder: Optional[EmbeddingBackend] = None):
         """
-        Суммаризирует самые старые воспоминания, если их количество превышает threshold.
-        Возвращает количество суммаризированных записей.
+        Восстановление из записей хранилища без пересчёта эмбеддингов.
+        Записи с эмбеддингами другого бэкенда отклоняются (EmbeddingMismatchError).
         """
-        if len(self.memories) < threshold:
-            return 0
-
-        indexed = list(enumerate(self.memories))
-        indexed.sort(key=lambda x: x[1]['timestamp'])
-        indices_to_remove = [idx for idx, _ in indexed[:batch_size]]
-
-        texts = [self.memories[idx]['text'] for idx in indices_to_remove]
-        prompt = "Суммируй следующие воспоминания в одно короткое предложение, сохранив ключевые детали:\n" + "\n".join(
-            texts)
-
-        response = await model_manager.generate_with_fallback("summarize", prompt)
-
-        self.add(f"Суммаризация: {response}")
+        store = cls(embedder)
+        for tag in {rec.get('embedding_tag') for rec in records}:
+            check_tag(store.embedder, tag)
+        for rec in records:
+            store.memories.append(cls._restore(rec, np.frombuffer(rec['embedding'], dtype=np.float32)))
+        return store
 
-        for idx in sorted(indices_to_remove, reverse=True):
-            del self.memories[idx]
+    @staticmethod
+    def summary_text(summary: str, level: int = ROUND_SUMMARY) -> str:
+        return f"{SUMMARY_PREFIXES[level]} {summary}"
 
-        return len(indices_to_remove)
\ No newline at end of file
+    def apply_summary(self, ids: List[str], summary: str, embedding: Optional[np.ndarray] = None,
+                      level: int = ROUND_SUMMARY) -> int:
+        """
+        Заменить воспоминания с указанными id одной сводкой уровня level
+        (сводка игры закрепляется, чтобы её не вытеснил предел памяти).
+        Удаление идёт по id, а не по индексам: пока ждали LLM, список мог измениться.
+        Если ни одного из воспоминаний уже нет (их свернула другая суммаризация), сводка не добавляется.
+        Возвращает количество удалённых записей.
+        """
+        remove = set(ids)
+        before = len(self.memories)
+        importance = max([m.get('importance', DEFAULT_IMPORTANCE) for m in self.memories if m['id'] in remove]
+                         + [SUMMARY_IMPORTANCE])
+        self.memories = [m for m in self.memories if m['id'] not in remove]
+        removed = before - len(self.memories)
+        if not removed:
+            return 0
+        self.add(self.summary_text(summary, level), embedding, importance=importance,
+                 pinned=level == GAME_SUMMARY, level=level)
+        return removed
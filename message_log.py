@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+def format_messages(messages: List[Dict[str, Any]]) -> str:
+    """Сообщения в виде строк «отправитель: текст» для вставки в промпт"""
+    return "".join(f"{msg.get('from', 'Unknown')}: {msg.get('text', '')}\n" for msg in messages)
+
+
+class MessageLog:
+    """
+    Журнал сообщений игры на стороне сервера. Последние capacity сообщений лежат в кольцевом буфере;
+    при заданном spill_file каждое сообщение дописывается в JSONL-файл, откуда читаются более старые
+    сообщения и восстанавливается буфер после перезапуска. Каждое сообщение получает номер seq (курсор).
+    """
+
+    def __init__(self, capacity: int = 200, window: int = 5, spill_file: Optional[str] = None):
+        self.capacity = capacity
+        self.window = window
+        self.spill_file = spill_file
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.last_seq = 0
+        self._window_text: Optional[str] = None
+        if spill_file:
+            for message in self._read_spill():
+                self._buffer.append(message)
+                self.last_seq = message["seq"]
+
+    def _read_spill(self, path: Optional[str] = None):
+        path = path or self.spill_file
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for lineno, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.error(f"Skipping corrupt message at {path}:{lineno}")
+        except FileNotFoundError:
+            return
+
+    def __len__(self):
+        return self.last_seq
+
+    def append(self, sender: str, text: str, round: Optional[int] = None,
+               agent_id: Optional[str] = None) -> Dict[str, Any]:
+        self.last_seq += 1
+        message = {
+            "seq": self.last_seq,
+            "round": round,
+            "from": sender,
+            "agent_id": agent_id,
+            "text": text,
+            "timestamp": datetime.now().isoformat(),
+        }
+        self._buffer.append(message)
+        self._window_text = None
+        if self.spill_file:
+            with open(self.spill_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+        return message
+
+    def since(self, cursor: int = 0, limit: int = 100) -> Tuple[int, List[Dict[str, Any]]]:
+        """Сообщения с seq > cursor (не больше limit) и курсор для следующего запроса"""
+        oldest = self._buffer[0]["seq"] if self._buffer else self.last_seq + 1
+        if cursor + 1 >= oldest or not self.spill_file:
+            items = [m for m in self._buffer if m["seq"] > cursor][:limit]
+        else:
+            # Старые сообщения уже вытеснены из буфера — читаем их из файла
+            items = []
+            for message in self._read_spill():
+                if message["seq"] > cursor:
+                    items.append(message)
+                    if len(items) >= limit:
+                        break
+        next_cursor = items[-1]["seq"] if items else max(cursor, 0)
+        return next_cursor, items
+
+    def recent(self, n: Optional[int] = None, round: Optional[int] = None) -> List[Dict[str, Any]]:
+        n = n or self.window
+        messages = self._buffer if round is None else [m for m in self._buffer if m["round"] == round]
+        return list(messages)[-n:]
+
+    def window_text(self, round: Optional[int] = None, cursor: Optional[int] = None) -> str:
+        """
+        Отформатированное «скользящее окно» последних сообщений для промптов.
+        Окно без фильтров собирается один раз после каждого нового сообщения.
+        """
+        if round is None and cursor is None:
+            if self._window_text is None:
+                self._window_text = format_messages(self.recent())
+            return self._window_text
+        messages = self.recent(self.capacity, round)
+        if cursor is not None:
+            messages = [m for m in messages if m["seq"] <= cursor]
+        return format_messages(messages[-self.window:])
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        Копия всех сообщений журнала, включая вытесненные из буфера в файл: снимок не должен зависеть
+        от файла, который игра потом дописывает или очищает при сбросе
+        """
+        if self.spill_file and os.path.exists(self.spill_file):
+            return list(self._read_spill())
+        return list(self._buffer)
+
+    def restore(self, messages: List[Dict[str, Any]]):
+        """Заменить журнал сообщениями снимка (ветка игры или откат к своему снимку)"""
+        self.clear()
+        f = open(self.spill_file, 'a', encoding='utf-8') if self.spill_file else None
+        try:
+            for message in messages:
+                self._buffer.append(message)
+                self.last_seq = message["seq"]
+                if f:
+                    f.write(json.dumps(message, ensure_ascii=False) + "\n")
+        finally:
+            if f:
+                f.close()
+
+    def clear(self):
+        self._buffer.clear()
+        self.last_seq = 0
+        self._window_text = None
+        if self.spill_file and os.path.exists(self.spill_file):
+            os.remove(self.spill_file)
@@ -0,0 +1,248 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы гистограмм по умолчанию (секунды): от миллисекунд до десятков секунд вызова LLM
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, метки и дочерние серии по значениям меток."""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """Серия с заданными значениями меток (создаётся при первом обращении)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик (событий, байт)."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels_text(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in list(self._children.items())]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение считывается вызовом function в момент сбора метрик"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    """Текущее значение (глубина очереди и т.п.); может вычисляться при сборе метрик."""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._children[()].set_function(function)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels_text(self.labelnames, key)} {_format_value(child.get())}"
+                for key, child in list(self._children.items())]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (задержки, размеры) с суммой и числом наблюдений."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса; render() отдаёт их в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------- Метрики сервиса ----------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "agent_http_request_seconds", "Длительность HTTP-запросов по маршруту",
+    ("method", "route", "status"))
+LLM_REQUEST_SECONDS = Histogram(
+    "agent_llm_request_seconds", "Длительность одного вызова модели по задаче, модели и индексу ключа",
+    ("task", "model", "key"))
+LLM_REQUESTS = Counter(
+    "agent_llm_requests_total", "Вызовы модели по исходу (success, rate_limited, error)",
+    ("task", "model", "key", "outcome"))
+LLM_FALLBACK_DEPTH = Histogram(
+    "agent_llm_fallback_depth", "Сколько пар (модель, ключ) перебрано в generate_with_fallback (0 — все заняты)",
+    ("task", "outcome"), buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16))
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "agent_llm_queue_wait_seconds", "Ожидание слота общего лимита LLM по классу приоритета",
+    ("priority",))
+LLM_SHED = Counter(
+    "agent_llm_shed_total", "Фоновые вызовы LLM, отброшенные из-за нарушения SLO интерактивных вызовов",
+    ("task",))
+EMBEDDING_ENCODE_SECONDS = Histogram(
+    "agent_embedding_encode_seconds", "Длительность вычисления эмбеддингов")
+EMBEDDING_BATCH_SIZE = Histogram(
+    "agent_embedding_batch_size", "Число текстов в одном вызове модели эмбеддингов", buckets=SIZE_BUCKETS)
+MEMORY_SEARCH_SECONDS = Histogram(
+    "agent_memory_search_seconds", "Длительность MemoryStore.search без учёта эмбеддинга запроса",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+MEMORY_SEARCH_SIZE = Histogram(
+    "agent_memory_search_memories", "Число воспоминаний, среди которых шёл поиск", buckets=SIZE_BUCKETS)
+STORAGE_SAVE_SECONDS = Histogram(
+    "agent_storage_save_seconds", "Длительность сохранения агентов игры", ("backend",))
+STORAGE_BYTES_WRITTEN = Counter(
+    "agent_storage_bytes_written_total", "Байт записано при сохранении агентов", ("backend",))
+AUTO_SAVE_SECONDS = Histogram(
+    "agent_auto_save_seconds", "Длительность auto_save (сохранение всех загруженных игр)")
+BACKGROUND_QUEUE_DEPTH = Gauge(
+    "agent_background_queue_depth", "Фоновые задачи, ожидающие выполнения")
+BACKGROUND_RUNNING = Gauge(
+    "agent_background_running", "Фоновые задачи, выполняющиеся сейчас")
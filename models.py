@@ -22,7 +22,9 @@ class AgentDetailResponse(AgentResponse):
     plans: List[str] = Field(..., description="Текущие планы агента (список, последний – актуальный)")
 
 class GameContext(BaseModel):
-    recent_messages: List[Dict[str, str]] = Field(..., description="Последние сообщения в общем чате. Каждый элемент: {\"from\": \"имя или ID\", \"text\": \"сообщение\"}")
+    recent_messages: Optional[List[Dict[str, str]]] = Field(None, description="Устарело: последние сообщения в общем чате. Если не переданы, используется журнал сообщений игры на сервере. Каждый элемент: {\"from\": \"имя или ID\", \"text\": \"сообщение\"}")
+    cursor: Optional[int] = Field(None, description="Номер (seq) последнего сообщения журнала, которое видел клиент; окно для промпта заканчивается на нём")
+    round: Optional[int] = Field(None, description="Брать в окно только сообщения журнала этого раунда")
     game_state: Dict[str, Any] = Field(..., description="Состояние игры: раунд, живые агенты, исключённые и т.д.")
     recent_events: List[str] = Field([], description="Список последних событий (например, ['Найден запас еды'])")
 
@@ -33,6 +35,7 @@ class StepResponse(BaseModel):
     new_messages: List[Dict[str, str]] = Field(..., description="Сгенерированные сообщения: [{\"agent_id\": \"...\", \"text\": \"...\"}]")
     mood_updates: Dict[str, float] = Field(..., description="Обновлённые настроения агентов: {agent_id: новое_настроение}")
     relationship_updates: Dict[str, float] = Field({}, description="Обновления отношений (пока пусто)")
+    cursor: Optional[int] = Field(None, description="Номер последнего сообщения в журнале игры после шага")
 
 class MessageToAgentRequest(BaseModel):
     from_agent: Optional[str] = Field(None, description="ID отправителя (если None – сообщение от наблюдателя)")
@@ -71,6 +74,15 @@ class RelationshipGraphResponse(BaseModel):
     nodes: List[RelationshipNode] = Field(..., description="Список узлов (агентов)")
     edges: List[RelationshipEdge] = Field(..., description="Список рёбер (отношений)")
 
+class RelationshipGraphDelta(BaseModel):
+    epoch: str = Field(..., description="Поколение графа; меняется при перезагрузке игры или сбросе")
+    version: int = Field(..., description="Текущая версия графа; передаётся как since в следующем запросе")
+    since: int = Field(..., description="Версия, относительно которой построена дельта")
+    full: bool = Field(..., description="True, если вместо дельты отдан полный граф (сменился epoch или since неизвестен)")
+    nodes: List[RelationshipNode] = Field(..., description="Добавленные или изменившиеся узлы")
+    edges: List[RelationshipEdge] = Field(..., description="Добавленные или изменившиеся рёбра")
+    removed: List[str] = Field(..., description="ID агентов, исключённых из графа после версии since")
+
 class BunkerParams(BaseModel):
     size: str = Field(..., description="Размер бункера (например, 'маленький', 'средний', 'большой')")
     food_supply: str = Field(..., description="Запас еды (например, 'неделя', 'месяц', 'год')")
@@ -84,4 +96,57 @@ class DisasterParams(BaseModel):
 class ThreatParams(BaseModel):
     type: str = Field(..., description="Тип угрозы (например, 'мутанты', 'бандиты', 'радиация')")
     severity: str = Field(..., description="Уровень угрозы (например, 'низкий', 'средний', 'критический')")
-    description: str = Field(..., description="Описание угрозы")
\ No newline at end of file
+    description: str = Field(..., description="Описание угрозы")
+
+class VoteRecord(BaseModel):
+    round: int = Field(..., description="Номер раунда")
+    votes: Dict[str, str] = Field(..., description="Голоса: {voter_id: candidate_id}")
+    excluded_id: str = Field(..., description="ID исключённого агента")
+    alive_agents: List[str] = Field(..., description="Выжившие после исключения")
+    timestamp: str = Field(..., description="Время записи (ISO 8601)")
+
+class VoteHistoryPage(BaseModel):
+    total: int = Field(..., description="Сколько записей подходит под фильтр")
+    offset: int = Field(..., description="Смещение страницы")
+    limit: int = Field(..., description="Размер страницы")
+    items: List[VoteRecord] = Field(..., description="Записи страницы в порядке голосований")
+
+class AgentVoteStats(BaseModel):
+    votes_cast: int = Field(..., description="Сколько раз агент голосовал")
+    aligned_votes: int = Field(..., description="Сколько раз голос агента совпал с исключённым")
+    times_voted_against: int = Field(..., description="Сколько голосов получил агент")
+    times_excluded: int = Field(..., description="Сколько раз агент был исключён")
+    voting_alignment: float = Field(..., description="Доля голосов агента, совпавших с итогом (0..1)")
+
+class GameCreate(BaseModel):
+    game_id: Optional[str] = Field(None, description="ID игры (латиница, цифры, '-' и '_'); если не задан, генерируется")
+
+class GameInfo(BaseModel):
+    game_id: str = Field(..., description="ID игры")
+    agents: Optional[int] = Field(None, description="Число агентов (если игра загружена)")
+    loaded: bool = Field(..., description="Загружена ли игра в память процесса")
+
+class MessageLogEntry(BaseModel):
+    seq: int = Field(..., description="Порядковый номер сообщения в журнале игры (курсор)")
+    round: Optional[int] = Field(None, description="Раунд, в котором прозвучало сообщение")
+    from_: str = Field(..., alias="from", description="Имя отправителя")
+    agent_id: Optional[str] = Field(None, description="ID агента-отправителя (для наблюдателя пусто)")
+    text: str = Field(..., description="Текст сообщения")
+    timestamp: str = Field(..., description="Время записи (ISO 8601)")
+
+class MessagePage(BaseModel):
+    cursor: int = Field(..., description="Курсор для следующего запроса (?after=cursor)")
+    items: List[MessageLogEntry] = Field(..., description="Сообщения после переданного курсора")
+
+class SnapshotInfo(BaseModel):
+    snapshot_id: str = Field(..., description="ID снимка")
+    game_id: str = Field(..., description="Игра, с которой снят снимок")
+    agents: int = Field(..., description="Число агентов в снимке")
+    memories: int = Field(..., description="Суммарное число воспоминаний агентов")
+    votes: int = Field(..., description="Число голосований в истории")
+    messages: int = Field(..., description="Число сообщений в журнале")
+    created_at: str = Field(..., description="Время снимка (ISO 8601)")
+
+class ForkRequest(BaseModel):
+    game_id: Optional[str] = Field(None, description="ID новой игры; если не задан, генерируется")
+    snapshot_id: Optional[str] = Field(None, description="Снимок, от которого ответвиться; если не задан — текущее состояние")
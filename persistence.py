@@ -1,19 +1,27 @@
 import json
 import logging
+import os
 from agent import Agent
 from typing import Dict
 
 logger = logging.getLogger(__name__)
 
-def save_agents(agents: Dict[str, Agent], filepath: str):
-    """Сохранить всех агентов в JSON-файл."""
+def save_agents(agents: Dict[str, Agent], filepath: str) -> int:
+    """Сохранить всех агентов в JSON-файл. Возвращает число записанных байт."""
     data = {aid: agent.to_dict() for aid, agent in agents.items()}
-    with open(filepath, 'w', encoding='utf-8') as f:
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    written = os.path.getsize(tmp_path)
+    os.replace(tmp_path, filepath)
     logger.info(f"Saved {len(agents)} agents to {filepath}")
+    return written
 
-def load_agents(filepath: str) -> Dict[str, Agent]:
-    """Загрузить агентов из JSON-файла. Если файл не найден, вернуть пустой словарь."""
+def load_agents(filepath: str, lazy: bool = False) -> Dict[str, Agent]:
+    """
+    Загрузить агентов из JSON-файла. Если файл не найден, вернуть пустой словарь.
+    При lazy=True эмбеддинги памяти не пересчитываются до первого обращения к agent.memory.
+    """
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             data = json.load(f)
@@ -27,7 +35,7 @@ def load_agents(filepath: str) -> Dict[str, Agent]:
     agents = {}
     for aid, agent_data in data.items():
         try:
-            agent = Agent.from_dict(agent_data)
+            agent = Agent.from_dict(agent_data, lazy=lazy)
             agents[aid] = agent
         except Exception as e:
             logger.error(f"Failed to load agent {aid}: {e}")
@@ -43,4 +51,81 @@ def load_history(filepath: str) -> list:
         with open(filepath, 'r', encoding='utf-8') as f:
             return json.load(f)
     except FileNotFoundError:
-        return []
\ No newline at end of file
+        return []
+
+def append_vote_record(record: dict, filepath: str):
+    """Дописать одну запись голосования в JSONL-журнал."""
+    with open(filepath, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def load_vote_log(filepath: str) -> list:
+    """Прочитать JSONL-журнал голосований; повреждённая строка пропускается, а не обнуляет всю историю."""
+    records = []
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.error(f"Skipping corrupt vote record at {filepath}:{lineno}")
+    except FileNotFoundError:
+        return []
+    return records
+
+class JSONStorage:
+    """Агенты — JSON-документ, история голосований — дописываемый JSONL-журнал."""
+    backend = "json"
+
+    def __init__(self, agents_file: str, history_file: str, legacy_history_file: str = None):
+        self.agents_file = agents_file
+        self.history_file = history_file
+        self.legacy_history_file = legacy_history_file
+
+    def load_agents(self, lazy: bool = False) -> Dict[str, Agent]:
+        return load_agents(self.agents_file, lazy=lazy)
+
+    def save_agents(self, agents: Dict[str, Agent]) -> int:
+        return save_agents(agents, self.agents_file)
+
+    def embedding_tags(self) -> set:
+        """Эмбеддинги в JSON не хранятся (пересчитываются при загрузке), поэтому несовпадения бэкенда не бывает"""
+        return set()
+
+    def load_history(self) -> list:
+        if (not os.path.exists(self.history_file) and self.legacy_history_file
+                and os.path.exists(self.legacy_history_file)):
+            history = load_history(self.legacy_history_file)
+            self.save_history(history)
+            logger.info(f"Converted {len(history)} votes from {self.legacy_history_file} to {self.history_file}")
+            return history
+        return load_vote_log(self.history_file)
+
+    def append_vote(self, record: dict):
+        append_vote_record(record, self.history_file)
+
+    def save_history(self, history: list):
+        tmp_path = f"{self.history_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in history:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.history_file)
+
+    def clear(self):
+        for file in [self.agents_file, self.history_file, self.legacy_history_file]:
+            if file and os.path.exists(file):
+                os.remove(file)
+                logger.info(f"Deleted {file}")
+
+
+def create_storage(backend: str, agents_file: str, history_file: str, sqlite_file: str,
+                   legacy_history_file: str = None):
+    """Выбрать хранилище по имени бэкенда из конфигурации ("json" или "sqlite")."""
+    if backend == "sqlite":
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(sqlite_file)
+    if backend == "json":
+        return JSONStorage(agents_file, history_file, legacy_history_file)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,165 @@
+import json
+import uuid
+from typing import Dict, Iterable, List, Optional, Any
+
+import numpy as np
+
+INITIAL_CAPACITY = 16
+
+
+class RelationshipGraph:
+    """
+    Граф отношений игры, поддерживаемый инкрементально: плотная матрица значений по индексам агентов,
+    маска существующих рёбер и версия последнего изменения каждого ребра и узла.
+
+    Агенты сообщают об изменениях через relationship_changed/mood_changed (см. Agent.observer).
+    Каждое изменение увеличивает version; epoch меняется при пересборке графа (загрузка, сброс),
+    поэтому пара (epoch, version) годится как ETag. Сериализованный полный граф кешируется до следующего изменения.
+    """
+
+    def __init__(self, agents: Optional[Dict[str, Any]] = None, active: Optional[Iterable[str]] = None):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._nodes: List[Dict[str, Any]] = []
+        self._values = np.zeros((INITIAL_CAPACITY, INITIAL_CAPACITY), dtype=np.float32)
+        self._present = np.zeros((INITIAL_CAPACITY, INITIAL_CAPACITY), dtype=bool)
+        self._edge_version = np.zeros((INITIAL_CAPACITY, INITIAL_CAPACITY), dtype=np.int64)
+        self._node_version = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        # Исключённые голосованием агенты скрыты; None — активны все
+        self._active: Optional[set] = None
+        self._removed: Dict[str, int] = {}
+        self._cache: Dict[bool, tuple] = {}
+        for agent in (agents or {}).values():
+            self.add_agent(agent)
+        for agent in (agents or {}).values():
+            for other_id, value in agent.relationships.items():
+                self.relationship_changed(agent, other_id, value)
+        if active is not None:
+            self.set_active(active)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.epoch}.{self.version}"'
+
+    def _bump(self) -> int:
+        self.version += 1
+        self._cache.clear()
+        return self.version
+
+    def _grow(self, size: int):
+        capacity = len(self._node_version)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        for name in ("_values", "_present", "_edge_version"):
+            old = getattr(self, name)
+            grown = np.zeros((new_capacity, new_capacity), dtype=old.dtype)
+            grown[:capacity, :capacity] = old
+            setattr(self, name, grown)
+        node_version = np.zeros(new_capacity, dtype=np.int64)
+        node_version[:capacity] = self._node_version
+        self._node_version = node_version
+
+    def add_agent(self, agent):
+        """Зарегистрировать агента как узел и подписать граф на его изменения"""
+        agent.observer = self
+        if agent.id in self._index:
+            return
+        i = len(self._ids)
+        self._grow(i + 1)
+        self._ids.append(agent.id)
+        self._index[agent.id] = i
+        self._nodes.append({"id": agent.id, "name": agent.name, "mood": agent.mood, "avatar": agent.avatar})
+        if self._active is not None:
+            self._active.add(agent.id)
+        self._node_version[i] = self._bump()
+
+    def relationship_changed(self, agent, other_id: str, value: float):
+        i = self._index.get(agent.id)
+        j = self._index.get(other_id)
+        if i is None or j is None:
+            return
+        if self._present[i, j] and self._values[i, j] == np.float32(value):
+            return
+        self._values[i, j] = value
+        self._present[i, j] = True
+        self._edge_version[i, j] = self._bump()
+
+    def mood_changed(self, agent):
+        i = self._index.get(agent.id)
+        if i is None or self._nodes[i]["mood"] == agent.mood:
+            return
+        self._nodes[i]["mood"] = agent.mood
+        self._node_version[i] = self._bump()
+
+    def set_active(self, ids: Iterable[str]):
+        """Оставить в графе только этих агентов (выживших после голосования)"""
+        active = {aid for aid in ids if aid in self._index}
+        previous = self._active if self._active is not None else set(self._ids)
+        if active == previous:
+            self._active = active
+            return
+        version = self._bump()
+        for aid in previous - active:
+            self._removed[aid] = version
+        # Вернувшиеся агенты отдаются в delta заново вместе со своими рёбрами
+        n = len(self._ids)
+        for aid in active - previous:
+            self._removed.pop(aid, None)
+            i = self._index[aid]
+            self._node_version[i] = version
+            self._edge_version[i, :n][self._present[i, :n]] = version
+            self._edge_version[:n, i][self._present[:n, i]] = version
+        self._active = active
+
+    def _mask(self, include_excluded: bool) -> np.ndarray:
+        n = len(self._ids)
+        if include_excluded or self._active is None:
+            return np.ones(n, dtype=bool)
+        return np.array([aid in self._active for aid in self._ids], dtype=bool)
+
+    def _edges(self, mask: np.ndarray, since: Optional[int] = None) -> List[Dict[str, Any]]:
+        n = len(self._ids)
+        selected = self._present[:n, :n] & mask[:, None] & mask[None, :]
+        if since is not None:
+            selected &= self._edge_version[:n, :n] > since
+        rows, cols = np.nonzero(selected)
+        values = np.rint(self._values[rows, cols] * 100).astype(int)
+        return [{"from": self._ids[i], "to": self._ids[j], "value": int(v)}
+                for i, j, v in zip(rows.tolist(), cols.tolist(), values.tolist())]
+
+    def _node_list(self, mask: np.ndarray, since: Optional[int] = None) -> List[Dict[str, Any]]:
+        return [dict(node) for i, node in enumerate(self._nodes)
+                if mask[i] and (since is None or self._node_version[i] > since)]
+
+    def snapshot(self, include_excluded: bool = False) -> Dict[str, Any]:
+        mask = self._mask(include_excluded)
+        return {"nodes": self._node_list(mask), "edges": self._edges(mask)}
+
+    def snapshot_json(self, include_excluded: bool = False) -> bytes:
+        """Полный граф в JSON; пересобирается только после изменений"""
+        cached = self._cache.get(include_excluded)
+        if cached is None or cached[0] != self.version:
+            body = json.dumps(self.snapshot(include_excluded), ensure_ascii=False).encode("utf-8")
+            cached = (self.version, body)
+            self._cache[include_excluded] = cached
+        return cached[1]
+
+    def delta(self, since: int, epoch: Optional[str] = None, include_excluded: bool = False) -> Dict[str, Any]:
+        """
+        Узлы и рёбра, изменившиеся после версии since, и скрытые с тех пор агенты.
+        Если граф пересобран (другой epoch) или since из будущего — полный граф с full=True.
+        """
+        if (epoch is not None and epoch != self.epoch) or since > self.version or since < 0:
+            return {"epoch": self.epoch, "version": self.version, "since": since, "full": True,
+                    "removed": [], **self.snapshot(include_excluded)}
+        mask = self._mask(include_excluded)
+        removed = [] if include_excluded else [aid for aid, version in self._removed.items() if version > since]
+        return {
+            "epoch": self.epoch, "version": self.version, "since": since, "full": False,
+            "nodes": self._node_list(mask, since),
+            "edges": self._edges(mask, since),
+            "removed": removed,
+        }
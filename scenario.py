@@ -0,0 +1,74 @@
+from typing import Dict, Optional, Any
+
+SCENARIO_PARTS = ("bunker", "disaster", "threat")
+
+
+def _bunker_info(bunker: Optional[Dict[str, Any]]) -> str:
+    if not bunker:
+        return "Информация о бункере отсутствует"
+    return (f"Размер: {bunker.get('size', 'неизвестно')}, запас еды: {bunker.get('food_supply', 'неизвестно')}, "
+            f"оборудование: {bunker.get('equipment', 'неизвестно')}")
+
+
+def _disaster_info(disaster: Optional[Dict[str, Any]]) -> str:
+    if not disaster:
+        return "Информация о катастрофе отсутствует"
+    return (f"Тип: {disaster.get('type', 'неизвестно')}, масштаб: {disaster.get('scale', 'неизвестно')}, "
+            f"опасности: {disaster.get('dangers', 'неизвестно')}")
+
+
+def _threat_info(threat: Optional[Dict[str, Any]]) -> str:
+    if not threat:
+        return "Информация об угрозе отсутствует"
+    return (f"Тип: {threat.get('type', 'неизвестно')}, уровень: {threat.get('severity', 'неизвестно')}, "
+            f"описание: {threat.get('description', 'неизвестно')}")
+
+
+class ScenarioContext:
+    """
+    Сценарий игры: бункер, катастрофа и угроза. Общий для всех агентов блок промпта
+    собирается один раз при изменении сценария (version растёт с каждым изменением).
+    """
+
+    def __init__(self, bunker: Optional[Dict[str, Any]] = None, disaster: Optional[Dict[str, Any]] = None,
+                 threat: Optional[Dict[str, Any]] = None):
+        self.bunker = bunker
+        self.disaster = disaster
+        self.threat = threat
+        self.version = 0
+        self._render()
+
+    def _render(self):
+        self.bunker_info = _bunker_info(self.bunker)
+        self.disaster_info = _disaster_info(self.disaster)
+        self.threat_info = _threat_info(self.threat)
+        self.prompt = (
+            f"Обстановка в бункере:\n{self.bunker_info}\n\n"
+            f"Катастрофа, которая произошла:\n{self.disaster_info}\n\n"
+            f"Угроза снаружи:\n{self.threat_info}"
+        )
+
+    def update(self, **parts: Optional[Dict[str, Any]]):
+        for name, value in parts.items():
+            if name not in SCENARIO_PARTS:
+                raise ValueError(f"Unknown scenario part: {name}")
+            setattr(self, name, value)
+        self.version += 1
+        self._render()
+
+    def for_game_state(self, game_state: Dict[str, Any]) -> "ScenarioContext":
+        """Параметры из game_state запроса (если переданы) перекрывают сценарий игры"""
+        overrides = {name: game_state[name] for name in SCENARIO_PARTS if game_state.get(name)}
+        if not overrides:
+            return self
+        return ScenarioContext(**{**self.to_dict(), **overrides})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in SCENARIO_PARTS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ScenarioContext":
+        return cls(**{name: data.get(name) for name in SCENARIO_PARTS})
+
+
+EMPTY_SCENARIO = ScenarioContext()
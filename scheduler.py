@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, List, Set, Any
+
+from limiter import BACKGROUND, LoadShedError, set_priority
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class BackgroundScheduler:
+    """
+    Очередь фоновых задач (обновление планов, суммаризация) с ограниченным пулом воркеров.
+
+    Задачи с одинаковым ключом склеиваются: в очереди остаётся только последняя,
+    и одна и та же задача не выполняется параллельно сама с собой.
+    Пока идут foreground-запросы, воркеры ждут (не дольше max_defer секунд, чтобы не голодать).
+    Вызовы LLM из задач идут с фоновым приоритетом и могут быть отброшены (LoadShedError), если страдают интерактивные.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 1000, max_defer: float = 2.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_defer = max_defer
+        self._pending: "OrderedDict[Hashable, Job]" = OrderedDict()
+        self._running: Set[Hashable] = set()
+        self._wakeup = asyncio.Event()
+        self._foreground = 0
+        self._foreground_idle = asyncio.Event()
+        self._foreground_idle.set()
+        self._tasks: List[asyncio.Task] = []
+        self._counters: Dict[str, int] = {
+            "submitted": 0, "coalesced": 0, "dropped": 0, "completed": 0, "failed": 0, "shed": 0,
+        }
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, key: Hashable, job: Job):
+        """Поставить задачу в очередь; ожидающая задача с тем же ключом заменяется новой"""
+        self._counters["submitted"] += 1
+        if key in self._pending:
+            self._counters["coalesced"] += 1
+        elif len(self._pending) >= self.max_pending:
+            dropped_key, _ = self._pending.popitem(last=False)
+            self._counters["dropped"] += 1
+            logger.warning(f"Background queue full, dropped job {dropped_key}")
+        self._pending[key] = job
+        self._wakeup.set()
+
+    @asynccontextmanager
+    async def foreground(self):
+        """Пометить выполнение интерактивного запроса: фоновые задачи на это время откладываются"""
+        self._foreground += 1
+        self._foreground_idle.clear()
+        try:
+            yield
+        finally:
+            self._foreground -= 1
+            if self._foreground == 0:
+                self._foreground_idle.set()
+
+    def _take(self):
+        for key in self._pending:
+            if key not in self._running:
+                return key, self._pending.pop(key)
+        return None, None
+
+    async def _worker(self, worker_id: int):
+        # Контекст задачи воркера наследуют все выполняемые им задачи
+        set_priority(BACKGROUND)
+        while True:
+            key, job = self._take()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._running.add(key)
+            try:
+                if not self._foreground_idle.is_set():
+                    try:
+                        await asyncio.wait_for(self._foreground_idle.wait(), timeout=self.max_defer)
+                    except asyncio.TimeoutError:
+                        pass
+                    # За время ожидания могла прийти более свежая версия той же задачи — она заменяет взятую
+                    newer = self._pending.pop(key, None)
+                    if newer is not None:
+                        self._counters["coalesced"] += 1
+                        job = newer
+                await job()
+                self._counters["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except LoadShedError as e:
+                self._counters["shed"] += 1
+                logger.info(f"Background job {key} shed: {e}")
+            except Exception as e:
+                self._counters["failed"] += 1
+                logger.error(f"Background job {key} failed: {e}")
+            finally:
+                self._running.discard(key)
+                self._wakeup.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "running": len(self._running),
+            "workers": len(self._tasks),
+            "foreground_in_flight": self._foreground,
+            **self._counters,
+        }
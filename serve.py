@@ -0,0 +1,60 @@
+"""
+Запуск нескольких воркеров API на соседних портах с общим бэкендом координации игр.
+
+    python serve.py --workers 4 --port 8001
+
+Воркер i слушает порт port + i. Балансировщик должен направлять все запросы одной игры
+на один воркер. worker_for_game(game_id, workers) из state_backend.py — это crc32(game_id) % workers;
+так же выбирает сервер обычный (не consistent) hash в nginx при равных весах и всех живых серверах,
+если серверы перечислены по порядку портов, а game_id взят из пути:
+
+    map $uri $game_id { ~^/games/(?<id>[A-Za-z0-9_-]+) $id; default default; }
+    upstream agent_core { hash $game_id; server 127.0.0.1:8001; server 127.0.0.1:8002; ... }
+
+Запросы без префикса /games/{game_id} идут к игре по умолчанию (query-параметр game_id такой map не видит).
+
+Без привязки состояние остаётся согласованным (игра арендуется на время запроса, устаревшая копия
+перечитывается с диска), но игры чаще перезагружаются и запросы ждут освобождения аренды.
+"""
+import argparse
+import multiprocessing
+import os
+
+import uvicorn
+
+
+def run_worker(index: int, host: str, port: int):
+    os.environ["WORKER_ID"] = f"worker-{index}"
+    # config читает переменные окружения при импорте, поэтому main импортируется уже в дочернем процессе
+    from main import app
+    uvicorn.run(app, host=host, port=port)
+
+
+def start_workers(workers: int, host: str, port: int):
+    if workers > 1:
+        os.environ.setdefault("STATE_BACKEND", "sqlite")
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_worker, args=(i, host, port + i), daemon=True) for i in range(workers)]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001, help="порт первого воркера")
+    args = parser.parse_args()
+
+    processes = start_workers(args.workers, args.host, args.port)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from agent import Agent
+from embeddings import EmbeddingBackend, EmbeddingMismatchError, check_tag
+from message_log import MessageLog
+from metrics import STORAGE_SAVE_SECONDS, STORAGE_BYTES_WRITTEN
+from http_cache import ResponseCache
+from persistence import create_storage
+from relationship_graph import RelationshipGraph
+from scenario import ScenarioContext
+from state_backend import StateBackend, LocalStateBackend
+from tracing import span
+from vote_log import VoteLog
+
+logger = logging.getLogger(__name__)
+
+GAME_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+LEASE_POLL_INTERVAL = 0.05
+
+
+class GameBusyError(Exception):
+    """Игра арендована другим воркером и не освободилась за отведённое время."""
+
+    def __init__(self, game_id: str, owner: Optional[str]):
+        super().__init__(f"Game {game_id} is held by worker {owner}")
+        self.game_id = game_id
+        self.owner = owner
+
+
+@dataclass
+class GameSnapshot:
+    """
+    Снимок игры для ветвления: копии агентов (память разделяется с игрой до первой записи, см. Agent.fork),
+    история голосований, сценарий и копия журнала сообщений.
+    """
+    snapshot_id: str
+    game_id: str
+    agents: Dict[str, Agent]
+    votes: List[Dict[str, Any]]
+    scenario: Dict[str, Any]
+    messages: List[Dict[str, Any]]
+    created_at: datetime = field(default_factory=datetime.now)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "snapshot_id": self.snapshot_id,
+            "game_id": self.game_id,
+            "agents": len(self.agents),
+            "memories": sum(len(a.memory.memories) for a in self.agents.values()),
+            "votes": len(self.votes),
+            "messages": len(self.messages),
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class GameSession:
+    """Одна игра: свои агенты, сценарий (бункер, катастрофа, угроза), история голосований и хранилище."""
+
+    def __init__(self, game_id: str, storage, state: StateBackend, messages_file: Optional[str] = None,
+                 message_capacity: int = 200, message_window: int = 5):
+        self.game_id = game_id
+        self.storage = storage
+        self.state = state
+        self.messages_file = messages_file
+        self.message_capacity = message_capacity
+        self.message_window = message_window
+        self.created_at = datetime.now()
+        # Изменения с момента взятия аренды; при возврате аренды версия в бэкенде увеличивается
+        self.changed = False
+        self._load()
+
+    def _load(self):
+        # Версия читается до состояния: если другой воркер сохранит игру посреди чтения, загруженное
+        # окажется не старше версии и при следующей аренде игра перечитается, а не перезапишет более новую
+        self.version = self.state.version(self.game_id)
+        # Метаданные агентов читаются сразу, память (эмбеддинги) — в фоне или при первом обращении
+        self.agents: Dict[str, Agent] = self.storage.load_agents(lazy=True)
+        self.voting_history = VoteLog(self.storage.load_history())
+        self.messages = MessageLog(self.message_capacity, self.message_window, self.messages_file)
+        self.scenario = ScenarioContext.from_dict(self.state.load_scenario(self.game_id))
+        # Поколение состояния в ETag: после перечитывания или сброса старые теги не совпадут
+        self.epoch = uuid.uuid4().hex[:8]
+        self.responses = ResponseCache()
+        self._build_graph()
+
+    def _build_graph(self):
+        # Выжившие берутся из последнего голосования; до голосований в графе все агенты
+        records = self.voting_history.records
+        active = records[-1].get("alive_agents") if records else None
+        self.graph = RelationshipGraph(self.agents, active=active or None)
+
+    def agents_stamp(self) -> str:
+        """Версия списка агентов: их число и наибольшая версия агента"""
+        return f"{len(self.agents)}.{max((a.version for a in self.agents.values()), default=0)}"
+
+    def add_agent(self, agent: Agent):
+        self.agents[agent.id] = agent
+        self.graph.add_agent(agent)
+
+    def snapshot(self, snapshot_id: Optional[str] = None) -> GameSnapshot:
+        """Снимок текущего состояния; память агентов должна быть загружена (см. Agent.hydrate)"""
+        return GameSnapshot(
+            snapshot_id=snapshot_id or uuid.uuid4().hex[:12],
+            game_id=self.game_id,
+            agents={aid: agent.fork() for aid, agent in self.agents.items()},
+            votes=list(self.voting_history.records),
+            scenario=self.scenario.to_dict(),
+            messages=self.messages.snapshot(),
+        )
+
+    def restore(self, snapshot: GameSnapshot):
+        """Заменить состояние игры снимком (другой игры или своим); снимок можно восстанавливать повторно"""
+        self.agents = {aid: agent.fork() for aid, agent in snapshot.agents.items()}
+        self.voting_history = VoteLog(snapshot.votes)
+        self.storage.save_history(snapshot.votes)
+        self.messages.restore(snapshot.messages)
+        self.update_scenario(**snapshot.scenario)
+        self.epoch = uuid.uuid4().hex[:8]
+        self.responses.clear()
+        self._build_graph()
+        self.changed = True
+
+    def reload(self):
+        """Перечитать состояние, сохранённое другим воркером"""
+        self._load()
+
+    def save(self):
+        backend = getattr(self.storage, "backend", "unknown")
+        start = time.perf_counter()
+        with span("storage.save", backend=backend):
+            written = self.storage.save_agents(self.agents)
+        STORAGE_SAVE_SECONDS.labels(backend).observe(time.perf_counter() - start)
+        STORAGE_BYTES_WRITTEN.labels(backend).inc(written or 0)
+        self.changed = True
+
+    def record_message(self, sender: str, text: str, round: Optional[int] = None,
+                       agent_id: Optional[str] = None) -> Dict[str, Any]:
+        message = self.messages.append(sender, text, round, agent_id)
+        self.changed = True
+        return message
+
+    def record_vote(self, record: Dict[str, Any]):
+        self.voting_history.append(record)
+        self.storage.append_vote(record)
+        if record.get("alive_agents"):
+            self.graph.set_active(record["alive_agents"])
+        self.changed = True
+
+    @property
+    def bunker(self) -> Optional[Dict[str, Any]]:
+        return self.scenario.bunker
+
+    @property
+    def disaster(self) -> Optional[Dict[str, Any]]:
+        return self.scenario.disaster
+
+    @property
+    def threat(self) -> Optional[Dict[str, Any]]:
+        return self.scenario.threat
+
+    def update_scenario(self, **parts: Optional[Dict[str, Any]]):
+        """Задать bunker/disaster/threat и сохранить сценарий в бэкенде координации"""
+        self.scenario.update(**parts)
+        self.state.save_scenario(self.game_id, self.scenario.to_dict())
+        self.changed = True
+
+    def reset(self):
+        self.agents.clear()
+        self.voting_history.clear()
+        self.messages.clear()
+        self.storage.clear()
+        self.update_scenario(bunker=None, disaster=None, threat=None)
+        self.epoch = uuid.uuid4().hex[:8]
+        self.responses.clear()
+        self._build_graph()
+
+    def close(self):
+        if hasattr(self.storage, "close"):
+            self.storage.close()
+
+
+class SessionManager:
+    """
+    Реестр игр процесса. Игра по умолчанию хранится в прежних файлах (обратная совместимость),
+    остальные — в отдельных каталогах games_dir/<game_id>/.
+
+    Перед работой с игрой воркер берёт её в аренду (checkout/lease) в бэкенде координации;
+    если другой воркер успел сохранить более новую версию, игра перечитывается с диска.
+    """
+
+    def __init__(self, backend: str, games_dir: str, default_game_id: str,
+                 agents_file: str, history_file: str, sqlite_file: str, legacy_history_file: str = None,
+                 state: Optional[StateBackend] = None, owner: str = "local",
+                 lease_ttl: float = 300.0, lease_wait: float = 30.0,
+                 messages_file: Optional[str] = None, message_capacity: int = 200, message_window: int = 5,
+                 max_snapshots: int = 32):
+        self.backend = backend
+        self.messages_file = messages_file
+        self.message_capacity = message_capacity
+        self.message_window = message_window
+        self.state = state or LocalStateBackend()
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.lease_wait = lease_wait
+        self._holds: Dict[str, int] = defaultdict(int)
+        self._lease_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._heartbeats: Dict[str, asyncio.Task] = {}
+        self.games_dir = games_dir
+        self.default_game_id = default_game_id
+        self.agents_file = agents_file
+        self.history_file = history_file
+        self.sqlite_file = sqlite_file
+        self.legacy_history_file = legacy_history_file
+        self._sessions: Dict[str, GameSession] = {}
+        self.max_snapshots = max_snapshots
+        self._snapshots: Dict[str, GameSnapshot] = {}
+
+    @staticmethod
+    def validate_game_id(game_id: str):
+        if not GAME_ID_RE.match(game_id):
+            raise ValueError(f"Invalid game id: {game_id!r}")
+
+    def _game_dir(self, game_id: str) -> str:
+        return os.path.join(self.games_dir, game_id)
+
+    def _create_storage(self, game_id: str):
+        if game_id == self.default_game_id:
+            return create_storage(self.backend, self.agents_file, self.history_file, self.sqlite_file,
+                                  self.legacy_history_file)
+        game_dir = self._game_dir(game_id)
+        os.makedirs(game_dir, exist_ok=True)
+        return create_storage(
+            self.backend,
+            os.path.join(game_dir, os.path.basename(self.agents_file)),
+            os.path.join(game_dir, os.path.basename(self.history_file)),
+            os.path.join(game_dir, os.path.basename(self.sqlite_file)),
+        )
+
+    def _messages_file(self, game_id: str) -> Optional[str]:
+        if not self.messages_file:
+            return None
+        if game_id == self.default_game_id:
+            return self.messages_file
+        return os.path.join(self._game_dir(game_id), os.path.basename(self.messages_file))
+
+    def exists(self, game_id: str) -> bool:
+        return (game_id in self._sessions or game_id == self.default_game_id
+                or os.path.isdir(self._game_dir(game_id)))
+
+    def get(self, game_id: str) -> Optional[GameSession]:
+        """Вернуть игру, загрузив её с диска при первом обращении; None, если такой игры нет"""
+        session = self._sessions.get(game_id)
+        if session is not None:
+            return session
+        self.validate_game_id(game_id)
+        if not self.exists(game_id):
+            return None
+        session = GameSession(game_id, self._create_storage(game_id), self.state, self._messages_file(game_id),
+                              self.message_capacity, self.message_window)
+        self._sessions[game_id] = session
+        logger.info(f"Loaded game {game_id} with {len(session.agents)} agents")
+        return session
+
+    def create(self, game_id: Optional[str] = None) -> GameSession:
+        game_id = game_id or uuid.uuid4().hex[:12]
+        self.validate_game_id(game_id)
+        if self.exists(game_id) and game_id != self.default_game_id:
+            raise ValueError(f"Game {game_id} already exists")
+        os.makedirs(self._game_dir(game_id), exist_ok=True)
+        return self.get(game_id)
+
+    def delete(self, game_id: str):
+        """Удалить игру вместе с файлами; игра по умолчанию только сбрасывается"""
+        session = self.get(game_id)
+        if session is None:
+            return
+        session.reset()
+        if game_id == self.default_game_id:
+            return
+        session.close()
+        del self._sessions[game_id]
+        shutil.rmtree(self._game_dir(game_id), ignore_errors=True)
+        logger.info(f"Deleted game {game_id}")
+
+    def snapshot(self, session: GameSession) -> GameSnapshot:
+        """Снять и запомнить снимок игры; сверх max_snapshots вытесняется самый старый"""
+        snapshot = session.snapshot()
+        self._snapshots[snapshot.snapshot_id] = snapshot
+        while len(self._snapshots) > self.max_snapshots:
+            del self._snapshots[next(iter(self._snapshots))]
+        return snapshot
+
+    def get_snapshot(self, snapshot_id: str) -> Optional[GameSnapshot]:
+        return self._snapshots.get(snapshot_id)
+
+    def snapshots(self, game_id: str) -> List[GameSnapshot]:
+        return [s for s in self._snapshots.values() if s.game_id == game_id]
+
+    def drop_snapshot(self, snapshot_id: str) -> bool:
+        return self._snapshots.pop(snapshot_id, None) is not None
+
+    def fork(self, snapshot: GameSnapshot, game_id: Optional[str] = None) -> GameSession:
+        """Новая игра из снимка; агенты разделяют память со снимком до первого изменения"""
+        session = self.create(game_id)
+        if session.agents or session.voting_history.records:
+            raise ValueError(f"Game {session.game_id} is not empty")
+        session.restore(snapshot)
+        logger.info(f"Forked game {snapshot.game_id} into {session.game_id} with {len(session.agents)} agents")
+        return session
+
+    def list_ids(self) -> List[str]:
+        ids = {self.default_game_id, *self._sessions}
+        if os.path.isdir(self.games_dir):
+            ids.update(name for name in os.listdir(self.games_dir)
+                       if GAME_ID_RE.match(name) and os.path.isdir(self._game_dir(name)))
+        return sorted(ids)
+
+    def embedding_mismatches(self, embedder: EmbeddingBackend) -> Dict[str, List[str]]:
+        """
+        Игры, в хранилище которых есть эмбеддинги другого бэкенда: game_id -> найденные метки.
+        Читаются только метки в хранилище: игры не загружаются в воркер и аренда не нужна.
+        """
+        mismatches = {}
+        for game_id in self.list_ids():
+            found = []
+            for tag in self._embedding_tags(game_id):
+                try:
+                    check_tag(embedder, tag)
+                except EmbeddingMismatchError as e:
+                    found.append(e.found)
+            if found:
+                mismatches[game_id] = sorted(found)
+        return mismatches
+
+    def _embedding_tags(self, game_id: str) -> set:
+        session = self._sessions.get(game_id)
+        if session is not None:
+            return session.storage.embedding_tags()
+        storage = self._create_storage(game_id)
+        try:
+            return storage.embedding_tags()
+        finally:
+            if hasattr(storage, "close"):
+                storage.close()
+
+    def load_all(self) -> List[GameSession]:
+        return [self.get(game_id) for game_id in self.list_ids()]
+
+    def loaded(self) -> List[GameSession]:
+        return list(self._sessions.values())
+
+    async def checkout(self, session: GameSession):
+        """Взять игру в аренду (повторный вход в рамках воркера не ждёт) и перечитать её, если она устарела"""
+        game_id = session.game_id
+        async with self._lease_locks[game_id]:
+            if self._holds[game_id] == 0:
+                deadline = time.monotonic() + self.lease_wait
+                with span("lease.acquire"):
+                    while not self.state.acquire(game_id, self.owner, self.lease_ttl):
+                        if time.monotonic() >= deadline:
+                            raise GameBusyError(game_id, self.state.owner(game_id))
+                        await asyncio.sleep(LEASE_POLL_INTERVAL)
+                if self.state.version(game_id) != session.version:
+                    logger.info(f"Game {game_id} was changed by another worker, reloading")
+                    with span("lease.reload"):
+                        session.reload()
+                self._heartbeats[game_id] = asyncio.create_task(self._heartbeat(game_id))
+            self._holds[game_id] += 1
+
+    async def _heartbeat(self, game_id: str):
+        """Продлевать аренду, пока игра удерживается: долгая задача не должна пережить TTL"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            if not self.state.acquire(game_id, self.owner, self.lease_ttl):
+                logger.error(f"Lease on game {game_id} was taken over by worker {self.state.owner(game_id)}")
+                return
+
+    def checkin(self, session: GameSession):
+        game_id = session.game_id
+        self._holds[game_id] -= 1
+        if self._holds[game_id] > 0:
+            return
+        heartbeat = self._heartbeats.pop(game_id, None)
+        if heartbeat is not None:
+            heartbeat.cancel()
+        if session.changed:
+            if self.state.version(game_id) != session.version:
+                # Аренду перехватил другой воркер и сохранил игру: своя версия не публикуется,
+                # при следующей аренде игра перечитывается
+                logger.error(f"Game {game_id} was saved by another worker while held here, discarding local state")
+                session.version = -1
+            else:
+                session.version = self.state.bump_version(game_id)
+            session.changed = False
+        self.state.release(game_id, self.owner)
+
+    @asynccontextmanager
+    async def lease(self, session: GameSession):
+        await self.checkout(session)
+        try:
+            yield session
+        finally:
+            self.checkin(session)
+
+    def save_all(self):
+        """Сохранить загруженные игры, которые не устарели относительно других воркеров (например, при выходе)"""
+        for session in self.loaded():
+            if not self.state.acquire(session.game_id, self.owner, self.lease_ttl):
+                continue
+            try:
+                if self.state.version(session.game_id) == session.version:
+                    session.save()
+                    if session.changed:
+                        session.version = self.state.bump_version(session.game_id)
+                        session.changed = False
+            finally:
+                if self._holds[session.game_id] == 0:
+                    self.state.release(session.game_id, self.owner)
@@ -0,0 +1,355 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from agent import Agent
+from memory import MemoryStore
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agents (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    bunker_params TEXT NOT NULL,
+    avatar TEXT NOT NULL DEFAULT '',
+    mood REAL NOT NULL DEFAULT 0.0,
+    revealed_cards TEXT NOT NULL DEFAULT '[]',
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memories (
+    id TEXT PRIMARY KEY,
+    agent_id TEXT NOT NULL REFERENCES agents(id) ON DELETE CASCADE,
+    text TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    importance REAL,
+    pinned INTEGER,
+    count INTEGER,
+    level INTEGER,
+    embedding_tag TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_memories_agent ON memories(agent_id, timestamp);
+CREATE TABLE IF NOT EXISTS plans (
+    agent_id TEXT NOT NULL REFERENCES agents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (agent_id, position)
+);
+CREATE TABLE IF NOT EXISTS relationships (
+    agent_id TEXT NOT NULL REFERENCES agents(id) ON DELETE CASCADE,
+    other_id TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (agent_id, other_id)
+);
+CREATE TABLE IF NOT EXISTS votes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    round INTEGER NOT NULL,
+    votes TEXT NOT NULL,
+    excluded_id TEXT NOT NULL,
+    alive_agents TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_votes_round ON votes(round);
+"""
+
+
+class SQLiteStore:
+    """
+    Хранилище агентов во встроенной SQLite (WAL).
+    Каждый агент — отдельные строки, поэтому сохранение инкрементально,
+    а загрузка возможна по одному агенту.
+    """
+    backend = "sqlite"
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Добавить столбцы, появившиеся после создания базы (NULL — значение вычисляется при загрузке)"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(memories)")}
+        for column, ddl in (("importance", "REAL"), ("pinned", "INTEGER"), ("count", "INTEGER"),
+                            ("level", "INTEGER"), ("embedding_tag", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE memories ADD COLUMN {column} {ddl}")
+
+    def close(self):
+        self._conn.close()
+
+    # ---------- Агенты ----------
+
+    def _upsert_agent(self, agent: Agent, taken: List[Tuple[MemoryStore, Set[str]]]) -> int:
+        """
+        Записать агента; возвращает примерный объём записанных данных в байтах (текст и эмбеддинги).
+        Забранные у памяти id слитых воспоминаний добавляются в taken, чтобы вернуть их при откате транзакции.
+        """
+        conn = self._conn
+        bunker_params = json.dumps(agent.bunker_params, ensure_ascii=False)
+        revealed_cards = json.dumps(agent.revealed_cards, ensure_ascii=False)
+        written = sum(len(value.encode("utf-8")) for value in
+                      (agent.name, agent.personality, bunker_params, agent.avatar or "", revealed_cards, *agent.plans))
+        written += 16 * len(agent.relationships)
+        conn.execute(
+            """
+            INSERT INTO agents (id, name, personality, bunker_params, avatar, mood, revealed_cards, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                name=excluded.name, personality=excluded.personality, bunker_params=excluded.bunker_params,
+                avatar=excluded.avatar, mood=excluded.mood, revealed_cards=excluded.revealed_cards,
+                updated_at=excluded.updated_at
+            """,
+            (agent.id, agent.name, agent.personality, bunker_params,
+             agent.avatar, agent.mood, revealed_cards,
+             datetime.now().isoformat()),
+        )
+
+        conn.execute("DELETE FROM plans WHERE agent_id = ?", (agent.id,))
+        conn.executemany(
+            "INSERT INTO plans (agent_id, position, text) VALUES (?, ?, ?)",
+            [(agent.id, i, text) for i, text in enumerate(agent.plans)],
+        )
+
+        conn.execute("DELETE FROM relationships WHERE agent_id = ?", (agent.id,))
+        conn.executemany(
+            "INSERT INTO relationships (agent_id, other_id, value) VALUES (?, ?, ?)",
+            [(agent.id, other_id, value) for other_id, value in agent.relationships.items()],
+        )
+
+        # Память ещё не загружена — в базе она не менялась
+        if not agent.is_hydrated:
+            return written
+
+        # Текст и эмбеддинг воспоминания неизменны: дописываем новые, удаляем исчезнувшие
+        # (суммаризация, вытеснение) и обновляем счётчик/время слитых почти-дубликатов
+        stored_ids = {row[0] for row in conn.execute("SELECT id FROM memories WHERE agent_id = ?", (agent.id,))}
+        current = {m['id']: m for m in agent.memory.memories}
+        new_ids = current.keys() - stored_ids
+        removed_ids = stored_ids - current.keys()
+        dirty = agent.memory.take_dirty()
+        taken.append((agent.memory, dirty))
+        merged_ids = (dirty & current.keys()) - new_ids
+        if new_ids:
+            new_records = agent.memory.to_records(only=new_ids)
+            conn.executemany(
+                "INSERT INTO memories (id, agent_id, text, timestamp, embedding, importance, pinned, count, level,"
+                " embedding_tag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r['id'], agent.id, r['text'], r['timestamp'], r['embedding'], r['importance'], r['pinned'],
+                  r['count'], r['level'], r['embedding_tag']) for r in new_records],
+            )
+            written += sum(len(r['text'].encode("utf-8")) + len(r['embedding']) for r in new_records)
+        if merged_ids:
+            conn.executemany(
+                "UPDATE memories SET timestamp = ?, importance = ?, count = ? WHERE id = ?",
+                [(current[mid]['timestamp'].isoformat(), current[mid]['importance'], current[mid]['count'], mid)
+                 for mid in merged_ids],
+            )
+        if removed_ids:
+            conn.executemany("DELETE FROM memories WHERE id = ?", [(mid,) for mid in removed_ids])
+        return written
+
+    @staticmethod
+    def _restore_dirty(taken: List[Tuple[MemoryStore, Set[str]]]):
+        # Транзакция откатилась: слитые воспоминания остаются несохранёнными до следующей записи
+        for memory, ids in taken:
+            memory.mark_dirty(ids)
+
+    def save_agent(self, agent: Agent):
+        """Сохранить (upsert) одного агента"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            taken = []
+            try:
+                self._upsert_agent(agent, taken)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._restore_dirty(taken)
+                raise
+
+    def save_agents(self, agents: Dict[str, Agent]) -> int:
+        """
+        Сохранить всех агентов одной транзакцией; удалённые из словаря агенты удаляются из базы.
+        Возвращает примерный объём записанных данных в байтах.
+        """
+        written = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            taken = []
+            try:
+                for agent in agents.values():
+                    written += self._upsert_agent(agent, taken)
+                stored_ids = {row[0] for row in self._conn.execute("SELECT id FROM agents")}
+                for aid in stored_ids - agents.keys():
+                    self._conn.execute("DELETE FROM agents WHERE id = ?", (aid,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._restore_dirty(taken)
+                raise
+        logger.info(f"Saved {len(agents)} agents to {self.filepath}")
+        return written
+
+    def delete_agent(self, agent_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM agents WHERE id = ?", (agent_id,))
+
+    def list_agent_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM agents ORDER BY rowid")]
+
+    def embedding_tags(self) -> Set[Optional[str]]:
+        """Метки бэкендов, которыми посчитаны сохранённые эмбеддинги (None — сохранения до появления меток)"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT DISTINCT embedding_tag FROM memories")}
+
+    def _load_memory(self, agent_id: str) -> MemoryStore:
+        with self._lock:
+            memory_rows = [dict(r) for r in self._conn.execute(
+                "SELECT id, text, timestamp, embedding, importance, pinned, count, level, embedding_tag FROM memories"
+                " WHERE agent_id = ? ORDER BY timestamp",
+                (agent_id,))]
+        return MemoryStore.from_records(memory_rows)
+
+    @staticmethod
+    def _agent_data(row, plans: List[str], relationships: Dict[str, float]) -> dict:
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'personality': row['personality'],
+            'bunker_params': json.loads(row['bunker_params']),
+            'avatar': row['avatar'],
+            'mood': row['mood'],
+            'relationships': relationships,
+            'plans': plans,
+            'revealed_cards': json.loads(row['revealed_cards']),
+        }
+
+    def load_agent(self, agent_id: str, lazy: bool = False) -> Optional[Agent]:
+        """Загрузить одного агента; память (эмбеддинги из базы) — сразу или при первом обращении"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM agents WHERE id = ?", (agent_id,)).fetchone()
+            if row is None:
+                return None
+            plans = [r['text'] for r in self._conn.execute(
+                "SELECT text FROM plans WHERE agent_id = ? ORDER BY position", (agent_id,))]
+            relationships = {r['other_id']: r['value'] for r in self._conn.execute(
+                "SELECT other_id, value FROM relationships WHERE agent_id = ?", (agent_id,))}
+        return Agent.from_dict(self._agent_data(row, plans, relationships),
+                               memory_loader=lambda: self._load_memory(agent_id), lazy=lazy)
+
+    def load_agents(self, lazy: bool = False) -> Dict[str, Agent]:
+        """Загрузить всех агентов: метаданные тремя запросами, память — сразу или лениво"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM agents ORDER BY rowid").fetchall()
+            plans: Dict[str, List[str]] = {}
+            for r in self._conn.execute("SELECT agent_id, text FROM plans ORDER BY agent_id, position"):
+                plans.setdefault(r['agent_id'], []).append(r['text'])
+            relationships: Dict[str, Dict[str, float]] = {}
+            for r in self._conn.execute("SELECT agent_id, other_id, value FROM relationships"):
+                relationships.setdefault(r['agent_id'], {})[r['other_id']] = r['value']
+
+        agents = {}
+        for row in rows:
+            aid = row['id']
+            try:
+                agents[aid] = Agent.from_dict(
+                    self._agent_data(row, plans.get(aid, []), relationships.get(aid, {})),
+                    memory_loader=lambda aid=aid: self._load_memory(aid), lazy=lazy)
+            except Exception as e:
+                logger.error(f"Failed to load agent {aid}: {e}")
+        logger.info(f"Loaded {len(agents)} agents from {self.filepath}")
+        return agents
+
+    # ---------- История голосований ----------
+
+    def load_history(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM votes ORDER BY id").fetchall()
+        return [
+            {
+                "round": r['round'],
+                "votes": json.loads(r['votes']),
+                "excluded_id": r['excluded_id'],
+                "alive_agents": json.loads(r['alive_agents']),
+                "timestamp": r['timestamp'],
+            }
+            for r in rows
+        ]
+
+    def append_vote(self, record: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO votes (round, votes, excluded_id, alive_agents, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (record['round'], json.dumps(record['votes'], ensure_ascii=False), record['excluded_id'],
+                 json.dumps(record['alive_agents'], ensure_ascii=False), record['timestamp']),
+            )
+
+    def save_history(self, history: list):
+        """История только дополняется, поэтому дописываются записи сверх уже сохранённых"""
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM votes").fetchone()[0]
+            if len(history) <= stored:
+                return
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO votes (round, votes, excluded_id, alive_agents, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [(rec['round'], json.dumps(rec['votes'], ensure_ascii=False), rec['excluded_id'],
+                      json.dumps(rec['alive_agents'], ensure_ascii=False), rec['timestamp'])
+                     for rec in history[stored:]],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._conn.executescript("DELETE FROM agents; DELETE FROM votes;")
+        logger.info(f"Cleared {self.filepath}")
+
+
+def migrate_from_json(agents_file: str, history_file: str, db_path: str,
+                      legacy_history_file: str = None) -> SQLiteStore:
+    """Перенести состояние из JSON-файлов в SQLite (эмбеддинги пересчитываются один раз)"""
+    from persistence import JSONStorage
+
+    source = JSONStorage(agents_file, history_file, legacy_history_file)
+    store = SQLiteStore(db_path)
+    agents = source.load_agents()
+    store.save_agents(agents)
+    history = source.load_history()
+    store.save_history(history)
+    logger.info(f"Migrated {len(agents)} agents and {len(history)} votes into {db_path}")
+    return store
+
+
+if __name__ == "__main__":
+    from config import AGENTS_FILE, HISTORY_FILE, LEGACY_HISTORY_FILE, SQLITE_FILE
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Миграция состояния агентов из JSON в SQLite")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--agents", default=AGENTS_FILE, help="JSON-файл агентов")
+    parser.add_argument("--history", default=HISTORY_FILE, help="JSONL-журнал истории голосований")
+    parser.add_argument("--legacy-history", default=LEGACY_HISTORY_FILE, help="старый JSON-файл истории голосований")
+    parser.add_argument("--db", default=SQLITE_FILE, help="Путь к базе SQLite")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.agents):
+        parser.error(f"{args.agents} not found")
+    migrate_from_json(args.agents, args.history, args.db, args.legacy_history).close()
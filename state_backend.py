@@ -0,0 +1,187 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Any
+
+
+def default_worker_id() -> str:
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_for_game(game_id: str, workers: int) -> int:
+    """Стабильная привязка игры к воркеру (для балансировщика/клиента): одна игра — один воркер"""
+    return zlib.crc32(game_id.encode("utf-8")) % workers
+
+
+class StateBackend:
+    """
+    Координация игр между процессами: аренда (lease) игры воркером, версия сохранённого состояния
+    и параметры сценария. Само состояние агентов лежит в хранилище игры (JSON/SQLite).
+    """
+
+    def acquire(self, game_id: str, owner: str, ttl: float) -> bool:
+        """Взять или продлить аренду игры; False, если игра арендована другим живым воркером"""
+        raise NotImplementedError
+
+    def release(self, game_id: str, owner: str):
+        raise NotImplementedError
+
+    def owner(self, game_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def version(self, game_id: str) -> int:
+        raise NotImplementedError
+
+    def bump_version(self, game_id: str) -> int:
+        raise NotImplementedError
+
+    def load_scenario(self, game_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def save_scenario(self, game_id: str, scenario: Dict[str, Any]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalStateBackend(StateBackend):
+    """Один процесс: аренда всегда свободна, версии и сценарий живут в памяти."""
+
+    def __init__(self):
+        self._owners: Dict[str, str] = {}
+        self._versions: Dict[str, int] = {}
+        self._scenarios: Dict[str, Dict[str, Any]] = {}
+
+    def acquire(self, game_id: str, owner: str, ttl: float) -> bool:
+        current = self._owners.get(game_id)
+        if current is not None and current != owner:
+            return False
+        self._owners[game_id] = owner
+        return True
+
+    def release(self, game_id: str, owner: str):
+        if self._owners.get(game_id) == owner:
+            del self._owners[game_id]
+
+    def owner(self, game_id: str) -> Optional[str]:
+        return self._owners.get(game_id)
+
+    def version(self, game_id: str) -> int:
+        return self._versions.get(game_id, 0)
+
+    def bump_version(self, game_id: str) -> int:
+        self._versions[game_id] = self._versions.get(game_id, 0) + 1
+        return self._versions[game_id]
+
+    def load_scenario(self, game_id: str) -> Dict[str, Any]:
+        return dict(self._scenarios.get(game_id, {}))
+
+    def save_scenario(self, game_id: str, scenario: Dict[str, Any]):
+        self._scenarios[game_id] = dict(scenario)
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Общий для нескольких воркеров файл SQLite (WAL): аренда с TTL, версия состояния и сценарий игры.
+    Подходит для N процессов uvicorn на одной машине или общем томе.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS games (
+                game_id TEXT PRIMARY KEY,
+                owner TEXT,
+                lease_expires REAL NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0,
+                scenario TEXT NOT NULL DEFAULT '{}'
+            )
+        """)
+
+    def _ensure_row(self, game_id: str):
+        self._conn.execute("INSERT OR IGNORE INTO games (game_id) VALUES (?)", (game_id,))
+
+    def acquire(self, game_id: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_row(game_id)
+                row = self._conn.execute(
+                    "SELECT owner, lease_expires FROM games WHERE game_id = ?", (game_id,)).fetchone()
+                current_owner, expires = row
+                if current_owner not in (None, owner) and expires > now:
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute(
+                    "UPDATE games SET owner = ?, lease_expires = ? WHERE game_id = ?", (owner, now + ttl, game_id))
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def release(self, game_id: str, owner: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE games SET owner = NULL, lease_expires = 0 WHERE game_id = ? AND owner = ?", (game_id, owner))
+
+    def owner(self, game_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner, lease_expires FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        if row is None or row[0] is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def version(self, game_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, game_id: str) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_row(game_id)
+                self._conn.execute("UPDATE games SET version = version + 1 WHERE game_id = ?", (game_id,))
+                version = self._conn.execute("SELECT version FROM games WHERE game_id = ?", (game_id,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+                return version
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def load_scenario(self, game_id: str) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT scenario FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_scenario(self, game_id: str, scenario: Dict[str, Any]):
+        with self._lock:
+            self._ensure_row(game_id)
+            self._conn.execute("UPDATE games SET scenario = ? WHERE game_id = ?",
+                               (json.dumps(scenario, ensure_ascii=False), game_id))
+
+    def close(self):
+        self._conn.close()
+
+
+def create_state_backend(backend: str, sqlite_file: str) -> StateBackend:
+    """Выбрать бэкенд координации по имени из конфигурации ("local" или "sqlite")."""
+    if backend == "local":
+        return LocalStateBackend()
+    if backend == "sqlite":
+        return SQLiteStateBackend(sqlite_file)
+    raise ValueError(f"Unknown state backend: {backend}")
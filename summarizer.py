@@ -0,0 +1,206 @@
+import json
+import logging
+import re
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncContextManager, Callable, Dict, List, Optional, Any
+
+from ModelManager import LLMUnavailableError
+from memory import RAW, ROUND_SUMMARY, GAME_SUMMARY, MemoryStore, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SummaryJob:
+    agent: Any
+    level: int  # уровень создаваемой сводки
+    batch: List[Dict[str, Any]]
+
+
+@asynccontextmanager
+async def _no_hold():
+    yield
+
+
+def _tokens(memories: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(m['text']) for m in memories)
+
+
+class Summarizer:
+    """
+    Иерархическая суммаризация памяти агентов: сырые воспоминания -> сводки раундов -> сводка игры.
+
+    Сырые воспоминания (кроме keep_recent последних) сворачиваются в сводку раунда, когда их объём
+    превышает raw_budget токенов; сводки раундов вместе с прежней сводкой игры сворачиваются в новую
+    сводку игры, когда их объём превышает round_budget. Задачи нескольких агентов одного уровня
+    отправляются одним структурированным вызовом LLM (ответ — JSON); если ответ не разобран,
+    для оставшихся агентов делаются отдельные вызовы. Если модель так и не ответила, воспоминания
+    остаются на месте до следующего запуска.
+    """
+
+    def __init__(self, model_manager, raw_budget: int = 400, keep_recent: int = 6, round_budget: int = 300,
+                 max_batch_agents: int = 8):
+        self.model_manager = model_manager
+        self.raw_budget = raw_budget
+        self.keep_recent = keep_recent
+        self.round_budget = round_budget
+        self.max_batch_agents = max_batch_agents
+        self._counters: Dict[str, int] = {
+            "runs": 0, "jobs": 0, "batched_calls": 0, "single_calls": 0, "fallback_calls": 0, "failed": 0,
+            "summarized": 0,
+        }
+
+    def plan(self, memory: MemoryStore, level: int) -> List[Dict[str, Any]]:
+        """Воспоминания, которые нужно свернуть в сводку уровня level (пусто, если бюджет не превышен)"""
+        if level == ROUND_SUMMARY:
+            raw = sorted((m for m in memory.memories if not m.get('pinned') and m.get('level', RAW) == RAW),
+                         key=lambda m: m['timestamp'])
+            older = raw[:-self.keep_recent] if self.keep_recent else raw
+            if older and _tokens(raw) > self.raw_budget:
+                return older
+            return []
+        rounds = [m for m in memory.memories if m.get('level', RAW) == ROUND_SUMMARY]
+        if len(rounds) < 2 or _tokens(rounds) <= self.round_budget:
+            return []
+        game = [m for m in memory.memories if m.get('level', RAW) == GAME_SUMMARY]
+        return sorted(game + rounds, key=lambda m: m['timestamp'])
+
+    async def run(self, agents: Callable[[], Dict[str, Any]], round: Optional[int] = None,
+                  hold: Optional[Callable[[], AsyncContextManager]] = None,
+                  commit: Optional[Callable[[], None]] = None) -> int:
+        """
+        Свернуть память агентов, где превышены бюджеты; возвращает число свёрнутых воспоминаний.
+        agents — текущие агенты игры по id, hold — аренда игры. Аренда держится, пока выбираются
+        воспоминания и применяются сводки, но не во время вызовов LLM; пока её не было, игру могли
+        перечитать, поэтому агенты берутся заново, а сводки применяются только к оставшимся воспоминаниям.
+        commit вызывается под арендой после применения сводок (сохранение игры).
+        """
+        hold = hold or _no_hold
+        self._counters["runs"] += 1
+        total = 0
+        for level in (ROUND_SUMMARY, GAME_SUMMARY):
+            async with hold():
+                jobs = await self._plan_jobs(list(agents().values()), level)
+            try:
+                for start in range(0, len(jobs), self.max_batch_agents):
+                    chunk = jobs[start:start + self.max_batch_agents]
+                    summaries = await self._summarize(chunk, round)
+                    async with hold():
+                        current = agents()
+                        count = 0
+                        for job, summary in zip(chunk, summaries):
+                            if summary is not None:
+                                count += await self._apply(job, summary, current.get(job.agent.id))
+                        if count and commit is not None:
+                            commit()
+                    total += count
+            finally:
+                for job in jobs:
+                    job.agent.summarizing = False
+        self._counters["summarized"] += total
+        return total
+
+    async def _plan_jobs(self, agents: List[Any], level: int) -> List[SummaryJob]:
+        jobs = []
+        for agent in agents:
+            if not agent.is_hydrated or agent.summarizing:
+                continue
+            async with agent.mutation():
+                batch = self.plan(agent.memory, level)
+            if batch:
+                agent.summarizing = True
+                jobs.append(SummaryJob(agent, level, batch))
+        return jobs
+
+    async def _summarize(self, jobs: List[SummaryJob], round: Optional[int]) -> List[Optional[str]]:
+        """
+        Сводки для задач (один вызов LLM на пакет, неразобранные — отдельными вызовами).
+        None — модель не ответила: заглушку нельзя сохранять вместо удаляемых воспоминаний.
+        """
+        self._counters["jobs"] += len(jobs)
+        summaries: Dict[int, str] = {}
+        if len(jobs) > 1:
+            self._counters["batched_calls"] += 1
+            try:
+                response = await self.model_manager.generate_with_fallback(
+                    "summarize", self.batch_prompt(jobs, round), raise_on_failure=True)
+            except LLMUnavailableError as e:
+                logger.warning(f"Batched summarization failed: {e}")
+                response = ""
+            summaries = self.parse_batch(response, len(jobs))
+        result = []
+        for i, job in enumerate(jobs):
+            summary = summaries.get(i)
+            if summary is None:
+                self._counters["fallback_calls" if len(jobs) > 1 else "single_calls"] += 1
+                try:
+                    summary = (await self.model_manager.generate_with_fallback(
+                        "summarize", self.single_prompt(job, round), raise_on_failure=True)).strip() or None
+                except LLMUnavailableError as e:
+                    logger.warning(f"Summarization for {job.agent.name} failed, memories kept: {e}")
+                if summary is None:
+                    self._counters["failed"] += 1
+            result.append(summary)
+        return result
+
+    @staticmethod
+    async def _apply(job: SummaryJob, summary: str, agent: Optional[Any]) -> int:
+        # Агент мог исчезнуть или смениться при перечитывании игры — тогда ищем его воспоминания по id
+        if agent is None or not agent.is_hydrated:
+            return 0
+        async with agent.mutation():
+            embedding = await agent._encode(MemoryStore.summary_text(summary, job.level))
+            count = agent.memory.apply_summary([m['id'] for m in job.batch], summary, embedding, level=job.level)
+        logger.info(f"Agent {agent.name} folded {count} memories into level {job.level} summary")
+        return count
+
+    @staticmethod
+    def _instruction(level: int) -> str:
+        if level == GAME_SUMMARY:
+            return ("Объедини сводки раундов и прежние итоги игры в одну общую сводку игры (2-3 предложения) "
+                    "от первого лица, сохранив ключевые события, союзы, конфликты и итоги голосований.")
+        return ("Суммируй воспоминания в одно-два коротких предложения от первого лица, "
+                "сохранив ключевые детали.")
+
+    def single_prompt(self, job: SummaryJob, round: Optional[int]) -> str:
+        header = f"Раунд {round}. " if round is not None else ""
+        return (f"{header}{self._instruction(job.level)}\n"
+                + "\n".join(f"- {m['text']}" for m in job.batch))
+
+    def batch_prompt(self, jobs: List[SummaryJob], round: Optional[int]) -> str:
+        header = f"Раунд {round}. " if round is not None else ""
+        parts = [
+            f"{header}Ниже воспоминания нескольких персонажей игры «Бункер». "
+            f"Для каждого персонажа отдельно: {self._instruction(jobs[0].level)}",
+            "Ответь только JSON-объектом вида {\"0\": \"сводка\", \"1\": \"сводка\", ...} "
+            "с ключами — номерами персонажей, без пояснений.",
+        ]
+        for i, job in enumerate(jobs):
+            parts.append(f"[{i}] {job.agent.name}:\n" + "\n".join(f"- {m['text']}" for m in job.batch))
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def parse_batch(response: str, n: int) -> Dict[int, str]:
+        """Сводки из JSON-ответа по номерам персонажей; неразобранные номера отсутствуют"""
+        match = re.search(r"\{.*\}", response, re.DOTALL)
+        if not match:
+            return {}
+        try:
+            data = json.loads(match.group())
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        result = {}
+        for key, value in data.items():
+            try:
+                idx = int(key)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= idx < n and isinstance(value, str) and value.strip():
+                result[idx] = value.strip()
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._counters)
@@ -0,0 +1,27 @@
+import atexit
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тесты не загружают sentence-transformers и не ходят в Gemini: эмбеддинги — хеширование слов, LLM — имитация
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    from fastapi.testclient import TestClient
+
+    # Приложение (планировщик, лимитеры) живёт в одном event loop, поэтому клиент один на все тесты;
+    # тесты работают каждый со своими играми. Состояние игр пишется относительно рабочего каталога
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("app"))
+        import main
+        # Автосохранение при выходе писало бы игру по умолчанию в каталог, из которого запущен pytest
+        atexit.unregister(main.auto_save)
+        with TestClient(main.app) as client:
+            yield client
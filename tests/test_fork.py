@@ -0,0 +1,120 @@
+import numpy as np
+
+from agent import Agent
+from embeddings import create_embedding_backend
+from memory import MemoryStore
+
+DIM = 8
+
+
+def vector(seed: int) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def filled_store(n: int = 5, **kwargs) -> MemoryStore:
+    kwargs.setdefault("dedup_threshold", None)
+    memory = MemoryStore(embedder=create_embedding_backend("hashing", "", DIM), max_memories=None, **kwargs)
+    for i in range(n):
+        memory.add(f"m{i}", vector(i))
+    # Буферы поиска собраны, как у агента в идущей игре
+    memory.search("q", k=1, query_embedding=vector(0))
+    return memory
+
+
+def texts(memory: MemoryStore):
+    return [m['text'] for m in memory.memories]
+
+
+def test_fork_shares_buffers_until_first_write():
+    original = filled_store()
+    fork = original.fork()
+    assert fork._matrix is original._matrix
+    assert fork.memories[0] is original.memories[0]
+
+    fork.add("только в ветке", vector(100))
+    assert fork._matrix is not original._matrix
+    assert original._rows == 5 and fork._rows == 6
+    assert texts(original) == [f"m{i}" for i in range(5)]
+    assert original.search("q", k=1, query_embedding=vector(100)) != ["только в ветке"]
+    assert fork.search("q", k=1, query_embedding=vector(100)) == ["только в ветке"]
+
+
+def test_writes_to_original_do_not_leak_into_fork():
+    original = filled_store()
+    fork = original.fork()
+    original.add("только в оригинале", vector(200))
+    assert texts(fork) == [f"m{i}" for i in range(5)]
+    assert fork.search("q", k=1, query_embedding=vector(200)) != ["только в оригинале"]
+
+
+def test_merge_in_fork_copies_the_record():
+    original = filled_store(dedup_threshold=0.99)
+    fork = original.fork()
+    merged = fork.add("m4 снова", vector(4), importance=1.0)
+    assert merged['count'] == 2
+    assert original.memories[-1]['count'] == 1
+    assert original.memories[-1]['importance'] != 1.0
+    assert original._importance[4] != 1.0
+    assert original.take_dirty() == set()
+    assert fork.take_dirty() == {merged['id']}
+
+
+def test_agent_fork_is_independent():
+    agent = Agent("Анна", "спокойная", {"profession": "врач"}, memory_loader=filled_store)
+    agent.relationships["other"] = 0.5
+    agent.plans.append("договориться")
+    fork = agent.fork()
+    assert fork.id == agent.id
+
+    fork.update_relationship("other", -0.3)
+    fork.plans.append("только в ветке")
+    fork.bunker_params["profession"] = "инженер"
+    fork.memory.add("ветка", vector(300))
+    assert agent.relationships == {"other": 0.5}
+    assert agent.plans == ["договориться"]
+    assert agent.bunker_params == {"profession": "врач"}
+    assert len(agent.memory.memories) == 5
+
+
+def create_agent(client, game_id: str, name: str) -> str:
+    return client.post(f"/games/{game_id}/agents",
+                       json={"name": name, "personality": "спокойный", "bunker_params": {}}).json()["id"]
+
+
+def send_message(client, game_id: str, agent_id: str, text: str):
+    response = client.post(f"/games/{game_id}/agents/{agent_id}/message",
+                           json={"text": text, "context": {"game_state": {"round": 1}}})
+    assert response.status_code == 200
+
+
+def message_texts(client, game_id: str):
+    return [m["text"] for m in client.get(f"/games/{game_id}/messages").json()["items"]]
+
+
+def test_forked_game_is_isolated(client):
+    assert client.post("/games", json={"game_id": "origin"}).status_code == 200
+    ids = [create_agent(client, "origin", name) for name in ("Анна", "Борис")]
+    send_message(client, "origin", ids[0], "до снимка")
+    before = message_texts(client, "origin")
+    assert len(before) == 2
+    snapshot = client.post("/games/origin/snapshots").json()["snapshot_id"]
+    fork = client.post("/games/origin/fork", json={"game_id": "branch", "snapshot_id": snapshot})
+    assert fork.status_code == 200
+    assert fork.json()["agents"] == 2
+
+    anna, boris = ids
+    client.post("/games/branch/vote", json={"round": 1, "votes": {anna: boris, boris: anna},
+                                            "excluded_id": boris, "alive_agents": [anna]})
+    assert len(client.get("/games/branch/relationships/graph").json()["nodes"]) == 1
+    assert len(client.get("/games/origin/relationships/graph").json()["nodes"]) == 2
+    assert client.get("/games/origin/history/votes").json()["items"] == []
+
+    # Снимок не меняется, даже если исходную игру сбросили и она пишет журнал заново
+    assert client.delete("/games/origin/reset").status_code == 200
+    send_message(client, "origin", create_agent(client, "origin", "Вера"), "после сброса")
+    second = client.post("/games/origin/fork", json={"game_id": "branch-2", "snapshot_id": snapshot})
+    assert second.status_code == 200
+    assert second.json()["agents"] == 2
+    assert len(client.get("/games/branch-2/relationships/graph").json()["nodes"]) == 2
+    assert message_texts(client, "branch-2") == message_texts(client, "branch") == before
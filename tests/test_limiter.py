@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from limiter import (
+    AdaptiveLimiter, LatencySLO, SUCCESS, RATE_LIMITED, ERROR, INTERACTIVE, STEP, BACKGROUND,
+    is_rate_limit_error, priority_scope, current_priority
+)
+
+
+def test_success_grows_limit_additively_up_to_max():
+    limiter = AdaptiveLimiter(initial=2, max_limit=3)
+    for _ in range(2):
+        assert limiter.try_acquire()
+        limiter.release(SUCCESS)
+    assert limiter.limit == pytest.approx(2.9, abs=0.01)
+    for _ in range(10):
+        assert limiter.try_acquire()
+        limiter.release(SUCCESS)
+    assert limiter.limit == 3
+
+
+def test_rate_limit_halves_once_per_cooldown_and_respects_min():
+    limiter = AdaptiveLimiter(initial=8, min_limit=3, cooldown=60)
+    for _ in range(3):
+        assert limiter.try_acquire()
+        limiter.release(RATE_LIMITED)
+    assert limiter.limit == 4
+    limiter = AdaptiveLimiter(initial=4, min_limit=3, cooldown=0)
+    for _ in range(2):
+        assert limiter.try_acquire()
+        limiter.release(RATE_LIMITED)
+    assert limiter.limit == 3
+
+
+def test_other_errors_do_not_change_limit():
+    limiter = AdaptiveLimiter(initial=4)
+    assert limiter.try_acquire()
+    limiter.release(ERROR)
+    assert limiter.limit == 4
+    assert limiter.stats()[ERROR] == 1
+
+
+def test_background_share_keeps_slots_for_interactive():
+    limiter = AdaptiveLimiter(initial=4, background_share=0.5)
+    assert limiter.try_acquire(BACKGROUND)
+    assert limiter.try_acquire(BACKGROUND)
+    assert not limiter.try_acquire(BACKGROUND)
+    assert limiter.try_acquire(INTERACTIVE)
+    assert limiter.try_acquire(STEP)
+    assert not limiter.try_acquire(INTERACTIVE)
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_woken_by_priority_then_fifo():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+    assert limiter.try_acquire()
+    order = []
+
+    async def call(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0)
+        limiter.release(SUCCESS)
+
+    tasks = [asyncio.create_task(call(name, priority)) for name, priority in (
+        ("bg", BACKGROUND), ("step1", STEP), ("chat", INTERACTIVE), ("step2", STEP))]
+    await asyncio.sleep(0)
+    assert limiter.waiting() == 4
+    # Пока ждёт интерактивный вызов, более низкий класс не может занять освободившийся слот
+    assert not limiter.try_acquire(STEP)
+    limiter.release(SUCCESS)
+    await asyncio.gather(*tasks)
+    assert order == ["chat", "step1", "step2", "bg"]
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_a_slot():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+    assert limiter.try_acquire()
+    waiter = asyncio.create_task(limiter.acquire(STEP))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.waiting() == 0
+    limiter.release(SUCCESS)
+    assert limiter.in_flight == 0
+    assert limiter.try_acquire()
+
+
+def test_latency_slo_needs_min_samples_and_flags_slow_p95():
+    slo = LatencySLO(target=1.0, min_samples=3)
+    slo.observe(5.0)
+    assert not slo.at_risk()
+    slo.observe(5.0)
+    slo.observe(5.0)
+    assert slo.at_risk()
+    slo = LatencySLO(target=1.0, min_samples=3)
+    for _ in range(3):
+        slo.observe(0.1)
+    assert not slo.at_risk()
+
+
+def test_priority_scope_restores_previous_priority():
+    assert current_priority() == STEP
+    with priority_scope(INTERACTIVE):
+        assert current_priority() == INTERACTIVE
+    assert current_priority() == STEP
+    with pytest.raises(ValueError):
+        with priority_scope("urgent"):
+            pass
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("429 Too Many Requests", True),
+    ("Resource exhausted: quota", True),
+    ("500 Internal Server Error", False),
+])
+def test_is_rate_limit_error(message, expected):
+    assert is_rate_limit_error(RuntimeError(message)) is expected
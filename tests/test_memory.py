@@ -0,0 +1,148 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from embeddings import create_embedding_backend
+from memory import MemoryStore, GAME_SUMMARY
+
+DIM = 8
+
+
+def axis(i: int, dim: int = DIM) -> np.ndarray:
+    v = np.zeros(dim, dtype=np.float32)
+    v[i] = 1.0
+    return v
+
+
+@pytest.fixture
+def embedder():
+    return create_embedding_backend("hashing", "", DIM)
+
+
+def store(embedder, **kwargs) -> MemoryStore:
+    kwargs.setdefault("max_memories", None)
+    kwargs.setdefault("dedup_threshold", None)
+    return MemoryStore(embedder=embedder, **kwargs)
+
+
+def texts(memory: MemoryStore):
+    return [m['text'] for m in memory.memories]
+
+
+def test_cap_evicts_least_valuable_and_keeps_pinned(embedder):
+    memory = store(embedder, max_memories=3)
+    memory.add("вступление", axis(0), importance=0.1, pinned=True)
+    memory.add("важное", axis(1), importance=0.9)
+    memory.add("мелочь", axis(2), importance=0.1)
+    memory.add("среднее", axis(3), importance=0.5)
+    assert texts(memory) == ["вступление", "важное", "среднее"]
+    assert memory.evicted == 1
+    # Буферы сжаты вместе со списком: поиск видит только оставшиеся записи
+    assert memory.search("q", k=1, query_embedding=axis(3)) == ["среднее"]
+
+
+def test_cap_never_evicts_pinned_even_when_over_limit(embedder):
+    memory = store(embedder, max_memories=1)
+    memory.add("a", axis(0), pinned=True)
+    memory.add("b", axis(1), pinned=True)
+    assert texts(memory) == ["a", "b"]
+
+
+def test_search_prefers_relevant_then_important(embedder):
+    memory = store(embedder)
+    memory.add("погода", axis(0), importance=0.9)
+    memory.add("бункер мелочь", axis(1), importance=0.2)
+    memory.add("бункер важно", axis(1), importance=0.8)
+    now = time.time()
+    assert memory.search("q", k=2, query_embedding=axis(1), now=now) == ["бункер важно", "погода"]
+    assert memory.search("q", k=1, query_embedding=axis(0), now=now) == ["погода"]
+
+
+def test_search_prefers_recent_among_equal(embedder):
+    memory = store(embedder)
+    memory.add("старое", axis(0), importance=0.5)
+    memory.add("новое", axis(0), importance=0.5)
+    memory.memories[0]['timestamp'] -= timedelta(seconds=memory.half_life)
+    memory._invalidate()
+    assert memory.search("q", k=2, query_embedding=axis(0)) == ["новое", "старое"]
+
+
+def test_get_recent_returns_newest_first(embedder):
+    memory = store(embedder)
+    for i in range(5):
+        memory.add(f"m{i}", axis(i))
+    assert memory.get_recent(2) == ["m4", "m3"]
+    assert memory.get_recent(0) == []
+
+
+def test_apply_summary_replaces_by_id_and_skips_when_nothing_left(embedder):
+    memory = store(embedder)
+    old = [memory.add(f"m{i}", axis(i)) for i in range(3)]
+    ids = [m['id'] for m in old[:2]]
+    assert memory.apply_summary(ids, "итог", axis(5), level=GAME_SUMMARY) == 2
+    assert texts(memory) == ["m2", "Итоги игры: итог"]
+    assert memory.memories[-1]['pinned']
+    # Повторное применение (параллельная суммаризация) не добавляет вторую сводку
+    assert memory.apply_summary(ids, "итог", axis(5), level=GAME_SUMMARY) == 0
+    assert len(memory.memories) == 2
+
+
+def test_records_round_trip_keeps_embeddings_and_tag(embedder):
+    memory = store(embedder)
+    memory.add("привет", axis(2), importance=0.7)
+    records = memory.to_records()
+    assert records[0]['embedding_tag'] == embedder.tag
+    restored = MemoryStore.from_records(records, embedder=embedder)
+    assert texts(restored) == ["привет"]
+    np.testing.assert_array_equal(restored.memories[0]['embedding'], axis(2))
+    with pytest.raises(ValueError):
+        MemoryStore.from_records(records, embedder=create_embedding_backend("hashing", "", DIM * 2))
+
+
+def near(i: int, j: int, weight: float = 0.1) -> np.ndarray:
+    v = axis(i) + weight * axis(j)
+    return v / np.linalg.norm(v)
+
+
+def test_near_duplicate_merges_into_existing(embedder):
+    memory = store(embedder, dedup_threshold=0.95, dedup_window=4)
+    first = memory.add("Анна голосует против Бориса", axis(0), importance=0.3)
+    merged = memory.add("Анна снова против Бориса", near(0, 1), importance=0.7)
+    assert merged['id'] == first['id']
+    assert texts(memory) == ["Анна голосует против Бориса"]
+    assert merged['count'] == 2
+    assert merged['importance'] == 0.7
+    assert memory.deduplicated == 1
+    assert memory.take_dirty() == {first['id']}
+    assert memory.take_dirty() == set()
+
+
+def test_pinned_match_does_not_hide_unpinned_duplicate(embedder):
+    memory = store(embedder, dedup_threshold=0.9, dedup_window=4)
+    pinned = memory.add("роль", axis(0), pinned=True)
+    plain = memory.add("похожее", near(0, 1, 0.45))
+    # Закреплённая запись ближе к новой, но слиться можно только с обычной
+    merged = memory.add("ещё похожее", near(0, 1, 0.1))
+    assert merged['id'] == plain['id']
+    assert pinned['count'] == 1
+    assert len(memory.memories) == 2
+
+
+def test_duplicate_outside_window_is_kept(embedder):
+    memory = store(embedder, dedup_threshold=0.95, dedup_window=2)
+    memory.add("давнее", axis(0))
+    memory.add("b", axis(1))
+    memory.add("c", axis(2))
+    memory.add("давнее снова", axis(0))
+    assert len(memory.memories) == 4
+    assert memory.deduplicated == 0
+
+
+def test_pinned_and_summaries_are_never_merged(embedder):
+    memory = store(embedder, dedup_threshold=0.95)
+    memory.add("a", axis(0))
+    memory.add("a pinned", axis(0), pinned=True)
+    memory.add("a summary", axis(0), level=GAME_SUMMARY)
+    assert len(memory.memories) == 3
@@ -0,0 +1,146 @@
+import pytest
+
+from agent import Agent
+from relationship_graph import RelationshipGraph
+
+
+def make_agents(*names):
+    return {a.id: a for a in (Agent(name, "спокойный", {}) for name in names)}
+
+
+@pytest.fixture
+def trio():
+    agents = make_agents("Анна", "Борис", "Вера")
+    graph = RelationshipGraph()
+    for agent in agents.values():
+        graph.add_agent(agent)
+    return graph, list(agents.values())
+
+
+def edges(result):
+    return {(e["from"], e["to"]): e["value"] for e in result["edges"]}
+
+
+def test_delta_returns_only_changes_since_version(trio):
+    graph, (anna, boris, vera) = trio
+    anna.update_relationship(boris.id, 0.2)
+    since = graph.version
+    boris.update_relationship(vera.id, -0.35)
+    vera.update_mood(0.5)
+
+    delta = graph.delta(since, graph.epoch)
+    assert not delta["full"]
+    assert delta["version"] == graph.version
+    assert edges(delta) == {(boris.id, vera.id): -35}
+    assert [n["id"] for n in delta["nodes"]] == [vera.id]
+    assert delta["removed"] == []
+    assert graph.delta(graph.version, graph.epoch)["edges"] == []
+
+
+def test_delta_reports_removed_and_returning_agents(trio):
+    graph, (anna, boris, vera) = trio
+    anna.update_relationship(vera.id, 0.4)
+    since = graph.version
+    graph.set_active([anna.id, boris.id])
+    delta = graph.delta(since)
+    assert delta["removed"] == [vera.id]
+    assert edges(delta) == {}
+    assert vera.id not in {n["id"] for n in graph.snapshot()["nodes"]}
+    assert vera.id in {n["id"] for n in graph.snapshot(include_excluded=True)["nodes"]}
+
+    since = graph.version
+    graph.set_active([anna.id, boris.id, vera.id])
+    delta = graph.delta(since)
+    # Вернувшийся агент отдаётся заново вместе со своими рёбрами
+    assert [n["id"] for n in delta["nodes"]] == [vera.id]
+    assert edges(delta) == {(anna.id, vera.id): 40}
+
+
+@pytest.mark.parametrize("since, epoch", [(0, "другой"), (10 ** 6, None), (-1, None)])
+def test_delta_falls_back_to_full_graph(trio, since, epoch):
+    graph, (anna, boris, _) = trio
+    anna.update_relationship(boris.id, 0.1)
+    delta = graph.delta(since, epoch)
+    assert delta["full"]
+    assert len(delta["nodes"]) == 3
+    assert edges(delta) == {(anna.id, boris.id): 10}
+
+
+def test_etag_changes_only_on_real_changes(trio):
+    graph, (anna, boris, _) = trio
+    etag = graph.etag
+    body = graph.snapshot_json()
+    graph.set_active([a for a in graph._ids])
+    graph.mood_changed(anna)
+    assert graph.etag == etag
+    assert graph.snapshot_json() is body
+
+    anna.update_relationship(boris.id, 0.3)
+    assert graph.etag != etag
+    etag = graph.etag
+    # То же значение повторно не считается изменением
+    graph.relationship_changed(anna, boris.id, anna.relationships[boris.id])
+    assert graph.etag == etag
+
+
+def test_graph_built_from_agents_and_epoch_differs():
+    agents = make_agents("Анна", "Борис")
+    anna, boris = agents.values()
+    anna.relationships[boris.id] = -0.5
+    first = RelationshipGraph(agents, active=[anna.id])
+    assert edges(first.snapshot(include_excluded=True)) == {(anna.id, boris.id): -50}
+    assert [n["id"] for n in first.snapshot()["nodes"]] == [anna.id]
+    second = RelationshipGraph(agents)
+    assert second.epoch != first.epoch
+    assert second.delta(first.version, first.epoch)["full"]
+
+
+def create_game(client, game_id):
+    assert client.post("/games", json={"game_id": game_id}).status_code == 200
+    return f"/games/{game_id}"
+
+
+def create_agent(client, prefix, name):
+    response = client.post(f"{prefix}/agents", json={"name": name, "personality": "спокойный", "bunker_params": {}})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_graph_endpoint_etag_and_delta(client):
+    prefix = create_game(client, "test-graph")
+    anna = create_agent(client, prefix, "Анна")
+    boris = create_agent(client, prefix, "Борис")
+
+    first = client.get(f"{prefix}/relationships/graph")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert len(first.json()["nodes"]) == 2
+    cached = client.get(f"{prefix}/relationships/graph", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    delta = client.get(f"{prefix}/relationships/graph/delta", params={"since": 0}).json()
+    version, epoch = delta["version"], delta["epoch"]
+    client.post(f"{prefix}/vote", json={"round": 1, "votes": {anna: boris, boris: anna},
+                                         "excluded_id": boris, "alive_agents": [anna]})
+    changed = client.get(f"{prefix}/relationships/graph", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+    delta = client.get(f"{prefix}/relationships/graph/delta", params={"since": version, "epoch": epoch}).json()
+    assert not delta["full"]
+    assert delta["removed"] == [boris]
+
+
+def test_agents_endpoint_etag(client):
+    prefix = create_game(client, "test-agents")
+    agent_id = create_agent(client, prefix, "Анна")
+    listing = client.get(f"{prefix}/agents")
+    etag = listing.headers["etag"]
+    assert client.get(f"{prefix}/agents", headers={"If-None-Match": etag}).status_code == 304
+
+    detail = client.get(f"{prefix}/agents/{agent_id}")
+    assert client.get(f"{prefix}/agents/{agent_id}", headers={"If-None-Match": detail.headers["etag"]}).status_code == 304
+
+    create_agent(client, prefix, "Борис")
+    assert client.get(f"{prefix}/agents", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from limiter import LoadShedError
+from scheduler import BackgroundScheduler
+
+
+async def drain(scheduler: BackgroundScheduler, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while scheduler.stats()["pending"] or scheduler.stats()["running"]:
+        assert loop.time() < deadline, "background queue did not drain"
+        await asyncio.sleep(0.01)
+
+
+def recorder(ran: list, value):
+    async def job():
+        ran.append(value)
+    return job
+
+
+def accounted(stats) -> bool:
+    return stats["submitted"] == (stats["completed"] + stats["coalesced"] + stats["dropped"]
+                                  + stats["failed"] + stats["shed"])
+
+
+@pytest.mark.asyncio
+async def test_pending_jobs_with_same_key_coalesce_to_latest():
+    scheduler = BackgroundScheduler(workers=1)
+    ran = []
+    for i in range(5):
+        scheduler.submit("plan", recorder(ran, i))
+    scheduler.start()
+    await drain(scheduler)
+    await scheduler.stop()
+    assert ran == [4]
+    stats = scheduler.stats()
+    assert stats["coalesced"] == 4
+    assert accounted(stats)
+
+
+@pytest.mark.asyncio
+async def test_job_replaced_during_foreground_wait_counts_as_coalesced():
+    scheduler = BackgroundScheduler(workers=1, max_defer=5.0)
+    ran = []
+    scheduler.start()
+    async with scheduler.foreground():
+        scheduler.submit("plan", recorder(ran, "old"))
+        await asyncio.sleep(0.05)  # воркер взял задачу и ждёт окончания foreground-запроса
+        scheduler.submit("plan", recorder(ran, "new"))
+    await drain(scheduler)
+    await scheduler.stop()
+    assert ran == ["new"]
+    stats = scheduler.stats()
+    assert stats["coalesced"] == 1
+    assert accounted(stats)
+
+
+@pytest.mark.asyncio
+async def test_same_key_never_runs_in_parallel():
+    scheduler = BackgroundScheduler(workers=4)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    scheduler.start()
+    for _ in range(3):
+        scheduler.submit("summarize", job)
+        await asyncio.sleep(0.005)
+    await drain(scheduler)
+    await scheduler.stop()
+    assert peak == 1
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_oldest_and_failures_are_counted():
+    scheduler = BackgroundScheduler(workers=1, max_pending=2)
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def shed():
+        raise LoadShedError("busy")
+
+    scheduler.submit("a", fail)
+    scheduler.submit("b", shed)
+    scheduler.submit("c", recorder([], "c"))
+    scheduler.start()
+    await drain(scheduler)
+    await scheduler.stop()
+    stats = scheduler.stats()
+    assert (stats["dropped"], stats["shed"], stats["completed"], stats["failed"]) == (1, 1, 1, 0)
+    assert accounted(stats)
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from agent import Agent
+from embeddings import create_embedding_backend
+from memory import MemoryStore
+from persistence import JSONStorage
+from session import SessionManager
+from state_backend import LocalStateBackend
+
+
+def manager(tmp_path, backend="json", state=None) -> SessionManager:
+    return SessionManager(backend, str(tmp_path / "games"), "default", str(tmp_path / "agents_state.json"),
+                          str(tmp_path / "history.jsonl"), str(tmp_path / "agents.db"), state=state)
+
+
+@pytest.mark.asyncio
+async def test_save_during_load_makes_session_stale(tmp_path, monkeypatch):
+    state = LocalStateBackend()
+    sessions = manager(tmp_path, state=state)
+    load_history = JSONStorage.load_history
+    loads = []
+
+    def racing_load_history(storage):
+        # Другой воркер сохраняет игру, пока эта ещё читается
+        if not loads:
+            state.bump_version("default")
+        loads.append(True)
+        return load_history(storage)
+
+    monkeypatch.setattr(JSONStorage, "load_history", racing_load_history)
+    session = sessions.get("default")
+    assert session.version == 0
+    async with sessions.lease(session):
+        assert len(loads) == 2
+        assert session.version == 1
+
+
+def test_embedding_mismatches_do_not_load_games(tmp_path):
+    writer = manager(tmp_path, backend="sqlite")
+    session = writer.create("old-model")
+    agent = Agent("Анна", "спокойная", {})
+    agent.memory = MemoryStore(embedder=create_embedding_backend("hashing", "", 16))
+    agent.memory.add("запомнила бункер")
+    session.add_agent(agent)
+    session.save()
+    writer.create("empty")
+
+    reader = manager(tmp_path, backend="sqlite")
+    embedder = create_embedding_backend("hashing", "", 32)
+    mismatches = reader.embedding_mismatches(embedder)
+    assert list(mismatches) == ["old-model"]
+    assert mismatches["old-model"] == [create_embedding_backend("hashing", "", 16).tag]
+    assert reader.loaded() == []
+    assert writer.embedding_mismatches(create_embedding_backend("hashing", "", 16)) == {}
+
+
+def test_plan_update_releases_lease_during_llm_call(client, monkeypatch):
+    import main
+
+    assert client.post("/games", json={"game_id": "plans"}).status_code == 200
+    agent_id = client.post("/games/plans/agents", json={"name": "Анна", "personality": "спокойная",
+                                                         "bunker_params": {}}).json()["id"]
+    generate = main.model_manager.generate_with_fallback
+    held = []
+
+    async def watching_generate(task, prompt, system_message="", **kwargs):
+        if task == "plan":
+            # Запрос шага и суммаризация могут ещё держать аренду — дожидаемся, пока её не отпустят все
+            for _ in range(100):
+                if not main.sessions._holds["plans"]:
+                    break
+                await asyncio.sleep(0.01)
+            held.append(main.sessions._holds["plans"])
+        return await generate(task, prompt, system_message, **kwargs)
+
+    monkeypatch.setattr(main.model_manager, "generate_with_fallback", watching_generate)
+    step = client.post(f"/games/plans/agents/{agent_id}/step",
+                       json={"context": {"game_state": {"round": 1, "alive_agents": [agent_id]}}})
+    assert step.status_code == 200
+    for _ in range(200):
+        plans = client.get(f"/games/plans/agents/{agent_id}").json()["plans"]
+        if plans:
+            break
+        time.sleep(0.01)
+    assert len(plans) == 1
+    # Во время вызова LLM игра не арендована: запросы других воркеров не ждут фоновый план
+    assert held == [0]
@@ -0,0 +1,59 @@
+import pytest
+
+from ModelManager import ModelManager
+from agent import Agent
+from embeddings import create_embedding_backend
+from memory import MemoryStore, RAW, ROUND_SUMMARY
+from summarizer import Summarizer
+
+TASK_MODELS = {"response": ["fake-a"], "summarize": ["fake-a", "fake-b"]}
+
+
+def make_agent(name: str, n: int = 12) -> Agent:
+    memory = MemoryStore(embedder=create_embedding_backend("hashing", "", 16), max_memories=None,
+                         dedup_threshold=None)
+    for i in range(n):
+        memory.add(f"{name}: раунд {i}, обсуждали запасы воды и кто полезнее в бункере")
+    agent = Agent(name, "спокойный", {})
+    agent.memory = memory
+    return agent
+
+
+def model_manager(failing=()) -> ModelManager:
+    return ModelManager(TASK_MODELS, ["key"], backend="fake",
+                        client_options={"latency": 0, "rate_limit_latency": 0, "failing_models": list(failing)})
+
+
+def agents_by_id(*agents):
+    return {a.id: a for a in agents}
+
+
+@pytest.mark.asyncio
+async def test_memories_are_folded_into_round_summary():
+    agents = agents_by_id(make_agent("Анна"), make_agent("Борис"))
+    summarizer = Summarizer(model_manager(), raw_budget=50, keep_recent=3)
+    assert await summarizer.run(lambda: agents) == 18
+    for agent in agents.values():
+        levels = [m['level'] for m in agent.memory.memories]
+        assert levels.count(ROUND_SUMMARY) == 1
+        assert levels.count(RAW) == 3
+        assert not agent.summarizing
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("n_agents", [1, 2])
+async def test_failed_models_keep_memories(n_agents):
+    agents = agents_by_id(*(make_agent(f"Агент {i}") for i in range(n_agents)))
+    before = {aid: [m['id'] for m in a.memory.memories] for aid, a in agents.items()}
+    summarizer = Summarizer(model_manager(failing=TASK_MODELS["summarize"]), raw_budget=50, keep_recent=3)
+    committed = []
+    assert await summarizer.run(lambda: agents, commit=lambda: committed.append(True)) == 0
+    assert committed == []
+    assert summarizer.stats()["failed"] == n_agents
+    for aid, agent in agents.items():
+        # Заглушка не стала сводкой, воспоминания остались для следующего запуска
+        assert [m['id'] for m in agent.memory.memories] == before[aid]
+        assert not agent.summarizing
+
+    summarizer.model_manager = model_manager()
+    assert await summarizer.run(lambda: agents) == 9 * n_agents
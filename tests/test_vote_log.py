@@ -0,0 +1,54 @@
+import pytest
+
+from vote_log import VoteLog
+
+
+@pytest.fixture
+def log():
+    return VoteLog([
+        {"round": 1, "votes": {"a": "c", "b": "c", "c": "a"}, "excluded_id": "c"},
+        {"round": 2, "votes": {"a": "b", "b": "a"}, "excluded_id": ""},
+        {"round": 3, "votes": {"a": "b"}, "excluded_id": "b"},
+    ])
+
+
+def test_query_without_filters_pages_in_append_order(log):
+    total, page = log.query(offset=1, limit=1)
+    assert total == 3
+    assert [r["round"] for r in page] == [2]
+
+
+def test_query_by_voter_candidate_and_round_intersects(log):
+    assert [r["round"] for r in log.query(voter="a")[1]] == [1, 2, 3]
+    assert [r["round"] for r in log.query(candidate="b")[1]] == [2, 3]
+    total, page = log.query(voter="a", candidate="b", round_from=3)
+    assert total == 1
+    assert page[0]["round"] == 3
+    assert log.query(round_from=2, round_to=2)[0] == 1
+    assert log.query(voter="nobody") == (0, [])
+
+
+def test_candidate_index_has_one_entry_per_record():
+    log = VoteLog([{"round": 1, "votes": {"a": "c", "b": "c"}, "excluded_id": "c"}])
+    assert log.query(candidate="c")[0] == 1
+
+
+def test_agent_stats(log):
+    a = log.agent_stats("a")
+    assert a["votes_cast"] == 3
+    assert a["aligned_votes"] == 2
+    assert a["voting_alignment"] == pytest.approx(2 / 3)
+    assert log.agent_stats("b")["times_voted_against"] == 2
+    assert log.agent_stats("c")["times_excluded"] == 1
+    assert log.agent_stats("unknown") == {"votes_cast": 0, "aligned_votes": 0, "times_voted_against": 0,
+                                          "times_excluded": 0, "voting_alignment": 0.0}
+
+
+def test_version_changes_on_append_and_clear(log):
+    version = log.version
+    log.append({"round": 4, "votes": {}, "excluded_id": ""})
+    assert log.version == version + 1
+    log.clear()
+    assert log.version == version + 2
+    assert len(log) == 0
+    assert log.all_stats() == {}
@@ -0,0 +1,266 @@
+import asyncio
+import contextvars
+import functools
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# Трассировка выключена, пока запрос не попросил её заголовком: без активной трассы span() — один get() у contextvar
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("trace_span", default=None)
+
+TIMING = "timing"
+CHROME = "chrome"
+PROFILE = "profile"
+MODES = (TIMING, CHROME, PROFILE)
+
+
+def parse_modes(header: Optional[str]) -> List[str]:
+    """Режимы из заголовка запроса: "1"/"timing", "chrome", "profile" (через запятую)"""
+    if not header:
+        return []
+    modes = []
+    for part in header.lower().split(","):
+        part = part.strip()
+        if part in ("1", "true", "on"):
+            part = TIMING
+        if part in MODES and part not in modes:
+            modes.append(part)
+    return modes
+
+
+def allowed_modes(modes: List[str], token: Optional[str], expected: str) -> List[str]:
+    """Режимы, доступные запросу: без верного токена chrome и profile сводятся к Server-Timing"""
+    if not modes or (expected and token and hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))):
+        return modes
+    return [TIMING]
+
+
+def prune(directory: str, keep: int):
+    """Удалить самые старые файлы трасс и профилей сверх keep"""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.endswith((".trace.json", ".folded"))]
+    except FileNotFoundError:
+        return
+    if len(paths) <= keep:
+        return
+    paths.sort(key=lambda path: os.path.getmtime(path))
+    for path in paths[:len(paths) - keep]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _lane() -> str:
+    """Дорожка для Chrome-трассы: задача asyncio в потоке event loop или поток пула"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return f"task-{id(task)}"
+    return f"thread-{threading.get_ident()}"
+
+
+class Trace:
+    """Спаны одного запроса: имя, начало, конец, родитель, дорожка и атрибуты."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.origin = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float, parent: Optional[int] = None,
+            lane: Optional[str] = None, **attrs) -> int:
+        with self._lock:
+            self.spans.append({"name": name, "start": start, "end": end, "parent": parent,
+                               "lane": lane or _lane(), "attrs": attrs})
+            return len(self.spans) - 1
+
+    def open(self, name: str, parent: Optional[int], **attrs) -> int:
+        return self.add(name, time.perf_counter(), 0.0, parent, **attrs)
+
+    def close(self, index: int):
+        self.spans[index]["end"] = time.perf_counter()
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """Суммарное время и число спанов по имени (вложенные спаны входят и в родителя)"""
+        totals: Dict[str, Dict[str, float]] = defaultdict(lambda: {"ms": 0.0, "count": 0})
+        for s in list(self.spans):
+            if s["end"]:
+                totals[s["name"]]["ms"] += (s["end"] - s["start"]) * 1000
+                totals[s["name"]]["count"] += 1
+        return dict(totals)
+
+    def server_timing(self) -> str:
+        """Заголовок Server-Timing: по записи на имя спана, число вызовов в desc"""
+        return ", ".join(f'{name};dur={t["ms"]:.2f};desc="x{int(t["count"])}"'
+                         for name, t in sorted(self.breakdown().items(), key=lambda item: -item[1]["ms"]))
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Трасса в формате Chrome Trace Event (chrome://tracing, Perfetto)"""
+        lanes: Dict[str, int] = {}
+        events = []
+        pid = os.getpid()
+        for s in list(self.spans):
+            if not s["end"]:
+                continue
+            tid = lanes.setdefault(s["lane"], len(lanes) + 1)
+            events.append({
+                "name": s["name"], "ph": "X", "pid": pid, "tid": tid,
+                "ts": round((s["start"] - self.origin) * 1e6, 1),
+                "dur": round((s["end"] - s["start"]) * 1e6, 1),
+                "args": {k: str(v) for k, v in s["attrs"].items()},
+            })
+        for lane, tid in lanes.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane}})
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id,
+                                                                               "name": self.name}}
+
+    def write_chrome(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.trace_id}.trace.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False)
+        return path
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None):
+    """Включить трассировку для текущего контекста (запроса); корневой спан — request"""
+    trace = Trace(name, trace_id)
+    trace_token = _current_trace.set(trace)
+    root = trace.open("request", None, path=name)
+    span_token = _current_span.set(root)
+    try:
+        yield trace
+    finally:
+        trace.close(root)
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Спан внутри активной трассы; без трассы ничего не делает"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    index = trace.open(name, _current_span.get(), **attrs)
+    token = _current_span.set(index)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        trace.close(index)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции (обычной или async) оборачивается в спан name"""
+
+    def decorator(func: Callable):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_trace.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+async def run_in_executor(func: Callable, *args):
+    """
+    run_in_executor пула по умолчанию, переносящий трассу в поток: ожидание свободного потока
+    записывается спаном executor.queue, сама работа — спанами внутри func.
+    """
+    loop = asyncio.get_running_loop()
+    trace = _current_trace.get()
+    if trace is None:
+        return await loop.run_in_executor(None, func, *args)
+    context = contextvars.copy_context()
+    parent = _current_span.get()
+    submitted = time.perf_counter()
+
+    def call():
+        trace.add("executor.queue", submitted, time.perf_counter(), parent, func=getattr(func, "__qualname__", ""))
+        return context.run(func, *args)
+
+    return await loop.run_in_executor(None, call)
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профайлер: фоновый поток раз в interval секунд снимает стеки всех потоков процесса
+    (event loop и пул потоков) и считает одинаковые стеки. Результат — формат collapsed stacks
+    (flamegraph.pl, speedscope). Параллельные запросы тоже попадают в выборку.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def write(self, directory: str, name: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
@@ -0,0 +1,102 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Iterable, Tuple, Any
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {"votes_cast": 0, "aligned_votes": 0, "times_voted_against": 0, "times_excluded": 0}
+
+
+class VoteLog:
+    """
+    История голосований в памяти с индексами по раунду, голосующему и кандидату.
+    Записи только дописываются; агрегаты по агентам пересчитываются инкрементально при добавлении.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = ()):
+        self.records: List[Dict[str, Any]] = []
+        self._by_round: Dict[int, List[int]] = defaultdict(list)
+        self._by_voter: Dict[str, List[int]] = defaultdict(list)
+        self._by_candidate: Dict[str, List[int]] = defaultdict(list)
+        self._stats: Dict[str, Dict[str, Any]] = defaultdict(_empty_stats)
+        # Растёт при каждом изменении (в том числе при очистке) — для ETag истории
+        self.version = 0
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Добавить запись голосования и обновить индексы и агрегаты"""
+        idx = len(self.records)
+        self.records.append(record)
+        self.version += 1
+        self._by_round[record["round"]].append(idx)
+
+        excluded_id = record.get("excluded_id")
+        for voter, candidate in record.get("votes", {}).items():
+            self._by_voter[voter].append(idx)
+            if not self._by_candidate[candidate] or self._by_candidate[candidate][-1] != idx:
+                self._by_candidate[candidate].append(idx)
+            voter_stats = self._stats[voter]
+            voter_stats["votes_cast"] += 1
+            if candidate == excluded_id:
+                voter_stats["aligned_votes"] += 1
+            self._stats[candidate]["times_voted_against"] += 1
+        if excluded_id:
+            self._stats[excluded_id]["times_excluded"] += 1
+        return record
+
+    def query(self,
+              round_from: Optional[int] = None,
+              round_to: Optional[int] = None,
+              voter: Optional[str] = None,
+              candidate: Optional[str] = None,
+              offset: int = 0,
+              limit: int = 100) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Отфильтрованная страница истории в порядке добавления.
+        Возвращает (общее число подходящих записей, записи страницы).
+        """
+        candidates: Optional[set] = None
+
+        def narrow(indices: Iterable[int]):
+            nonlocal candidates
+            indices = set(indices)
+            candidates = indices if candidates is None else candidates & indices
+
+        if voter is not None:
+            narrow(self._by_voter.get(voter, ()))
+        if candidate is not None:
+            narrow(self._by_candidate.get(candidate, ()))
+        if round_from is not None or round_to is not None:
+            lo = round_from if round_from is not None else float("-inf")
+            hi = round_to if round_to is not None else float("inf")
+            narrow(i for rnd, idxs in self._by_round.items() if lo <= rnd <= hi for i in idxs)
+
+        if candidates is None:
+            total = len(self.records)
+            page = self.records[offset:offset + limit]
+        else:
+            ordered = sorted(candidates)
+            total = len(ordered)
+            page = [self.records[i] for i in ordered[offset:offset + limit]]
+        return total, page
+
+    def agent_stats(self, agent_id: str) -> Dict[str, Any]:
+        """Агрегаты по агенту: сколько раз голосовал, сколько голосов получил, доля голосов «с большинством»"""
+        stats = dict(self._stats.get(agent_id) or _empty_stats())
+        cast = stats["votes_cast"]
+        stats["voting_alignment"] = stats["aligned_votes"] / cast if cast else 0.0
+        return stats
+
+    def all_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {agent_id: self.agent_stats(agent_id) for agent_id in self._stats}
+
+    def clear(self):
+        self.records.clear()
+        self._by_round.clear()
+        self._by_voter.clear()
+        self._by_candidate.clear()
+        self._stats.clear()
+        self.version += 1